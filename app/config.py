@@ -1,58 +1,876 @@
 """
 Конфигурация для WAN2.2 API Gateway
+
+Настройки описаны моделью pydantic Settings и проверяются один раз при
+загрузке: значения берутся из переменных окружения, а файл CONFIG_FILE
+(TOML) переопределяет их по секциям:
+
+    timeout = 300
+
+    [text]
+    max_concurrency = 64
+    timeout = 60
+
+    [http]
+    max_connections = 200
+
+Некорректное значение останавливает запуск с понятной ошибкой.
+Файл можно перечитать на ходу (SIGHUP или изменение файла,
+app.services.config_reload): новые настройки подменяются целиком,
+уже идущие запросы не прерываются. Функции get_*() читают текущие
+настройки при каждом вызове.
 """
 
 import os
-from typing import Optional
+import tomllib
+from typing import Annotated, Any, Dict, List, Literal, Optional, Tuple
+
+from pydantic import BaseModel, BeforeValidator, ConfigDict, Field, ValidationError, field_validator
+
+# Файл настроек (TOML); его значения переопределяют переменные окружения
+CONFIG_FILE = os.getenv("CONFIG_FILE", "")
+# Как часто проверять изменение файла настроек (в секундах, 0 — только по SIGHUP)
+CONFIG_WATCH_INTERVAL = float(os.getenv("CONFIG_WATCH_INTERVAL", "5"))
+
+
+def env(name: str, default: Optional[str] = None, **constraints: Any) -> Any:
+    """Поле настроек со значением по умолчанию из переменной окружения name"""
+    return Field(default_factory=lambda: os.getenv(name, default), validate_default=True, **constraints)
+
+
+def _lower(value: Any) -> Any:
+    return value.lower() if isinstance(value, str) else value
+
+
+def _upper(value: Any) -> Any:
+    return value.upper() if isinstance(value, str) else value
+
+
+class Section(BaseModel):
+    """Секция настроек: неизвестные поля — ошибка (опечатка в файле), значения не меняются"""
+
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
+
+def parse_backends(value: str) -> List[Tuple[str, int]]:
+    """
+    Разбирает список апстримов "url[|вес]" через запятую
+
+    Raises:
+        ValueError: вес не положительное целое число
+    """
+    backends = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        url, _, weight = item.partition("|")
+        weight = int(weight) if weight else 1
+        if weight < 1:
+            raise ValueError(f"Вес апстрима должен быть положительным: {item!r}")
+        backends.append((url.strip().rstrip("/"), weight))
+    return backends
+
+
+# Классы приоритета клиентов API (app/services/clients.py)
+PRIORITY_CLASS_NAMES = ("batch", "standard", "interactive")
+
+
+def parse_api_clients(value: str) -> Dict[str, Tuple[str, float, str]]:
+    """
+    Разбирает список клиентов API "ключ=имя[:вес[:класс]]" через запятую
+
+    Returns:
+        ключ -> (имя, вес, максимальный класс приоритета)
+
+    Raises:
+        ValueError: вес не число или неизвестный класс приоритета
+    """
+    clients: Dict[str, Tuple[str, float, str]] = {}
+    for item in value.split(","):
+        key, separator, spec = item.strip().partition("=")
+        if not separator or not key:
+            continue
+        fields = spec.split(":")
+        name = fields[0].strip() or key
+        try:
+            weight = float(fields[1]) if len(fields) > 1 and fields[1].strip() else 1.0
+        except ValueError:
+            raise ValueError(f"Вес клиента должен быть числом: {item.strip()!r}") from None
+        max_class = fields[2].strip().lower() if len(fields) > 2 and fields[2].strip() else "interactive"
+        if max_class not in PRIORITY_CLASS_NAMES:
+            raise ValueError(f"Неизвестный класс приоритета клиента: {item.strip()!r}")
+        clients[key] = (name, max(weight, 0.01), max_class)
+    return clients
+
+
+class UpstreamSettings(Section):
+    """Апстримы WAN2.2 API: балансировка, таймауты фаз, повторы и микро-батчинг"""
+
+    api_url: str = env("WAN_API_URL", "http://127.0.0.1:8000")
+    # Несколько апстримов через запятую, вес через "|": "http://gpu1:8000|2,http://gpu2:8000"
+    api_urls: Optional[str] = env("WAN_API_URLS")
+    # Балансировка между апстримами
+    lb_strategy: Annotated[
+        Literal["round_robin", "least_outstanding", "ewma"], BeforeValidator(_lower)
+    ] = env("WAN_LB_STRATEGY", "round_robin")
+    # Активные проверки здоровья апстримов (0 — отключены)
+    health_interval: float = env("BACKEND_HEALTH_INTERVAL", "10", ge=0)
+    health_path: str = env("BACKEND_HEALTH_PATH", "/health")
+    health_timeout: float = env("BACKEND_HEALTH_TIMEOUT", "2", gt=0)
+    # После скольких ошибок подряд апстрим исключается из ротации
+    max_failures: int = env("BACKEND_MAX_FAILURES", "3", ge=1)
+    # Таймауты фаз HTTP запроса: установка соединения, отправка тела
+    # и ожидание свободного соединения пула (чтение ответа — таймаут типа генерации)
+    connect_timeout: float = env("WAN_CONNECT_TIMEOUT", "5", gt=0)
+    write_timeout: float = env("WAN_WRITE_TIMEOUT", "30", gt=0)
+    pool_timeout: float = env("WAN_POOL_TIMEOUT", "10", gt=0)
+    # Повторы при обрыве соединения и 502/503/504
+    retries: int = env("UPSTREAM_RETRIES", "2", ge=0)
+    # Пауза перед повтором: случайная от 0 до min(BACKOFF_MAX, BACKOFF * 2^попытка) секунд
+    retry_backoff: float = env("UPSTREAM_RETRY_BACKOFF", "0.1", ge=0)
+    retry_backoff_max: float = env("UPSTREAM_RETRY_BACKOFF_MAX", "2", ge=0)
+    # Бюджет повторов: в окне RETRY_BUDGET_WINDOW секунд повторов и hedged запросов
+    # не больше RETRY_BUDGET_RATIO от числа запросов плюс RETRY_BUDGET_MIN
+    retry_budget_ratio: float = env("UPSTREAM_RETRY_BUDGET_RATIO", "0.1", ge=0)
+    retry_budget_min: int = env("UPSTREAM_RETRY_BUDGET_MIN", "10", ge=0)
+    retry_budget_window: float = env("UPSTREAM_RETRY_BUDGET_WINDOW", "10", gt=0)
+    # Hedged запросы: endpoints апстрима через запятую (пусто — отключены)
+    hedge_endpoints: str = env("UPSTREAM_HEDGE_ENDPOINTS", "")
+    hedge_quantile: float = env("UPSTREAM_HEDGE_QUANTILE", "0.95", gt=0, le=1)
+    # Задержка hedged запроса не меньше этой (в секундах)
+    hedge_min_delay: float = env("UPSTREAM_HEDGE_MIN_DELAY", "0.05", ge=0)
+    # Размер блока при потоковом чтении ответа апстрима
+    chunk_size: int = env("UPSTREAM_CHUNK_SIZE", "65536", ge=1)
+    # Микро-батчинг запросов текста и изображений: одновременные запросы
+    # собираются в один вызов {endpoint}/batch (апстрим должен его поддерживать)
+    batch_enabled: bool = env("WAN_BATCH_ENABLED", "false")
+    batch_max_size: int = env("WAN_BATCH_MAX_SIZE", "8", ge=1)
+    # Сколько ждать добора пакета после первого запроса (в секундах)
+    batch_max_delay: float = env("WAN_BATCH_MAX_DELAY", "0.01", ge=0)
+
+    @field_validator("api_urls")
+    @classmethod
+    def _check_api_urls(cls, value: Optional[str]) -> Optional[str]:
+        if value:
+            parse_backends(value)
+        return value
+
+
+class HTTPSettings(Section):
+    """Пул HTTP соединений к WAN2.2 API"""
+
+    max_connections: int = env("HTTP_MAX_CONNECTIONS", "100", ge=1)
+    max_keepalive_connections: int = env("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20", ge=0)
+    keepalive_expiry: float = env("HTTP_KEEPALIVE_EXPIRY", "30", ge=0)
+    http2: bool = env("HTTP2_ENABLED", "false")
+
+
+class BreakerSettings(Section):
+    """
+    Circuit breaker для апстримов: после превышения доли ошибок или медленных
+    ответов в окне запросы отклоняются сразу, без ожидания таймаута
+    """
+
+    enabled: bool = env("BREAKER_ENABLED", "true")
+    window: float = env("BREAKER_WINDOW", "60", gt=0)
+    # Минимум запросов в окне, прежде чем breaker может открыться
+    min_requests: int = env("BREAKER_MIN_REQUESTS", "5", ge=1)
+    error_rate: float = env("BREAKER_ERROR_RATE", "0.5", gt=0, le=1)
+    # Ответ дольше этого считается медленным
+    slow_call_seconds: float = env("BREAKER_SLOW_CALL_SECONDS", "120", gt=0)
+    slow_call_rate: float = env("BREAKER_SLOW_CALL_RATE", "0.8", gt=0, le=1)
+    # Сколько breaker остается открытым перед пробными запросами
+    open_seconds: float = env("BREAKER_OPEN_SECONDS", "30", ge=0)
+    half_open_max_calls: int = env("BREAKER_HALF_OPEN_MAX_CALLS", "1", ge=1)
+
+
+class TextSettings(Section):
+    """
+    Генерация текста: сколько запросов выполняются одновременно, сколько
+    ждут в очереди и как долго, таймаут запроса (по умолчанию WAN_TIMEOUT)
+    """
+
+    max_concurrency: int = env("TEXT_MAX_CONCURRENCY", "32", ge=1)
+    max_queue: int = env("TEXT_MAX_QUEUE", "100", ge=0)
+    max_wait: float = env("TEXT_MAX_WAIT", "10", gt=0)
+    timeout: Optional[int] = env("WAN_TEXT_TIMEOUT", gt=0)
+
+
+class ImageSettings(Section):
+    """Генерация изображений: лимиты как у текста и формат результата"""
+
+    max_concurrency: int = env("IMAGE_MAX_CONCURRENCY", "4", ge=1)
+    max_queue: int = env("IMAGE_MAX_QUEUE", "50", ge=0)
+    max_wait: float = env("IMAGE_MAX_WAIT", "60", gt=0)
+    timeout: Optional[int] = env("WAN_IMAGE_TIMEOUT", gt=0)
+    # Результат по умолчанию: inline — JSON апстрима как есть,
+    # artifact — base64 изображения декодируются в файлы ARTIFACT_DIR, в ответе ссылки,
+    # stream — тело ответа апстрима передается клиенту по частям без разбора
+    output: Annotated[Literal["inline", "artifact", "stream"], BeforeValidator(_lower)] = env("IMAGE_OUTPUT", "inline")
+    # В режиме artifact строки короче этого (в байтах) остаются в ответе как есть
+    artifact_min_bytes: int = env("IMAGE_ARTIFACT_MIN_BYTES", "65536", ge=0)
+
+
+class VideoSettings(Section):
+    """
+    Генерация видео: исполнители и очередь заданий, пакеты,
+    локальный скрипт generate.py и резидентные воркеры
+    """
+
+    max_concurrency: int = env("VIDEO_MAX_CONCURRENCY", os.getenv("JOB_WORKERS", "1"), ge=1)
+    max_queue: int = env("VIDEO_MAX_QUEUE", os.getenv("JOB_QUEUE_SIZE", "100"), ge=0)
+    max_wait: float = env("VIDEO_MAX_WAIT", "3600", gt=0)
+    timeout: Optional[int] = env("WAN_VIDEO_TIMEOUT", gt=0)
+    # Пакетная обработка совместимых заданий на резидентных воркерах:
+    # сколько заданий в пакете и сколько ждать добора пакета (в секундах)
+    batch_max_size: int = env("VIDEO_BATCH_MAX_SIZE", "4", ge=1)
+    batch_max_delay: float = env("VIDEO_BATCH_MAX_DELAY", "2", ge=0)
+    # Путь к скрипту generate.py (относительно текущей директории или абсолютный)
+    generate_script_path: str = env("GENERATE_SCRIPT_PATH", "../Wan2.2/generate.py")
+    python_path: str = env("WAN_PYTHON_PATH", "/venv/main/bin/python")
+    # Путь к директории с чекпоинтами
+    ckpt_dir: str = env("CKPT_DIR", "./Wan2.2-TI2V-5B")
+    # Размер видео и модель по умолчанию
+    size: str = env("VIDEO_SIZE", "1280*704")
+    task: str = env("TI2V_TASK", "ti2v-5B")
+    # "subprocess" (процесс на каждый запрос) или "resident" (пул прогретых воркеров)
+    worker_mode: Annotated[Literal["subprocess", "resident"], BeforeValidator(_lower)] = env(
+        "VIDEO_WORKER_MODE", "subprocess"
+    )
+    workers: int = env("VIDEO_WORKERS", "1", ge=1)
+    worker_script: str = env("VIDEO_WORKER_SCRIPT", "workers/wan_worker.py")
+    # Объявлять ли воркеру пакетные задания (--batch): включайте, только если пайплайн
+    # воркера генерирует промпты пакета вместе, иначе пакет лишь задерживает первое задание
+    worker_batch: bool = env("VIDEO_WORKER_BATCH", "false")
+    # Сколько ждать загрузки модели в воркере
+    worker_ready_timeout: int = env("VIDEO_WORKER_READY_TIMEOUT", "900", gt=0)
+    # Сколько ждать завершения процесса генерации после SIGTERM до SIGKILL (в секундах)
+    kill_grace: float = env("VIDEO_KILL_GRACE", "10", ge=0)
+
+
+class ClientSettings(Section):
+    """Клиенты API (заголовок X-API-Key)"""
+
+    # "ключ=имя[:вес[:класс]]" через запятую
+    api_clients: str = env("API_CLIENTS", "")
+    # Какую долю очереди (текста, изображений, видео) может занять один клиент
+    max_queue_share: float = env("CLIENT_MAX_QUEUE_SHARE", "0.5", ge=0, le=1)
+    # Максимальный класс приоритета запросов без ключа и с неизвестным ключом
+    anonymous_max_class: Annotated[Literal["batch", "standard", "interactive"], BeforeValidator(_lower)] = env(
+        "CLIENT_ANONYMOUS_MAX_CLASS", "standard"
+    )
+
+    @field_validator("api_clients")
+    @classmethod
+    def _check_api_clients(cls, value: str) -> str:
+        parse_api_clients(value)
+        return value
+
+
+class JobSettings(Section):
+    """Задания генерации видео"""
+
+    # Сколько хранить завершенные задания (в секундах)
+    retention: int = env("JOB_RETENTION", "3600", gt=0)
+    # Хранилище заданий для восстановления после перезапуска
+    store: Annotated[Literal["sqlite", "memory"], BeforeValidator(_lower)] = env("JOB_STORE", "sqlite")
+    store_path: str = env("JOB_STORE_PATH", "data/jobs.db")
+    # Как часто записывать накопленные изменения заданий (в секундах)
+    store_flush_interval: float = env("JOB_STORE_FLUSH_INTERVAL", "0.5", gt=0)
+
+
+class CacheSettings(Section):
+    """Кэш результатов генерации"""
+
+    enabled: bool = env("CACHE_ENABLED", "true")
+    ttl: int = env("CACHE_TTL", "86400", gt=0)
+    memory_max_items: int = env("CACHE_MEMORY_MAX_ITEMS", "1000", ge=0)
+    memory_max_bytes: int = env("CACHE_MEMORY_MAX_BYTES", str(64 * 1024 * 1024), ge=0)
+    # Результаты больше этого размера хранятся только на диске
+    memory_item_max_bytes: int = env("CACHE_MEMORY_ITEM_MAX_BYTES", str(1024 * 1024), ge=0)
+    dir: str = env("CACHE_DIR", "cache")
+    disk_max_bytes: int = env("CACHE_DISK_MAX_BYTES", str(20 * 1024 * 1024 * 1024), ge=0)
+
+
+class ArtifactSettings(Section):
+    """Сгенерированные файлы: у каждого задания свой файл результата и временная директория"""
+
+    dir: str = env("ARTIFACT_DIR", "outputs")
+    # Квота директории результатов: при превышении удаляются самые старые файлы
+    max_bytes: int = env("ARTIFACT_MAX_BYTES", str(50 * 1024 * 1024 * 1024), ge=0)
+    # Сколько хранить файлы результатов (в секундах)
+    max_age: int = env("ARTIFACT_MAX_AGE", str(7 * 24 * 3600), gt=0)
+    # Период очистки директории результатов (в секундах, 0 — отключена)
+    janitor_interval: float = env("ARTIFACT_JANITOR_INTERVAL", "300", ge=0)
+
+
+class LogSettings(Section):
+    """Логирование: уровень, формат и размер очереди записей"""
+
+    level: Annotated[
+        Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], BeforeValidator(_upper)
+    ] = env("LOG_LEVEL", "INFO")
+    format: Annotated[Literal["text", "json"], BeforeValidator(_lower)] = env("LOG_FORMAT", "text")
+    dir: str = env("LOG_DIR", "logs")
+    # При заполненной очереди (медленный диск) новые записи отбрасываются
+    queue_size: int = env("LOG_QUEUE_SIZE", "10000", ge=1)
+
 
-# Настройки по умолчанию
-DEFAULT_WAN_API_URL = os.getenv("WAN_API_URL", "http://127.0.0.1:8000")
-DEFAULT_TIMEOUT = int(os.getenv("WAN_TIMEOUT", "300"))  # 5 минут
-DEFAULT_WAN_PYTHON_PATH = os.getenv("WAN_PYTHON_PATH", "/venv/main/bin/python")
+class Settings(Section):
+    """Все настройки шлюза"""
 
-# Настройки для генерации видео через локальный скрипт
-# Путь к скрипту generate.py (относительно текущей директории или абсолютный)
-DEFAULT_GENERATE_SCRIPT_PATH = os.getenv(
-    "GENERATE_SCRIPT_PATH", "../Wan2.2/generate.py"
+    # Таймаут запроса по умолчанию (в секундах)
+    timeout: int = env("WAN_TIMEOUT", "300", gt=0)
+    # Дедлайн запроса (X-Request-Deadline / X-Request-Timeout): отклонять
+    # сразу работу, которая по оценке не успеет завершиться до дедлайна
+    deadline_early_reject: bool = env("DEADLINE_EARLY_REJECT", "true")
+    # Объединение одновременных одинаковых запросов в одно выполнение
+    singleflight_enabled: bool = env("SINGLEFLIGHT_ENABLED", "true")
+    # Явный mock-режим: ответы генерируются локально, апстрим не вызывается
+    mock_mode: bool = env("WAN_MOCK_MODE", "false")
+    # Библиотека JSON: auto — orjson, если установлен, иначе стандартный json; orjson; stdlib
+    json_backend: Annotated[Literal["auto", "orjson", "stdlib"], BeforeValidator(_lower)] = env("JSON_BACKEND", "auto")
+    # Директория файлов метрик для нескольких worker'ов (пусто — метрики в памяти процесса)
+    metrics_multiproc_dir: str = env("METRICS_MULTIPROC_DIR", "")
+
+    upstream: UpstreamSettings = Field(default_factory=dict, validate_default=True)
+    http: HTTPSettings = Field(default_factory=dict, validate_default=True)
+    breaker: BreakerSettings = Field(default_factory=dict, validate_default=True)
+    text: TextSettings = Field(default_factory=dict, validate_default=True)
+    image: ImageSettings = Field(default_factory=dict, validate_default=True)
+    video: VideoSettings = Field(default_factory=dict, validate_default=True)
+    clients: ClientSettings = Field(default_factory=dict, validate_default=True)
+    jobs: JobSettings = Field(default_factory=dict, validate_default=True)
+    cache: CacheSettings = Field(default_factory=dict, validate_default=True)
+    artifacts: ArtifactSettings = Field(default_factory=dict, validate_default=True)
+    log: LogSettings = Field(default_factory=dict, validate_default=True)
+
+
+# Поля, которые читаются только при запуске: их изменение в файле вступает в силу после перезапуска
+RESTART_REQUIRED = (
+    "upstream.api_url",
+    "upstream.api_urls",
+    "http.http2",
+    "video.max_concurrency",
+    "video.worker_mode",
+    "video.workers",
+    "video.worker_script",
+    "video.worker_batch",
+    "video.worker_ready_timeout",
+    "jobs.store",
+    "jobs.store_path",
+    "log.format",
+    "log.dir",
+    "log.queue_size",
+    "json_backend",
+    "metrics_multiproc_dir",
 )
-# Путь к директории с чекпоинтами
-DEFAULT_CKPT_DIR = os.getenv("CKPT_DIR", "./Wan2.2-TI2V-5B")
-# Размер видео по умолчанию
-DEFAULT_VIDEO_SIZE = os.getenv("VIDEO_SIZE", "1280*704")
-# Модель по умолчанию
-DEFAULT_TASK = os.getenv("TI2V_TASK", "ti2v-5B")
+
+
+def load_settings(path: Optional[str] = None) -> Settings:
+    """
+    Читает и проверяет настройки: переменные окружения, поверх них — файл path
+    (по умолчанию CONFIG_FILE)
+
+    Raises:
+        ValueError: некорректное значение (pydantic.ValidationError) или синтаксис TOML
+        OSError: файл не читается
+    """
+    path = CONFIG_FILE if path is None else path
+    data: Dict[str, Any] = {}
+    if path:
+        with open(path, "rb") as f:
+            data = tomllib.load(f)
+    try:
+        return Settings.model_validate(data)
+    except ValidationError as e:
+        errors = "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())
+        raise ValueError(f"Некорректные настройки: {errors}") from None
+
+
+def _flatten(value: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    result = {}
+    for key, item in value.items():
+        if isinstance(item, dict):
+            result.update(_flatten(item, f"{prefix}{key}."))
+        else:
+            result[f"{prefix}{key}"] = item
+    return result
+
+
+def diff_settings(old: Settings, new: Settings) -> List[str]:
+    """Измененные поля в виде "секция.поле" """
+    before, after = _flatten(old.model_dump()), _flatten(new.model_dump())
+    return [key for key in after if before.get(key) != after[key]]
+
+
+_settings = load_settings()
+
+
+def get_settings() -> Settings:
+    """Возвращает текущие настройки"""
+    return _settings
+
+
+def replace_settings(new: Settings) -> List[str]:
+    """
+    Подменяет настройки целиком (одно присваивание, без промежуточного состояния)
+
+    Returns:
+        измененные поля
+    """
+    global _settings
+    old, _settings = _settings, new
+    return diff_settings(old, new)
+
+
+def get_config_file() -> str:
+    """Возвращает путь к файлу настроек (пусто — только переменные окружения)"""
+    return CONFIG_FILE
+
+
+def get_config_watch_interval() -> float:
+    """Возвращает период проверки изменения файла настроек"""
+    return CONFIG_WATCH_INTERVAL
 
 
 def get_wan_api_url(override: Optional[str] = None) -> str:
     """Возвращает URL для WAN API"""
-    return override or DEFAULT_WAN_API_URL
+    return override or _settings.upstream.api_url
+
+
+def get_wan_api_urls() -> List[Tuple[str, int]]:
+    """Возвращает список апстримов WAN API с весами"""
+    upstream = _settings.upstream
+    return parse_backends(upstream.api_urls or "") or [(upstream.api_url, 1)]
+
+
+def get_lb_strategy() -> str:
+    """Возвращает стратегию балансировки между апстримами"""
+    return _settings.upstream.lb_strategy
+
+
+def get_backend_health_interval() -> float:
+    """Возвращает интервал активных проверок здоровья апстримов в секундах"""
+    return _settings.upstream.health_interval
+
+
+def get_backend_health_path() -> str:
+    """Возвращает путь проверки здоровья апстрима"""
+    return _settings.upstream.health_path
+
 
+def get_backend_health_timeout() -> float:
+    """Возвращает таймаут проверки здоровья апстрима в секундах"""
+    return _settings.upstream.health_timeout
 
-def get_timeout(override: Optional[int] = None) -> int:
-    """Возвращает таймаут для запросов"""
-    return override or DEFAULT_TIMEOUT
+
+def get_backend_max_failures() -> int:
+    """Возвращает число ошибок подряд, после которого апстрим исключается"""
+    return _settings.upstream.max_failures
+
+
+def get_timeout(override: Optional[int] = None, kind: Optional[str] = None) -> int:
+    """Возвращает таймаут для запросов (kind: text, image или video)"""
+    if override:
+        return override
+    section = {"text": _settings.text, "image": _settings.image, "video": _settings.video}.get(kind)
+    if section is not None and section.timeout:
+        return section.timeout
+    return _settings.timeout
+
+
+def get_connect_timeout() -> float:
+    """Возвращает таймаут установки соединения с апстримом"""
+    return _settings.upstream.connect_timeout
+
+
+def get_write_timeout() -> float:
+    """Возвращает таймаут отправки тела запроса в апстрим"""
+    return _settings.upstream.write_timeout
+
+
+def get_pool_timeout() -> float:
+    """Возвращает таймаут ожидания свободного соединения пула"""
+    return _settings.upstream.pool_timeout
+
+
+def get_deadline_early_reject() -> bool:
+    """Отклонять ли сразу работу, которая не успеет завершиться до дедлайна запроса"""
+    return _settings.deadline_early_reject
 
 
 def get_generate_script_path() -> str:
     """Возвращает путь к скрипту generate.py"""
-    return DEFAULT_GENERATE_SCRIPT_PATH
+    return _settings.video.generate_script_path
 
 
 def get_wan_python_path() -> str:
     """Возвращает путь к python со всеми зависимостями wan"""
-    return DEFAULT_WAN_PYTHON_PATH
+    return _settings.video.python_path
 
 
 def get_ckpt_dir() -> str:
     """Возвращает путь к директории с чекпоинтами"""
-    return DEFAULT_CKPT_DIR
+    return _settings.video.ckpt_dir
 
 
 def get_video_size() -> str:
     """Возвращает размер видео по умолчанию"""
-    return DEFAULT_VIDEO_SIZE
+    return _settings.video.size
 
 
 def get_ti2v_task() -> str:
     """Возвращает задачу для генерации видео"""
-    return DEFAULT_TASK
+    return _settings.video.task
+
+
+def get_http_max_connections() -> int:
+    """Возвращает максимальное число соединений в пуле на один апстрим"""
+    return _settings.http.max_connections
+
+
+def get_http_max_keepalive_connections() -> int:
+    """Возвращает максимальное число keep-alive соединений в пуле"""
+    return _settings.http.max_keepalive_connections
+
+
+def get_http_keepalive_expiry() -> float:
+    """Возвращает время жизни простаивающего keep-alive соединения в секундах"""
+    return _settings.http.keepalive_expiry
+
+
+def get_http2_enabled() -> bool:
+    """Возвращает, включен ли HTTP/2 для запросов к апстриму"""
+    return _settings.http.http2
+
+
+def get_video_worker_mode() -> str:
+    """Возвращает режим генерации видео: subprocess или resident"""
+    return _settings.video.worker_mode
+
+
+def get_video_workers() -> int:
+    """Возвращает количество резидентных видео воркеров"""
+    return _settings.video.workers
+
+
+def get_video_worker_script() -> str:
+    """Возвращает путь к скрипту резидентного видео воркера"""
+    return _settings.video.worker_script
+
+
+def get_video_worker_batch() -> bool:
+    """Возвращает, запускаются ли воркеры с поддержкой пакетных заданий"""
+    return _settings.video.worker_batch
+
+
+def get_video_worker_ready_timeout() -> int:
+    """Возвращает таймаут загрузки модели в воркере в секундах"""
+    return _settings.video.worker_ready_timeout
+
+
+def get_video_kill_grace() -> float:
+    """Возвращает паузу между SIGTERM и SIGKILL при остановке процесса генерации"""
+    return _settings.video.kill_grace
+
+
+def get_text_max_concurrency() -> int:
+    """Возвращает максимум одновременных запросов генерации текста"""
+    return _settings.text.max_concurrency
+
+
+def get_text_max_queue() -> int:
+    """Возвращает максимум запросов генерации текста в очереди ожидания"""
+    return _settings.text.max_queue
+
+
+def get_text_max_wait() -> float:
+    """Возвращает максимальное время ожидания слота для текста в секундах"""
+    return _settings.text.max_wait
+
+
+def get_image_max_concurrency() -> int:
+    """Возвращает максимум одновременных запросов генерации изображений"""
+    return _settings.image.max_concurrency
+
+
+def get_image_max_queue() -> int:
+    """Возвращает максимум запросов генерации изображений в очереди ожидания"""
+    return _settings.image.max_queue
+
+
+def get_image_max_wait() -> float:
+    """Возвращает максимальное время ожидания слота для изображений в секундах"""
+    return _settings.image.max_wait
+
+
+def get_video_max_concurrency() -> int:
+    """Возвращает максимум одновременных генераций видео (исполнители очереди заданий)"""
+    return _settings.video.max_concurrency
+
+
+def get_video_max_queue() -> int:
+    """Возвращает максимальный размер очереди заданий генерации видео"""
+    return _settings.video.max_queue
+
+
+def get_video_max_wait() -> float:
+    """Возвращает максимальное время ожидания задания в очереди в секундах"""
+    return _settings.video.max_wait
+
+
+def get_video_batch_max_size() -> int:
+    """Возвращает максимальное число заданий видео в одном пакете"""
+    return _settings.video.batch_max_size
+
+
+def get_video_batch_max_delay() -> float:
+    """Возвращает, сколько ждать добора пакета заданий видео в секундах"""
+    return _settings.video.batch_max_delay
+
+
+def get_api_clients() -> str:
+    """Возвращает описание клиентов API (ключ=имя[:вес[:класс]])"""
+    return _settings.clients.api_clients
+
+
+def get_client_max_queue_share() -> float:
+    """Возвращает долю очереди, доступную одному клиенту"""
+    return _settings.clients.max_queue_share
+
+
+def get_client_anonymous_max_class() -> str:
+    """Возвращает максимальный класс приоритета запросов без ключа и с неизвестным ключом"""
+    return _settings.clients.anonymous_max_class
+
+
+def get_job_retention() -> int:
+    """Возвращает время хранения завершенных заданий в секундах"""
+    return _settings.jobs.retention
+
+
+def get_job_store() -> str:
+    """Возвращает тип хранилища заданий: sqlite или memory"""
+    return _settings.jobs.store
+
+
+def get_job_store_path() -> str:
+    """Возвращает путь к файлу SQLite хранилища заданий"""
+    return _settings.jobs.store_path
+
+
+def get_job_store_flush_interval() -> float:
+    """Возвращает интервал записи изменений заданий в секундах"""
+    return _settings.jobs.store_flush_interval
+
+
+def get_cache_enabled() -> bool:
+    """Возвращает, включен ли кэш результатов"""
+    return _settings.cache.enabled
+
+
+def get_cache_ttl() -> int:
+    """Возвращает время жизни записи кэша в секундах"""
+    return _settings.cache.ttl
+
+
+def get_cache_memory_max_items() -> int:
+    """Возвращает максимум записей в памяти"""
+    return _settings.cache.memory_max_items
+
+
+def get_cache_memory_max_bytes() -> int:
+    """Возвращает максимальный объем кэша в памяти в байтах"""
+    return _settings.cache.memory_max_bytes
+
+
+def get_cache_memory_item_max_bytes() -> int:
+    """Возвращает максимальный размер записи, которая хранится в памяти"""
+    return _settings.cache.memory_item_max_bytes
+
+
+def get_cache_dir() -> str:
+    """Возвращает директорию дискового кэша"""
+    return _settings.cache.dir
+
+
+def get_cache_disk_max_bytes() -> int:
+    """Возвращает максимальный объем дискового кэша в байтах"""
+    return _settings.cache.disk_max_bytes
+
+
+def get_artifact_dir() -> str:
+    """Возвращает директорию файлов результатов генерации"""
+    return _settings.artifacts.dir
+
+
+def get_artifact_max_bytes() -> int:
+    """Возвращает квоту директории результатов в байтах"""
+    return _settings.artifacts.max_bytes
+
+
+def get_artifact_max_age() -> int:
+    """Возвращает время хранения файлов результатов в секундах"""
+    return _settings.artifacts.max_age
+
+
+def get_artifact_janitor_interval() -> float:
+    """Возвращает период очистки директории результатов в секундах"""
+    return _settings.artifacts.janitor_interval
+
+
+def get_singleflight_enabled() -> bool:
+    """Возвращает, объединяются ли одновременные одинаковые запросы"""
+    return _settings.singleflight_enabled
+
+
+def get_breaker_enabled() -> bool:
+    """Возвращает, включен ли circuit breaker"""
+    return _settings.breaker.enabled
+
+
+def get_breaker_window() -> float:
+    """Возвращает длину окна подсчета ошибок в секундах"""
+    return _settings.breaker.window
+
+
+def get_breaker_min_requests() -> int:
+    """Возвращает минимум запросов в окне для открытия breaker"""
+    return _settings.breaker.min_requests
+
+
+def get_breaker_error_rate() -> float:
+    """Возвращает долю ошибок, при которой breaker открывается"""
+    return _settings.breaker.error_rate
+
+
+def get_breaker_slow_call_seconds() -> float:
+    """Возвращает порог медленного ответа в секундах"""
+    return _settings.breaker.slow_call_seconds
+
+
+def get_breaker_slow_call_rate() -> float:
+    """Возвращает долю медленных ответов, при которой breaker открывается"""
+    return _settings.breaker.slow_call_rate
+
+
+def get_breaker_open_seconds() -> float:
+    """Возвращает время в открытом состоянии до пробных запросов"""
+    return _settings.breaker.open_seconds
+
+
+def get_breaker_half_open_max_calls() -> int:
+    """Возвращает число одновременных пробных запросов в half-open"""
+    return _settings.breaker.half_open_max_calls
+
+
+def get_upstream_retries() -> int:
+    """Возвращает максимальное число повторов запроса к апстриму"""
+    return _settings.upstream.retries
+
+
+def get_upstream_retry_backoff() -> float:
+    """Возвращает базовую паузу перед повтором в секундах"""
+    return _settings.upstream.retry_backoff
+
+
+def get_upstream_retry_backoff_max() -> float:
+    """Возвращает максимальную паузу перед повтором в секундах"""
+    return _settings.upstream.retry_backoff_max
+
+
+def get_upstream_retry_budget_ratio() -> float:
+    """Возвращает долю повторов от числа запросов в окне бюджета"""
+    return _settings.upstream.retry_budget_ratio
+
+
+def get_upstream_retry_budget_min() -> int:
+    """Возвращает число повторов в окне, разрешенных независимо от числа запросов"""
+    return _settings.upstream.retry_budget_min
+
+
+def get_upstream_retry_budget_window() -> float:
+    """Возвращает окно бюджета повторов в секундах"""
+    return _settings.upstream.retry_budget_window
+
+
+def get_upstream_hedge_endpoints() -> List[str]:
+    """Возвращает endpoints апстрима, для которых включены hedged запросы"""
+    return [item.strip() for item in _settings.upstream.hedge_endpoints.split(",") if item.strip()]
+
+
+def get_upstream_hedge_quantile() -> float:
+    """Возвращает перцентиль задержки, после которого отправляется hedged запрос"""
+    return _settings.upstream.hedge_quantile
+
+
+def get_upstream_hedge_min_delay() -> float:
+    """Возвращает минимальную задержку hedged запроса в секундах"""
+    return _settings.upstream.hedge_min_delay
+
+
+def get_wan_mock_mode() -> bool:
+    """Возвращает, включен ли mock-режим вместо реального апстрима"""
+    return _settings.mock_mode
+
+
+def get_metrics_multiproc_dir() -> str:
+    """Возвращает директорию файлов метрик для нескольких worker'ов"""
+    return _settings.metrics_multiproc_dir
+
+
+def get_log_level() -> str:
+    """Возвращает уровень логирования"""
+    return _settings.log.level
+
+
+def get_log_format() -> str:
+    """Возвращает формат логов: text или json"""
+    return _settings.log.format
+
+
+def get_log_dir() -> str:
+    """Возвращает директорию логов"""
+    return _settings.log.dir
+
+
+def get_log_queue_size() -> int:
+    """Возвращает размер очереди записей логов"""
+    return _settings.log.queue_size
+
+
+def get_json_backend() -> str:
+    """Возвращает библиотеку JSON: auto, orjson или stdlib"""
+    return _settings.json_backend
+
+
+def get_wan_batch_enabled() -> bool:
+    """Возвращает, включен ли микро-батчинг запросов к апстриму"""
+    return _settings.upstream.batch_enabled
+
+
+def get_wan_batch_max_size() -> int:
+    """Возвращает максимальное число запросов в одном пакете к апстриму"""
+    return _settings.upstream.batch_max_size
+
+
+def get_wan_batch_max_delay() -> float:
+    """Возвращает время добора пакета запросов к апстриму в секундах"""
+    return _settings.upstream.batch_max_delay
+
+
+def get_image_output() -> str:
+    """Возвращает режим результата генерации изображения по умолчанию"""
+    return _settings.image.output
+
+
+def get_image_artifact_min_bytes() -> int:
+    """Возвращает минимальную длину строки base64, сохраняемой в артефакт"""
+    return _settings.image.artifact_min_bytes
+
+
+def get_upstream_chunk_size() -> int:
+    """Возвращает размер блока потокового чтения ответа апстрима в байтах"""
+    return _settings.upstream.chunk_size
@@ -1,33 +1,127 @@
 """
 Настройка логирования для приложения
+
+Записи не пишутся на диск в потоке event loop: root logger кладет их
+в ограниченную очередь (QueueHandler), а файловые и консольный handlers
+работают в отдельном потоке QueueListener. Если очередь заполнена
+(например, медленный диск), новые записи отбрасываются и считаются,
+вместо того чтобы блокировать обработку запросов.
+
+Сообщения передаются в стиле logger.info("... %s", value): строка
+собирается только если уровень включен, и уже в потоке записи.
 """
+import atexit
+import contextvars
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Dict, Optional
+
+from app.config import get_log_dir, get_log_format, get_log_level, get_log_queue_size
+
+# ID текущего запроса (заголовок X-Request-ID), попадает в каждую запись лога
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+
+# Стандартные атрибуты LogRecord; остальные (из extra) выводятся в JSON как поля
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id", "taskName"}
+
+
+class RequestIdFilter(logging.Filter):
+    """Добавляет в запись ID запроса (выполняется в потоке, создавшем запись)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON, поля из extra (например, duration_ms) добавляются как есть"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+            "file": record.filename,
+            "line": record.lineno,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler, который не блокируется на заполненной очереди, а отбрасывает запись"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Очередь внутри процесса: запись не нужно сериализовать,
+        # сообщение форматируется handlers в потоке listener'а
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self):
+        # Очередь может быть заполнена — ждем, пока поток записи освободит место
+        self.queue.put(self._sentinel)
+
 
+# Имя handler'а errors.log: его уровень не меняется вместе с LOG_LEVEL
+_ERROR_HANDLER = "errors"
 
-def setup_logging(log_dir: str = "logs"):
+_queue_handler: Optional[DroppingQueueHandler] = None
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging(log_dir: Optional[str] = None):
     """
     Настраивает логирование для приложения
-    
+
     Args:
-        log_dir: Директория для хранения логов
+        log_dir: Директория для хранения логов (по умолчанию LOG_DIR)
     """
+    global _queue_handler, _listener
+    log_dir = log_dir or get_log_dir()
+
     # Создаем директорию для логов если её нет
     if not os.path.exists(log_dir):
         os.makedirs(log_dir)
-    
+
     # Настройка формата логов
-    log_format = '%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s'
+    log_format = '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] [%(filename)s:%(lineno)d] - %(message)s'
     date_format = '%Y-%m-%d %H:%M:%S'
-    
+    if get_log_format() == "json":
+        formatter: logging.Formatter = JsonFormatter(datefmt=date_format)
+    else:
+        formatter = logging.Formatter(log_format, date_format)
+    level = logging.getLevelName(get_log_level())
+    if not isinstance(level, int):
+        level = logging.INFO
+
     # Создаем root logger
     root_logger = logging.getLogger()
-    root_logger.setLevel(logging.INFO)
-    
+    root_logger.setLevel(level)
+
     # Очищаем существующие handlers (для предотвращения дублирования при hot-reload)
     root_logger.handlers.clear()
-    
+    _stop_listener()
+
     # Handler для файла с ротацией (10MB, 5 файлов бэкапа)
     file_handler = RotatingFileHandler(
         filename=os.path.join(log_dir, 'gateway.log'),
@@ -35,14 +129,14 @@ def setup_logging(log_dir: str = "logs"):
         backupCount=5,
         encoding='utf-8'
     )
-    file_handler.setLevel(logging.INFO)
-    file_handler.setFormatter(logging.Formatter(log_format, date_format))
-    
+    file_handler.setLevel(level)
+    file_handler.setFormatter(formatter)
+
     # Handler для консоли
     console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    console_handler.setFormatter(logging.Formatter(log_format, date_format))
-    
+    console_handler.setLevel(level)
+    console_handler.setFormatter(formatter)
+
     # Handler для файла с ошибками (только ERROR и выше)
     error_handler = RotatingFileHandler(
         filename=os.path.join(log_dir, 'errors.log'),
@@ -51,16 +145,62 @@ def setup_logging(log_dir: str = "logs"):
         encoding='utf-8'
     )
     error_handler.setLevel(logging.ERROR)
-    error_handler.setFormatter(logging.Formatter(log_format, date_format))
-    
-    # Добавляем handlers
-    root_logger.addHandler(file_handler)
-    root_logger.addHandler(console_handler)
-    root_logger.addHandler(error_handler)
-    
+    error_handler.set_name(_ERROR_HANDLER)
+    error_handler.setFormatter(formatter)
+
+    # Handlers работают в потоке listener'а, root logger только ставит записи в очередь
+    _queue_handler = DroppingQueueHandler(queue.Queue(get_log_queue_size()))
+    _queue_handler.addFilter(RequestIdFilter())
+    root_logger.addHandler(_queue_handler)
+    _listener = _Listener(
+        _queue_handler.queue,
+        file_handler,
+        console_handler,
+        error_handler,
+        respect_handler_level=True
+    )
+    _listener.start()
+
     # Возвращаем настроенный root logger
     return root_logger
 
 
+def _stop_listener():
+    """Дописывает оставшиеся в очереди записи и останавливает поток listener'а"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def set_log_level(level: str):
+    """Меняет уровень логирования на ходу (перечитывание настроек)"""
+    value = logging.getLevelName(level)
+    if not isinstance(value, int):
+        logging.getLogger(__name__).warning("Неизвестный уровень логирования %s", level)
+        return
+    logging.getLogger().setLevel(value)
+    if _listener is not None:
+        for handler in _listener.handlers:
+            if handler.get_name() != _ERROR_HANDLER:
+                handler.setLevel(value)
+
+
+def log_stats() -> Dict[str, Any]:
+    """Состояние очереди логов"""
+    if _queue_handler is None:
+        return {}
+    return {
+        "format": get_log_format(),
+        "level": logging.getLevelName(logging.getLogger().level),
+        "queue_size": _queue_handler.queue.qsize(),
+        "queue_capacity": _queue_handler.queue.maxsize,
+        "dropped": _queue_handler.dropped,
+    }
+
+
 # Автоматически настраиваем логирование при импорте
 logger = setup_logging()
+atexit.register(_stop_listener)
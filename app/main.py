@@ -1,16 +1,97 @@
 import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import List
 
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+
+from app.config import (
+    get_connect_timeout,
+    get_log_level,
+    get_timeout,
+    get_video_max_concurrency,
+    get_video_worker_mode,
+    get_wan_mock_mode,
+)
+from app.logger import log_stats, logger, request_id_var, set_log_level
+from app.metrics import UNMATCHED_ROUTE, format_gauge, metrics
+from app.routers import artifacts, generate, jobs
+from app.serialization import FastJSONResponse, default_response_class, json_backend
+from app.services.admission import AdmissionRejected, image_limiter, reconfigure_limiters, text_limiter
+from app.services.artifacts import artifact_registry
+from app.services.backends import backend_pool
+from app.services.cache import result_cache
+from app.services.circuit_breaker import HALF_OPEN, OPEN, circuit_breakers
+from app.services.config_reload import config_reloader
+from app.services.deadlines import DEADLINE_HEADER, TIMEOUT_HEADER, deadline_var, parse_deadline
+from app.services.http_pool import http_pool
+from app.services.jobs import job_manager
+from app.services.retries import retries_snapshot, retry_budget
+from app.services.video_workers import video_worker_pool
+from app.services.wan_client import batching_snapshot, singleflight
+
+
+async def _on_config_change(changed: List[str]):
+    """Применяет перечитанные настройки к тому, что построено при запуске"""
+    sections = {name.split(".", 1)[0] for name in changed if "." in name}
+    if sections & {"text", "image"}:
+        reconfigure_limiters()
+    if "http" in sections:
+        http_pool.reconfigure()
+    if any(name.startswith(("upstream.lb_strategy", "upstream.health_")) for name in changed):
+        await backend_pool.reconfigure()
+    if "artifacts.janitor_interval" in changed:
+        await artifact_registry.stop()
+        artifact_registry.start()
+    if "log.level" in changed:
+        set_log_level(get_log_level())
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    metrics.startup()
+    http_pool.startup()
+    await result_cache.startup()
+    artifact_registry.start()
+    await backend_pool.start()
+    if get_video_worker_mode() == "resident":
+        await video_worker_pool.start()
+    await job_manager.start()
+    config_reloader.subscribe(_on_config_change)
+    config_reloader.start()
+    logger.info("WAN2.2 API Gateway started")
+    logger.info("Server configuration:")
+    logger.info(
+        "  - Timeouts: text=%ss, image=%ss, video=%ss, connect=%ss",
+        get_timeout(kind="text"), get_timeout(kind="image"), get_timeout(kind="video"), get_connect_timeout()
+    )
+    logger.info("  - JSON: %s", json_backend())
+    logger.info(
+        "  - Max concurrent requests (per worker): text=%s, image=%s, video=%s",
+        text_limiter.max_concurrent, image_limiter.max_concurrent, get_video_max_concurrency()
+    )
+    if get_wan_mock_mode():
+        logger.warning("  - WAN_MOCK_MODE включен: апстрим не вызывается, ответы mock")
+    logger.info("  - For production, configure uvicorn with proper workers")
+    yield
+    await config_reloader.stop()
+    await job_manager.stop()
+    await video_worker_pool.stop()
+    await backend_pool.stop()
+    await artifact_registry.stop()
+    await http_pool.shutdown()
+    metrics.shutdown()
+    logger.info("WAN2.2 API Gateway stopped")
 
-from app.logger import logger
-from app.metrics import metrics
-from app.routers import generate
 
 app = FastAPI(
     title="WAN2.2 API Gateway",
     description="API Gateway для работы с WAN2.2 моделью",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan,
+    default_response_class=default_response_class()
 )
 
 # Настройка CORS для работы с фронтендом
@@ -22,23 +103,94 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Длинные X-Request-ID от клиента обрезаются
+_MAX_REQUEST_ID_LENGTH = 128
+
+
+def _route_template(request: Request) -> str:
+    """Шаблон маршрута запроса (/api/jobs/{job_id}), а не конкретный путь — для меток метрик"""
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED_ROUTE
+
+
+# Объявлен первым, поэтому выполняется внутри остальных middleware:
+# его отказы попадают в метрики и access-лог с X-Request-ID
+@app.middleware("http")
+async def deadline_middleware(request: Request, call_next):
+    """Дедлайн запроса из X-Request-Deadline / X-Request-Timeout в контекст запроса"""
+    try:
+        deadline = parse_deadline(request.headers.get(DEADLINE_HEADER), request.headers.get(TIMEOUT_HEADER))
+    except ValueError as e:
+        return FastJSONResponse(status_code=400, content={"detail": str(e)})
+    if deadline is None:
+        return await call_next(request)
+    if deadline <= time.time():
+        logger.warning("Запрос %s отклонен: дедлайн истек до начала обработки", request.url.path)
+        return FastJSONResponse(status_code=504, content={"detail": "Дедлайн запроса истек до начала обработки"})
+    token = deadline_var.set(deadline)
+    try:
+        return await call_next(request)
+    finally:
+        deadline_var.reset(token)
+
 @app.middleware("http")
 async def metrics_middleware(request: Request, call_next):
     start = time.perf_counter()
+    method = request.method
+    # Маршрут известен только после роутинга, поэтому запросы в работе считаются по методу
+    metrics.request_started(method)
     try:
         response = await call_next(request)
         return response
     finally:
         latency = time.perf_counter() - start
+        metrics.request_finished(method)
         status = getattr(request.state, "status_code", None)
         if status is None:
             try:
                 status = response.status_code
             except Exception:
                 status = 500
-        metrics.record(latency, status)
+        metrics.record(latency, status, _route_template(request), method)
+
+@app.middleware("http")
+async def request_context_middleware(request: Request, call_next):
+    """Назначает запросу ID для логов (X-Request-ID) и пишет строку access-лога со временем выполнения"""
+    request_id = request.headers.get("x-request-id", "")[:_MAX_REQUEST_ID_LENGTH] or uuid.uuid4().hex
+    token = request_id_var.set(request_id)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        logger.info(
+            "%s %s -> %s за %.1f мс", request.method, request.url.path, status, duration_ms,
+            extra={
+                "method": request.method,
+                "path": request.url.path,
+                "route": _route_template(request),
+                "status": status,
+                "duration_ms": round(duration_ms, 2),
+            }
+        )
+        request_id_var.reset(token)
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    logger.warning("Запрос %s отклонен: %s", request.url.path, exc)
+    return FastJSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
 
 app.include_router(generate.router)
+app.include_router(jobs.router)
+app.include_router(artifacts.router)
 
 
 @app.get("/")
@@ -52,15 +204,123 @@ async def root():
 
 @app.get("/metrics")
 async def get_metrics():
-    return metrics.snapshot()
+    snapshot = metrics.snapshot()
+    snapshot["http_pool"] = http_pool.snapshot()
+    snapshot["backends"] = backend_pool.snapshot()
+    snapshot["circuit_breakers"] = circuit_breakers.snapshot()
+    snapshot["video_workers"] = video_worker_pool.snapshot()
+    snapshot["cache"] = result_cache.snapshot()
+    snapshot["artifacts"] = artifact_registry.snapshot()
+    snapshot["singleflight"] = singleflight.snapshot()
+    snapshot["upstream_batching"] = batching_snapshot()
+    snapshot["upstream_retries"] = retries_snapshot()
+    snapshot["logging"] = log_stats()
+    snapshot["config"] = config_reloader.snapshot()
+    snapshot["admission"] = {
+        "text": text_limiter.snapshot(),
+        "image": image_limiter.snapshot(),
+        "video": job_manager.snapshot()
+    }
+    return snapshot
 
-@app.on_event("startup")
-async def startup_event():
-    logger.info("WAN2.2 API Gateway started")
-    logger.info("Server configuration:")
-    logger.info(f"  - Default timeout: 300s")
-    logger.info(f"  - Max concurrent requests: depends on uvicorn workers")
-    logger.info("  - For production, configure uvicorn with proper workers")
 
 
-# Rate limiting and concurrency control would be added here for production
+# Числовое состояние circuit breaker для Prometheus
+_CIRCUIT_STATE_VALUES = {OPEN: 2, HALF_OPEN: 1}
+
+
+@app.get("/metrics/prometheus", response_class=PlainTextResponse)
+async def get_prometheus_metrics():
+    """Метрики в текстовом формате Prometheus"""
+    limiters = {"text": text_limiter.snapshot(), "image": image_limiter.snapshot()}
+    video = job_manager.snapshot()
+    cache = result_cache.snapshot()
+    lines = [metrics.prometheus().rstrip("\n")]
+    lines += format_gauge(
+        "wan_gateway_admission_active",
+        "Запросы, выполняющиеся под лимитом параллелизма",
+        [({"kind": kind}, snapshot["active"]) for kind, snapshot in limiters.items()]
+        + [({"kind": "video"}, video["jobs"].get("running", 0))],
+    )
+    lines += format_gauge(
+        "wan_gateway_admission_waiting",
+        "Запросы в очереди на выполнение",
+        [({"kind": kind}, snapshot["waiting"]) for kind, snapshot in limiters.items()]
+        + [({"kind": "video"}, video["queue_size"])],
+    )
+    lines += format_gauge(
+        "wan_gateway_admission_rejected_total",
+        "Запросы, отклоненные контролем допуска",
+        [
+            ({"kind": kind, "reason": reason}, snapshot[f"rejected_{reason}"])
+            for kind, snapshot in {**limiters, "video": video}.items()
+            for reason in ("queue_full", "wait_timeout", "client_quota", "deadline")
+        ],
+        metric_type="counter",
+    )
+    lines += format_gauge(
+        "wan_gateway_client_queue_depth",
+        "Запросы клиента в очереди допуска",
+        [
+            ({"kind": kind, "client": client}, counts["waiting"])
+            for kind, snapshot in {**limiters, "video": video}.items()
+            for client, counts in snapshot["clients"].items()
+        ],
+    )
+    lines += format_gauge(
+        "wan_gateway_circuit_state",
+        "Состояние circuit breaker апстрима: 0 closed, 1 half_open, 2 open",
+        [
+            ({"backend": url}, _CIRCUIT_STATE_VALUES.get(snapshot["state"], 0))
+            for url, snapshot in circuit_breakers.snapshot().items()
+        ],
+    )
+    lines += format_gauge(
+        "wan_gateway_cache_requests_total",
+        "Обращения к кэшу результатов",
+        [
+            ({"result": "hit_memory"}, cache["hits_memory"]),
+            ({"result": "hit_disk"}, cache["hits_disk"]),
+            ({"result": "miss"}, cache["misses"]),
+        ],
+        metric_type="counter",
+    )
+    lines += format_gauge(
+        "wan_gateway_upstream_retries_total",
+        "Повторы и hedged запросы к апстриму",
+        [({"kind": "retry"}, retry_budget.retries), ({"kind": "hedge"}, retry_budget.hedges)],
+        metric_type="counter",
+    )
+    lines += format_gauge(
+        "wan_gateway_upstream_hedge_wins_total",
+        "Hedged запросы, ответившие раньше исходного",
+        [({}, retry_budget.hedge_wins)],
+        metric_type="counter",
+    )
+    lines += format_gauge(
+        "wan_gateway_upstream_retry_budget_exhausted_total",
+        "Повторы, не выполненные из-за исчерпанного бюджета",
+        [({}, retry_budget.exhausted)],
+        metric_type="counter",
+    )
+    lines += format_gauge(
+        "wan_gateway_config_reloads_total",
+        "Перечитывания настроек",
+        [({"result": "success"}, config_reloader.reloads), ({"result": "failure"}, config_reloader.failures)],
+        metric_type="counter",
+    )
+    lines += format_gauge(
+        "wan_gateway_config_version",
+        "Версия настроек: увеличивается при каждом изменении",
+        [({}, config_reloader.version)],
+    )
+    lines += format_gauge(
+        "wan_gateway_log_dropped_total",
+        "Записи логов, отброшенные из-за заполненной очереди",
+        [({}, log_stats().get("dropped", 0))],
+        metric_type="counter",
+    )
+    return PlainTextResponse(
+        "\n".join(lines) + "\n",
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
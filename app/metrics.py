@@ -1,55 +1,323 @@
 """
 Модуль для отслеживания метрик производительности API
+
+Задержки хранятся в гистограммах с фиксированными границами бакетов:
+запись — один bisect и инкремент счетчика, перцентили (p50/p90/p99)
+оцениваются линейной интерполяцией внутри бакета. Границы покрывают
+и миллисекундные ответы текста, и десятиминутную генерацию видео.
 """
 import time
+from bisect import bisect_left
 from collections import defaultdict
 from threading import Lock
-from typing import Dict, Any
+from typing import Any, Dict, Iterable, List, Tuple
+
+from app.metrics_store import create_store
+
+# Верхние границы бакетов задержки в секундах (последний бакет — +Inf)
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+    30.0, 60.0, 120.0, 300.0, 600.0, 900.0, 1200.0, 1800.0, 3600.0,
+)
+PERCENTILES = (0.5, 0.9, 0.99)
+
+# Маршрут для запросов, не совпавших ни с одним endpoint (чтобы не плодить метки по URL)
+UNMATCHED_ROUTE = "unmatched"
+
+
+class Histogram:
+    """Гистограмма задержек с фиксированными бакетами"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: "Histogram"):
+        """Добавляет наблюдения другой гистограммы с теми же бакетами"""
+        for index, bucket_count in enumerate(other.counts):
+            self.counts[index] += bucket_count
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q: float) -> float:
+        """Оценка перцентиля q (0..1) в секундах"""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                # Оценка не может превышать максимальное наблюдение (в бакете +Inf границы нет)
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                estimate = lower + (upper - lower) * (rank - cumulative) / bucket_count
+                return min(estimate, self.max)
+            cumulative += bucket_count
+        return self.max
+
+    def snapshot(self) -> Dict[str, Any]:
+        result = {
+            "count": self.count,
+            "average_ms": round(self.sum / self.count * 1000, 2) if self.count else 0,
+        }
+        for q in PERCENTILES:
+            result[f"p{int(q * 100)}_ms"] = round(self.percentile(q) * 1000, 2)
+        result["max_ms"] = round(self.max * 1000, 2)
+        return result
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """Кумулятивные счетчики по бакетам для Prometheus (le, count)"""
+        result = []
+        total = 0
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            total += bucket_count
+            result.append((_format_value(bound), total))
+        result.append(("+Inf", self.count))
+        return result
 
 
 class Metrics:
-    """Класс для сбора и хранения метрик"""
-    
-    def __init__(self):
+    """
+    Класс для сбора и хранения метрик
+
+    Значения пишутся в хранилище (app.metrics_store): в памяти процесса или,
+    если задан METRICS_MULTIPROC_DIR, в mmap файлы, общие для всех worker'ов.
+    Снимок строится из объединенных значений всех процессов.
+    """
+
+    def __init__(self, store=None):
         self._lock = Lock()
-        self.total_requests = 0
-        self.total_latency = 0.0
-        self.requests_by_status = defaultdict(int)
-        self.requests_by_endpoint = defaultdict(int)
+        self._store = store if store is not None else create_store()
+        self.start_time = time.time()
+
+    def startup(self):
+        """Отмечает запуск процесса (вызывается из lifespan каждого worker'а)"""
         self.start_time = time.time()
-    
-    def record(self, latency: float, status_code: int, endpoint: str = None):
+        with self._lock:
+            self._store.set(("live_min", "start_time"), self.start_time)
+
+    def shutdown(self):
+        """Обнуляет gauge процесса и закрывает его файл метрик"""
+        with self._lock:
+            self._store.close()
+
+    def _observe(self, name: str, labels: Tuple, value: float):
+        store = self._store
+        store.inc(("sum", name, *labels, "bucket", bisect_left(LATENCY_BUCKETS, value)))
+        store.inc(("sum", name, *labels, "sum"), value)
+        store.set_max(("max", name, *labels, "max"), value)
+
+    def record(
+        self,
+        latency: float,
+        status_code: int,
+        endpoint: str = None,
+        method: str = "GET"
+    ):
         """Записывает метрику запроса"""
         with self._lock:
-            self.total_requests += 1
-            self.total_latency += latency
-            self.requests_by_status[status_code] += 1
-            if endpoint:
-                self.requests_by_endpoint[endpoint] += 1
-    
+            self._observe("request", (endpoint or UNMATCHED_ROUTE, method, status_code), latency)
+
+    def request_started(self, method: str):
+        with self._lock:
+            self._store.inc(("live", "in_flight", method))
+
+    def request_finished(self, method: str):
+        with self._lock:
+            self._store.inc(("live", "in_flight", method), -1)
+
+    def upstream_started(self, backend: str):
+        with self._lock:
+            self._store.inc(("live", "upstream_in_flight", backend))
+
+    def record_upstream(self, backend: str, endpoint: str, latency: float, outcome: str):
+        """
+        Записывает завершение запроса к апстриму
+
+        Args:
+            outcome: success, failure или cancelled
+        """
+        with self._lock:
+            self._store.inc(("live", "upstream_in_flight", backend), -1)
+            self._observe("upstream", (backend, endpoint, outcome), latency)
+
+    def record_queue_wait(self, kind: str, client: str, priority_class: str, wait: float):
+        """Записывает время ожидания в очереди допуска (text, image, video) до начала выполнения"""
+        with self._lock:
+            self._observe("queue_wait", (kind, client, priority_class), wait)
+
+    def _collect(self) -> Tuple[Dict[str, Dict[Tuple, Histogram]], Dict[str, Dict[Tuple, float]], float]:
+        """Гистограммы и gauge из объединенных значений всех процессов"""
+        with self._lock:
+            samples = self._store.collect()
+
+        histograms: Dict[str, Dict[Tuple, Histogram]] = defaultdict(dict)
+        gauges: Dict[str, Dict[Tuple, float]] = defaultdict(dict)
+        start_time = self.start_time
+        for key, value in samples.items():
+            kind, name = key[0], key[1]
+            if kind == "live_min":
+                start_time = value
+            elif kind == "live":
+                gauges[name][key[2:]] = value
+            elif key[-2] == "bucket":
+                histogram = histograms[name].setdefault(key[2:-2], Histogram())
+                histogram.counts[key[-1]] += int(value)
+                histogram.count += int(value)
+            else:
+                histogram = histograms[name].setdefault(key[2:-1], Histogram())
+                if key[-1] == "sum":
+                    histogram.sum = value
+                else:
+                    histogram.max = value
+        return histograms, gauges, start_time
+
     def snapshot(self) -> Dict[str, Any]:
         """Возвращает снимок текущих метрик"""
-        with self._lock:
-            avg_latency = self.total_latency / self.total_requests if self.total_requests > 0 else 0
-            uptime = time.time() - self.start_time
-            
-            return {
-                "total_requests": self.total_requests,
-                "average_latency_ms": round(avg_latency * 1000, 2),
-                "uptime_seconds": round(uptime, 2),
-                "requests_per_second": round(self.total_requests / uptime if uptime > 0 else 0, 2),
-                "status_codes": dict(self.requests_by_status),
-                "endpoints": dict(self.requests_by_endpoint)
-            }
-    
+        histograms, gauges, start_time = self._collect()
+        uptime = time.time() - start_time
+
+        latency = Histogram()
+        requests_by_status: Dict[int, int] = defaultdict(int)
+        requests_by_endpoint: Dict[str, int] = defaultdict(int)
+        routes: Dict[str, Dict[str, Any]] = defaultdict(dict)
+        for (route, method, status), histogram in sorted(histograms["request"].items()):
+            latency.merge(histogram)
+            requests_by_status[status] += histogram.count
+            requests_by_endpoint[route] += histogram.count
+            routes[f"{method} {route}"][str(status)] = histogram.snapshot()
+        upstreams: Dict[str, Dict[str, Any]] = defaultdict(dict)
+        for (backend, endpoint, outcome), histogram in sorted(histograms["upstream"].items()):
+            upstreams[backend][f"{endpoint} {outcome}"] = histogram.snapshot()
+        queue_wait: Dict[str, Dict[str, Any]] = defaultdict(dict)
+        for (kind, client, priority_class), histogram in sorted(histograms["queue_wait"].items()):
+            queue_wait[kind][f"{client} {priority_class}"] = histogram.snapshot()
+
+        return {
+            "total_requests": latency.count,
+            "average_latency_ms": round(latency.sum / latency.count * 1000, 2) if latency.count else 0,
+            "latency": latency.snapshot(),
+            "uptime_seconds": round(uptime, 2),
+            "requests_per_second": round(latency.count / uptime if uptime > 0 else 0, 2),
+            "status_codes": dict(requests_by_status),
+            "endpoints": dict(requests_by_endpoint),
+            "routes": dict(routes),
+            "upstream_latency": dict(upstreams),
+            "queue_wait": dict(queue_wait),
+            "in_flight": {labels[0]: int(value) for labels, value in gauges["in_flight"].items() if value},
+            "upstream_in_flight": {
+                labels[0]: int(value) for labels, value in gauges["upstream_in_flight"].items() if value
+            },
+            "processes": self._store.processes() if self._store.multiprocess else 1,
+        }
+
+    def prometheus(self) -> str:
+        """Возвращает метрики в текстовом формате Prometheus"""
+        histograms, gauges, start_time = self._collect()
+        lines: List[str] = []
+        lines += format_histograms(
+            "wan_gateway_request_duration_seconds",
+            "Задержка HTTP запросов к шлюзу",
+            (
+                ({"route": route, "method": method, "status": str(status)}, histogram)
+                for (route, method, status), histogram in sorted(histograms["request"].items())
+            ),
+        )
+        lines += format_gauge(
+            "wan_gateway_requests_in_flight",
+            "HTTP запросы в обработке",
+            (({"method": method}, value) for (method,), value in sorted(gauges["in_flight"].items())),
+        )
+        lines += format_histograms(
+            "wan_gateway_upstream_duration_seconds",
+            "Задержка запросов к апстримам WAN2.2 API",
+            (
+                ({"backend": backend, "endpoint": endpoint, "outcome": outcome}, histogram)
+                for (backend, endpoint, outcome), histogram in sorted(histograms["upstream"].items())
+            ),
+        )
+        lines += format_gauge(
+            "wan_gateway_upstream_in_flight",
+            "Запросы к апстримам в работе",
+            (({"backend": backend}, value) for (backend,), value in sorted(gauges["upstream_in_flight"].items())),
+        )
+        lines += format_histograms(
+            "wan_gateway_queue_wait_seconds",
+            "Время ожидания в очереди допуска по клиентам и классам приоритета",
+            (
+                ({"kind": kind, "client": client, "class": priority_class}, histogram)
+                for (kind, client, priority_class), histogram in sorted(histograms["queue_wait"].items())
+            ),
+        )
+        lines += format_gauge(
+            "wan_gateway_uptime_seconds",
+            "Время работы шлюза",
+            [({}, time.time() - start_time)],
+        )
+        return "\n".join(lines) + "\n"
+
     def reset(self):
-        """Сбрасывает все метрики"""
+        """Сбрасывает все метрики (в режиме нескольких worker'ов — только метрики этого процесса)"""
         with self._lock:
-            self.total_requests = 0
-            self.total_latency = 0.0
-            self.requests_by_status.clear()
-            self.requests_by_endpoint.clear()
-            self.start_time = time.time()
+            self._store.clear()
+        self.startup()
+
+
+# --- Текстовый формат Prometheus ---
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return f"{value:.1f}"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+
+def format_gauge(
+    name: str,
+    help_text: str,
+    samples: Iterable[Tuple[Dict[str, str], float]],
+    metric_type: str = "gauge"
+) -> List[str]:
+    """Строки одной метрики-gauge (или counter) в формате Prometheus"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(labels)} {_format_value(value)}")
+    return lines
+
+
+def format_histograms(
+    name: str,
+    help_text: str,
+    samples: Iterable[Tuple[Dict[str, str], Histogram]]
+) -> List[str]:
+    """Строки гистограммы в формате Prometheus"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for labels, histogram in samples:
+        for bound, count in histogram.cumulative():
+            lines.append(f"{name}_bucket{_labels({**labels, 'le': bound})} {count}")
+        lines.append(f"{name}_sum{_labels(labels)} {_format_value(histogram.sum)}")
+        lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+    return lines
 
 
 # Глобальный экземпляр метрик
@@ -0,0 +1,269 @@
+"""
+Хранилища значений метрик
+
+LocalStore — словарь в памяти процесса (один uvicorn worker).
+
+MmapStore — для нескольких worker'ов (gunicorn --workers N): каждый процесс
+пишет только в свой файл METRICS_MULTIPROC_DIR/metrics_<pid>.db, отображенный
+в память через mmap. Запись — поиск смещения в словаре и struct.pack_into,
+без межпроцессных блокировок. При чтении любой worker читает файлы всех
+процессов и объединяет значения, поэтому /metrics показывает данные кластера.
+
+Формат файла: 8 байт заголовка (занятый размер), затем записи
+[длина ключа uint32][ключ utf-8, дополненный до 8 байт][значение double].
+Заголовок обновляется после записи, поэтому читатель не видит
+недописанных записей.
+
+Ключ — кортеж, первый элемент которого задает способ объединения:
+    - "sum": сумма по всем процессам (счетчики, гистограммы)
+    - "max": максимум по всем процессам
+    - "live": сумма только по живым процессам (gauge запросов в работе)
+    - "live_min": минимум по живым процессам (время запуска)
+"""
+import glob
+import json
+import mmap
+import os
+import struct
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from app.config import get_metrics_multiproc_dir
+from app.logger import logger
+
+Key = Tuple
+
+_HEADER_SIZE = 8
+_INITIAL_SIZE = 1024 * 1024
+_FILE_PREFIX = "metrics_"
+_FILE_SUFFIX = ".db"
+
+
+def _merge(samples: Dict[Key, float], key: Key, value: float):
+    if key not in samples:
+        samples[key] = value
+    elif key[0] == "max":
+        samples[key] = max(samples[key], value)
+    elif key[0] == "live_min":
+        samples[key] = min(samples[key], value)
+    else:
+        samples[key] = samples[key] + value
+
+
+class LocalStore:
+    """Значения метрик в памяти процесса"""
+
+    multiprocess = False
+
+    def __init__(self):
+        self._values: Dict[Key, float] = {}
+
+    def inc(self, key: Key, amount: float = 1.0):
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set_max(self, key: Key, value: float):
+        if value > self._values.get(key, float("-inf")):
+            self._values[key] = value
+
+    def set(self, key: Key, value: float):
+        self._values[key] = value
+
+    def collect(self) -> Dict[Key, float]:
+        return dict(self._values)
+
+    def clear(self):
+        self._values.clear()
+
+    def close(self):
+        pass
+
+
+class _MmapFile:
+    """Файл значений одного процесса, отображенный в память"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a+b")
+        size = os.fstat(self._file.fileno()).st_size
+        if size < _INITIAL_SIZE:
+            self._file.truncate(_INITIAL_SIZE)
+            size = _INITIAL_SIZE
+        self._capacity = size
+        self._mmap = mmap.mmap(self._file.fileno(), self._capacity)
+        self._positions: Dict[str, int] = {}
+
+        self._used = struct.unpack_from("i", self._mmap, 0)[0]
+        if self._used == 0:
+            self._used = _HEADER_SIZE
+            struct.pack_into("i", self._mmap, 0, self._used)
+        else:
+            # Файл остался от процесса с тем же pid — продолжаем его счетчики
+            for key, _, position in _read_entries(self._mmap, self._used):
+                self._positions[key] = position
+
+    def _init_key(self, key: str) -> int:
+        encoded = key.encode("utf-8")
+        padded = encoded + b" " * (8 - (len(encoded) + 4) % 8)
+        entry = struct.pack(f"i{len(padded)}sd", len(encoded), padded, 0.0)
+        while self._used + len(entry) > self._capacity:
+            self._grow()
+        self._mmap[self._used:self._used + len(entry)] = entry
+        position = self._used + 4 + len(padded)
+        self._used += len(entry)
+        struct.pack_into("i", self._mmap, 0, self._used)
+        self._positions[key] = position
+        return position
+
+    def _grow(self):
+        self._capacity *= 2
+        self._file.truncate(self._capacity)
+        self._mmap.close()
+        self._mmap = mmap.mmap(self._file.fileno(), self._capacity)
+
+    def read(self, key: str) -> float:
+        position = self._positions.get(key)
+        if position is None:
+            return 0.0
+        return struct.unpack_from("d", self._mmap, position)[0]
+
+    def write(self, key: str, value: float):
+        position = self._positions.get(key)
+        if position is None:
+            position = self._init_key(key)
+        struct.pack_into("d", self._mmap, position, value)
+
+    def clear(self):
+        self._mmap[:self._used] = b"\x00" * self._used
+        self._used = _HEADER_SIZE
+        struct.pack_into("i", self._mmap, 0, self._used)
+        self._positions.clear()
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+
+def _read_entries(data, used: int) -> Iterator[Tuple[str, float, int]]:
+    """Записи файла значений: (ключ, значение, смещение значения)"""
+    position = _HEADER_SIZE
+    while position < used:
+        length = struct.unpack_from("i", data, position)[0]
+        if length <= 0 or position + 4 + length > used:
+            return
+        key = bytes(data[position + 4:position + 4 + length]).decode("utf-8")
+        position += 4 + length + (8 - (length + 4) % 8)
+        value = struct.unpack_from("d", data, position)[0]
+        yield key, value, position
+        position += 8
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MmapStore:
+    """Значения метрик в mmap файлах, по одному на процесс"""
+
+    multiprocess = True
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._pid = None
+        self._file = None
+        # Кэш кодирования ключей: кортеж -> строка JSON
+        self._encoded: Dict[Key, str] = {}
+
+    def _own_file(self) -> _MmapFile:
+        # pid проверяется при каждой записи: приложение может быть загружено
+        # в мастер-процессе до fork (gunicorn --preload)
+        pid = os.getpid()
+        if self._pid != pid:
+            self._pid = pid
+            self._file = _MmapFile(os.path.join(self.directory, f"{_FILE_PREFIX}{pid}{_FILE_SUFFIX}"))
+        return self._file
+
+    def _encode(self, key: Key) -> str:
+        encoded = self._encoded.get(key)
+        if encoded is None:
+            encoded = self._encoded[key] = json.dumps(key, ensure_ascii=False, separators=(",", ":"))
+        return encoded
+
+    def inc(self, key: Key, amount: float = 1.0):
+        file = self._own_file()
+        encoded = self._encode(key)
+        file.write(encoded, file.read(encoded) + amount)
+
+    def set_max(self, key: Key, value: float):
+        file = self._own_file()
+        encoded = self._encode(key)
+        if value > file.read(encoded):
+            file.write(encoded, value)
+
+    def set(self, key: Key, value: float):
+        self._own_file().write(self._encode(key), value)
+
+    def collect(self) -> Dict[Key, float]:
+        """Объединяет значения всех процессов"""
+        samples: Dict[Key, float] = {}
+        for path in self._paths():
+            pid = _path_pid(path)
+            alive = pid is not None and _pid_alive(pid)
+            try:
+                with open(path, "rb") as file:
+                    data = file.read()
+            except OSError as e:
+                logger.warning("Не удалось прочитать файл метрик %s: %s", path, e)
+                continue
+            if len(data) < _HEADER_SIZE:
+                continue
+            used = min(struct.unpack_from("i", data, 0)[0], len(data))
+            for encoded, value, _ in _read_entries(data, used):
+                key = tuple(json.loads(encoded))
+                if key[0].startswith("live") and not alive:
+                    continue
+                _merge(samples, key, value)
+        return samples
+
+    def _paths(self) -> Iterable[str]:
+        return glob.glob(os.path.join(self.directory, f"{_FILE_PREFIX}*{_FILE_SUFFIX}"))
+
+    def processes(self) -> int:
+        """Число живых процессов, пишущих метрики"""
+        pids = (_path_pid(path) for path in self._paths())
+        return sum(1 for pid in pids if pid is not None and _pid_alive(pid))
+
+    def clear(self):
+        self._own_file().clear()
+
+    def close(self):
+        """Закрывает файл процесса и обнуляет его gauge "live" (вызывается при остановке worker'а)"""
+        if self._file is None or self._pid != os.getpid():
+            return
+        for key, encoded in self._encoded.items():
+            if key[0] == "live":
+                self._file.write(encoded, 0.0)
+        self._file.close()
+        self._file = None
+        self._pid = None
+
+
+def _path_pid(path: str) -> Optional[int]:
+    name = os.path.basename(path)[len(_FILE_PREFIX):-len(_FILE_SUFFIX)]
+    try:
+        return int(name)
+    except ValueError:
+        return None
+
+
+def create_store():
+    """Хранилище по конфигурации: mmap файлы, если задан METRICS_MULTIPROC_DIR"""
+    directory = get_metrics_multiproc_dir()
+    if directory:
+        return MmapStore(directory)
+    return LocalStore()
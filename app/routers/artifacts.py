@@ -0,0 +1,172 @@
+import os
+import re
+from typing import Optional, Tuple
+
+import anyio
+from fastapi import APIRouter, HTTPException
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.types import Receive, Scope, Send
+
+from app.services.artifacts import artifact_registry
+
+router = APIRouter(prefix="/api/artifacts", tags=["WAN Artifacts"])
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+# Расширение ASGI для передачи файла через sendfile без копирования в Python.
+# uvicorn его не предоставляет (как и http.response.pathsend)
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+
+def _parse_single_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Разбирает Range с одним диапазоном, возвращает (start, end) включительно
+
+    Raises:
+        ValueError: диапазон некорректен или не пересекается с файлом
+    """
+    match = _RANGE_RE.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        raise ValueError(header)
+    if not first:
+        # Суффикс: последние N байт
+        length = int(last)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in candidates
+
+
+class ArtifactResponse(FileResponse):
+    """
+    FileResponse с поддержкой If-None-Match и передачей файла без копирования
+
+    Если сервер поддерживает расширение http.response.zerocopysend, тело
+    (целиком или один диапазон Range) отдается через sendfile. Иначе полный
+    файл отдается стандартным FileResponse (pathsend или чтение в потоке),
+    а один диапазон читается блоками в потоке, не блокируя event loop.
+
+    uvicorn, под которым работает шлюз, не предоставляет ни zerocopysend,
+    ни pathsend, поэтому под ним всегда используется чтение в потоке.
+    Передача через sendfile требует ASGI сервера с zerocopysend.
+    """
+
+    # Блоки чтения в потоке: видео отдается за меньшее число переходов в поток
+    chunk_size = 1024 * 1024
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        request_headers = Headers(scope=scope)
+        etag = self.headers["etag"]
+
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match and _etag_matches(if_none_match, etag):
+            not_modified = Response(
+                status_code=304,
+                headers={"etag": etag, "last-modified": self.headers["last-modified"]},
+            )
+            await not_modified(scope, receive, send)
+            return
+
+        size = self.stat_result.st_size
+        http_range = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if http_range is not None and (if_range is None or if_range == etag):
+            try:
+                byte_range = _parse_single_range(http_range, size)
+            except ValueError:
+                response = Response(status_code=416, headers={"content-range": f"bytes */{size}"})
+                await response(scope, receive, send)
+                return
+            if byte_range is not None:
+                await self._send_range(scope, send, *byte_range)
+                return
+            # Несколько диапазонов — multipart/byteranges средствами starlette
+            await super().__call__(scope, receive, send)
+            return
+
+        if self._zerocopy(scope):
+            await send({"type": "http.response.start", "status": 200, "headers": self.raw_headers})
+            await self._send_zerocopy(send, 0, size)
+            return
+
+        await super().__call__(scope, receive, send)
+
+    @staticmethod
+    def _zerocopy(scope: Scope) -> bool:
+        return ZEROCOPY_EXTENSION in scope.get("extensions", {}) and scope["method"].upper() != "HEAD"
+
+    async def _send_range(self, scope: Scope, send: Send, start: int, end: int):
+        size = self.stat_result.st_size
+        length = end - start + 1
+        headers = self.headers.mutablecopy()
+        headers["content-range"] = f"bytes {start}-{end}/{size}"
+        headers["content-length"] = str(length)
+        await send({"type": "http.response.start", "status": 206, "headers": headers.raw})
+
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif self._zerocopy(scope):
+            await self._send_zerocopy(send, start, length)
+        else:
+            async with await anyio.open_file(self.path, mode="rb") as file:
+                await file.seek(start)
+                remaining = length
+                while remaining > 0:
+                    chunk = await file.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+                if remaining > 0:
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def _send_zerocopy(self, send: Send, offset: int, count: int):
+        with open(self.path, "rb") as file:
+            await send({
+                "type": ZEROCOPY_EXTENSION,
+                "file": file,
+                "offset": offset,
+                "count": count,
+                "more_body": False,
+            })
+
+
+@router.api_route("/{artifact_id}", methods=["GET", "HEAD"])
+async def get_artifact(artifact_id: str):
+    """
+    Отдает сгенерированный файл
+
+    Поддерживает Range (докачка и перемотка видео), ETag/If-None-Match
+    и передачу через sendfile, если сервер это умеет (uvicorn — нет)
+    """
+    artifact = artifact_registry.get(artifact_id)
+    if artifact is None:
+        raise HTTPException(status_code=404, detail="Артефакт не найден")
+
+    try:
+        stat_result = await anyio.to_thread.run_sync(os.stat, artifact.path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Файл артефакта удален")
+
+    return ArtifactResponse(
+        artifact.path,
+        media_type=artifact.media_type,
+        filename=os.path.basename(artifact.path),
+        stat_result=stat_result,
+        headers={"cache-control": "private, max-age=86400"},
+        content_disposition_type="inline",
+    )
@@ -1,13 +1,34 @@
-from typing import Optional
+import asyncio
+import json
+from contextlib import AsyncExitStack
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Literal, Optional, TypeVar, Union
 
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel, Field
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field
 
+from app.config import get_image_output, get_wan_mock_mode
 from app.logger import logger
-from app.services.wan_client import generate_image, generate_text, generate_video
+from app.services.admission import AdmissionRejected, DeadlineExceeded, image_limiter, text_limiter
+from app.services.backends import backend_pool
+from app.services.circuit_breaker import OPEN
+from app.services.clients import BATCH, INTERACTIVE, STANDARD, Client, resolve_client
+from app.services.deadlines import remaining
+from app.services.jobs import REJECTED, Job, job_manager
+from app.services.payloads import INLINE, STREAM
+from app.services.wan_client import UpstreamStream, generate_image, generate_text, stream_image
 
 router = APIRouter(prefix="/api", tags=["WAN Generation"])
 
+# Интервал keep-alive комментариев в SSE потоке (секунды)
+SSE_KEEPALIVE_INTERVAL = 15
+# Максимум промптов в одном запросе /generate/image/batch
+IMAGE_BATCH_MAX_ITEMS = 64
+# Статус ответа, если клиент закрыл соединение до результата (как в nginx)
+CLIENT_CLOSED_REQUEST = 499
+
+T = TypeVar("T")
+
 
 # Базовые модели запросов
 class GenerateRequest(BaseModel):
@@ -24,6 +45,18 @@ class ImageGenerationRequest(BaseModel):
     steps: int = Field(50, ge=10, le=100, description="Количество шагов генерации")
     api_url: Optional[str] = None
     timeout: Optional[int] = None
+    cache: bool = Field(True, description="Использовать кэш результатов")
+    output: Optional[Literal["inline", "artifact", "stream"]] = Field(
+        None,
+        description="Результат: inline — ответ апстрима, artifact — ссылки на файлы изображений, "
+                    "stream — тело ответа апстрима по частям (по умолчанию IMAGE_OUTPUT)"
+    )
+
+
+class ImageBatchRequest(BaseModel):
+    items: List[ImageGenerationRequest] = Field(
+        ..., min_length=1, max_length=IMAGE_BATCH_MAX_ITEMS, description="Запросы генерации изображений"
+    )
 
 
 class VideoGenerationRequest(BaseModel):
@@ -35,11 +68,195 @@ class VideoGenerationRequest(BaseModel):
     ckpt_dir: Optional[str] = Field(None, description="Путь к директории с чекпоинтами")
     generate_script_path: Optional[str] = Field(None, description="Путь к скрипту generate.py")
     timeout: Optional[int] = None
+    cache: bool = Field(True, description="Использовать кэш результатов")
+    priority: int = Field(0, ge=-10, le=10, description="Приоритет среди заданий клиента (больше — раньше)")
+
+
+# Модели ответов. Поля, которых нет в ответе, не выводятся (response_model_exclude_unset),
+# поэтому формат ответа совпадает с dict из wan_client, а FastAPI сериализует его
+# через pydantic-core без обхода jsonable_encoder
+class GenerationResponse(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    result: Any = Field(None, description="Результат генерации (null при ошибке)")
+    error: Optional[str] = Field(None, description="Описание ошибки")
+    elapsed_time: Optional[float] = Field(None, description="Время выполнения в секундах")
+    api_url: Optional[str] = Field(None, description="Апстрим, выполнивший запрос")
+    cached: Optional[bool] = Field(None, description="Результат взят из кэша")
+    batch_size: Optional[int] = Field(None, description="Размер пакета запросов к апстриму")
+    retries: Optional[int] = Field(None, description="Сколько раз запрос к апстриму повторялся")
+    hedged: Optional[bool] = Field(None, description="Ответ получен от hedged запроса")
+    warning: Optional[str] = None
+
+
+class ImageBatchItemResponse(GenerationResponse):
+    status_code: Optional[int] = Field(None, description="Код отказа по лимиту параллелизма")
+    retry_after: Optional[int] = Field(None, description="Через сколько секунд повторить элемент")
+
+
+class ImageBatchResponse(BaseModel):
+    results: List[ImageBatchItemResponse]
+    count: int
+    succeeded: int
+
+
+def client_dependency(default_class: str) -> Callable[..., Client]:
+    """Зависимость: клиент из X-API-Key и класс приоритета из X-Priority-Class"""
+    def dependency(
+        x_api_key: Optional[str] = Header(None, description="API ключ клиента"),
+        x_priority_class: Optional[str] = Header(None, description="Класс приоритета: interactive, standard, batch"),
+    ) -> Client:
+        try:
+            return resolve_client(x_api_key, x_priority_class, default_class)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return dependency
+
+
+# Класс приоритета по умолчанию зависит от endpoint
+interactive_client = client_dependency(INTERACTIVE)
+standard_client = client_dependency(STANDARD)
+batch_client = client_dependency(BATCH)
+
+
+def image_output(request: ImageGenerationRequest) -> str:
+    """Режим результата изображения: из запроса или IMAGE_OUTPUT"""
+    return request.output or get_image_output()
+
+
+def image_params(request: ImageGenerationRequest) -> dict:
+    """Параметры generate_image из запроса"""
+    output = image_output(request)
+    return {
+        "prompt": request.prompt,
+        "negative_prompt": request.negative_prompt,
+        "width": request.width,
+        "height": request.height,
+        "steps": request.steps,
+        "api_url": request.api_url,
+        "timeout": request.timeout,
+        "cache": request.cache,
+        # Пакетные запросы не передаются потоком
+        "output": INLINE if output == STREAM else output
+    }
+
+
+def video_job_params(request: VideoGenerationRequest) -> dict:
+    """Параметры generate_video для задания в очереди"""
+    return {
+        "prompt": request.prompt,
+        "duration": request.duration,
+        "fps": request.fps,
+        "size": request.size,
+        "task": request.task,
+        "ckpt_dir": request.ckpt_dir,
+        "generate_script_path": request.generate_script_path,
+        "timeout": request.timeout,
+        "cache": request.cache
+    }
+
+
+async def _wait_disconnect(http_request: Request):
+    """
+    Ждет отключения клиента
+
+    Тело запроса к этому моменту уже прочитано, поэтому receive() возвращает
+    только http.disconnect. Request.is_disconnected() здесь не подходит:
+    за BaseHTTPMiddleware его мгновенная отмена теряет сообщение об отключении
+    """
+    while True:
+        message = await http_request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def until_disconnected(
+    http_request: Request,
+    awaitable: Awaitable[T],
+    on_disconnect: Optional[Callable[[], None]] = None
+) -> T:
+    """
+    Ждет awaitable, пока клиент держит соединение
+
+    Если клиент отключился, выполнение отменяется (слот ограничения
+    параллелизма освобождается сразу), вызывается on_disconnect
+    и возвращается 499
+
+    Raises:
+        HTTPException: клиент закрыл соединение (499)
+    """
+    task = asyncio.ensure_future(awaitable)
+    disconnect = asyncio.ensure_future(_wait_disconnect(http_request))
+    try:
+        await asyncio.wait({task, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+        if task.done():
+            return task.result()
+    finally:
+        task.cancel()
+        disconnect.cancel()
+        await asyncio.gather(task, disconnect, return_exceptions=True)
+    if on_disconnect is not None:
+        on_disconnect()
+    logger.info("Клиент закрыл соединение, запрос %s %s прерван", http_request.method, http_request.url.path)
+    raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail="Клиент закрыл соединение")
+
+
+async def _sse_events(job: Job, http_request: Optional[Request] = None) -> AsyncIterator[str]:
+    """
+    Форматирует события задания как Server-Sent Events
+
+    Если передан http_request, задание отменяется, когда клиент закрывает соединение
+    """
+    yield f"event: job\ndata: {json.dumps({'job_id': job.id}, ensure_ascii=False)}\n\n"
+    events = job.events().__aiter__()
+    # Ожидание события не отменяется по таймауту keep-alive: отмена закрыла бы генератор событий
+    next_event = asyncio.ensure_future(events.__anext__())
+    disconnect = asyncio.ensure_future(_wait_disconnect(http_request)) if http_request is not None else None
+    try:
+        while True:
+            waiting = {next_event} if disconnect is None else {next_event, disconnect}
+            done, _ = await asyncio.wait(waiting, timeout=SSE_KEEPALIVE_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+            if disconnect in done:
+                return
+            if next_event not in done:
+                # Держим соединение живым для прокси во время долгих шагов
+                yield ": keep-alive\n\n"
+                continue
+            try:
+                event = next_event.result()
+            except StopAsyncIteration:
+                return
+            yield f"event: {event.get('event', 'message')}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+            next_event = asyncio.ensure_future(events.__anext__())
+    finally:
+        next_event.cancel()
+        if disconnect is not None:
+            disconnect.cancel()
+            if not job.finished:
+                job_manager.cancel(job.id)
+                logger.info("Клиент закрыл поток событий, задание %s отменено", job.id)
+
+
+def job_event_stream(job: Job, http_request: Optional[Request] = None) -> StreamingResponse:
+    """
+    SSE ответ с событиями задания: log, progress и финальное result
+
+    С http_request задание принадлежит соединению и отменяется при отключении клиента
+    """
+    return StreamingResponse(
+        _sse_events(job, http_request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 # Endpoints
-@router.post("/generate/text")
-async def generate_text_endpoint(request: GenerateRequest):
+@router.post("/generate/text", response_model=GenerationResponse, response_model_exclude_unset=True)
+async def generate_text_endpoint(
+    request: GenerateRequest,
+    http_request: Request,
+    client: Client = Depends(interactive_client)
+):
     """
     Генерирует текст на основе промпта через WAN2.2
     
@@ -53,24 +270,31 @@ async def generate_text_endpoint(request: GenerateRequest):
     if not request.prompt or not request.prompt.strip():
         raise HTTPException(status_code=400, detail="Prompt не может быть пустым")
     
-    logger.info(f"Received text generation request with prompt length: {len(request.prompt)}")
+    logger.info("Received text generation request with prompt length: %s", len(request.prompt))
+    
+    async def generate() -> dict:
+        async with text_limiter.slot(client):
+            return await generate_text(
+                prompt=request.prompt,
+                api_url=request.api_url,
+                timeout=request.timeout
+            )
     
     try:
-        result = await generate_text(
-            prompt=request.prompt,
-            api_url=request.api_url,
-            timeout=request.timeout
-        )
-        
-        return result
-        
+        return await until_disconnected(http_request, generate())
+    except (HTTPException, AdmissionRejected):
+        raise
     except Exception as e:
-        logger.error(f"Error in text generation endpoint: {str(e)}")
+        logger.error("Error in text generation endpoint: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/generate/image")
-async def generate_image_endpoint(request: ImageGenerationRequest):
+@router.post("/generate/image", response_model=GenerationResponse, response_model_exclude_unset=True)
+async def generate_image_endpoint(
+    request: ImageGenerationRequest,
+    http_request: Request,
+    client: Client = Depends(interactive_client)
+):
     """
     Генерирует изображение на основе промпта через WAN2.2
     
@@ -82,34 +306,144 @@ async def generate_image_endpoint(request: ImageGenerationRequest):
     - steps: количество шагов генерации (опционально, по умолчанию 50)
     - api_url: URL API (опционально)
     - timeout: таймаут в секундах (опционально)
+    - cache: использовать кэш результатов (опционально, по умолчанию true)
+    - output: inline, artifact или stream (опционально, по умолчанию IMAGE_OUTPUT)
     
-    Возвращает URL изображения и метрики производительности
+    Возвращает URL изображения и метрики производительности.
+    С output=artifact изображения base64 сохраняются в файлы и заменяются
+    ссылками на артефакты, с output=stream тело ответа апстрима
+    передается клиенту по частям как есть
     """
     if not request.prompt or not request.prompt.strip():
         raise HTTPException(status_code=400, detail="Prompt не может быть пустым")
     
-    logger.info(f"Received image generation request: {request.width}x{request.height}, {request.steps} steps")
+    logger.info("Received image generation request: %sx%s, %s steps", request.width, request.height, request.steps)
+    
+    if image_output(request) == STREAM:
+        return await _stream_image_response(request, http_request, client)
+    
+    async def generate() -> dict:
+        async with image_limiter.slot(client):
+            return await generate_image(**image_params(request))
     
     try:
-        result = await generate_image(
-            prompt=request.prompt,
-            negative_prompt=request.negative_prompt,
-            width=request.width,
-            height=request.height,
-            steps=request.steps,
-            api_url=request.api_url,
-            timeout=request.timeout
-        )
-        
-        return result
-        
+        return await until_disconnected(http_request, generate())
+    except (HTTPException, AdmissionRejected):
+        raise
     except Exception as e:
-        logger.error(f"Error in image generation endpoint: {str(e)}")
+        logger.error("Error in image generation endpoint: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/generate/video")
-async def generate_video_endpoint(request: VideoGenerationRequest):
+async def _stream_image_response(
+    request: ImageGenerationRequest,
+    http_request: Request,
+    client: Client
+) -> Union[dict, StreamingResponse]:
+    """
+    Передает тело ответа апстрима клиенту по частям
+
+    Слот ограничения параллелизма изображений занят до конца передачи
+    """
+    slot = AsyncExitStack()
+
+    async def open_stream() -> Union[dict, UpstreamStream]:
+        await slot.enter_async_context(image_limiter.slot(client))
+        try:
+            stream = await stream_image(
+                prompt=request.prompt,
+                negative_prompt=request.negative_prompt,
+                width=request.width,
+                height=request.height,
+                steps=request.steps,
+                api_url=request.api_url,
+                timeout=request.timeout
+            )
+        except BaseException:
+            await slot.aclose()
+            raise
+        if isinstance(stream, dict):
+            await slot.aclose()
+        return stream
+
+    try:
+        stream = await until_disconnected(http_request, open_stream())
+    except (HTTPException, AdmissionRejected):
+        raise
+    except Exception as e:
+        logger.error("Error in image generation endpoint: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+    if isinstance(stream, dict):
+        return stream
+
+    async def relay() -> AsyncIterator[bytes]:
+        try:
+            async for chunk in stream.chunks:
+                yield chunk
+        finally:
+            await stream.aclose()
+            await slot.aclose()
+
+    return StreamingResponse(relay(), media_type=stream.media_type)
+
+
+async def _generate_image_item(request: ImageGenerationRequest, client: Client) -> dict:
+    """Один элемент пакетного запроса: ошибка не затрагивает остальные элементы"""
+    try:
+        async with image_limiter.slot(client):
+            return await generate_image(**image_params(request))
+    except AdmissionRejected as e:
+        return {"result": None, "error": str(e), "status_code": e.status_code, "retry_after": e.retry_after}
+    except Exception as e:
+        logger.error("Error in image batch item: %s", e)
+        return {"result": None, "error": str(e)}
+
+
+@router.post("/generate/image/batch", response_model=ImageBatchResponse, response_model_exclude_unset=True)
+async def generate_image_batch_endpoint(
+    request: ImageBatchRequest,
+    http_request: Request,
+    client: Client = Depends(batch_client)
+):
+    """
+    Генерирует несколько изображений одним запросом
+    
+    Принимает:
+    - items: список запросов в формате /api/generate/image (до 64);
+      output=stream для элементов не поддерживается
+    
+    Каждый элемент проходит контроль допуска для изображений отдельно,
+    по умолчанию в классе приоритета batch.
+    При включенном WAN_BATCH_ENABLED элементы уходят в апстрим пакетами.
+    
+    Возвращает результаты в порядке items; ошибка одного элемента
+    (в том числе отказ по лимиту) не влияет на остальные
+    """
+    for index, item in enumerate(request.items):
+        if not item.prompt or not item.prompt.strip():
+            raise HTTPException(status_code=400, detail=f"Prompt не может быть пустым (элемент {index})")
+        if item.output == STREAM:
+            raise HTTPException(status_code=400, detail=f"output=stream недоступен в пакетном запросе (элемент {index})")
+    
+    logger.info("Received image batch request: %s items", len(request.items))
+    
+    results = await until_disconnected(
+        http_request,
+        asyncio.gather(*(_generate_image_item(item, client) for item in request.items))
+    )
+    return {
+        "results": results,
+        "count": len(results),
+        "succeeded": sum(1 for result in results if result.get("result") is not None),
+    }
+
+
+@router.post("/generate/video", response_model=GenerationResponse, response_model_exclude_unset=True)
+async def generate_video_endpoint(
+    request: VideoGenerationRequest,
+    http_request: Request,
+    client: Client = Depends(standard_client)
+):
     """
     Генерирует видео на основе промпта через локальный скрипт generate.py
     
@@ -122,42 +456,84 @@ async def generate_video_endpoint(request: VideoGenerationRequest):
     - ckpt_dir: путь к директории с чекпоинтами (опционально)
     - generate_script_path: путь к скрипту generate.py (опционально)
     - timeout: таймаут в секундах (опционально, рекомендуется минимум 600)
+    - cache: использовать кэш результатов (опционально, по умолчанию true)
     
     Возвращает путь к сгенерированному видео и метрики производительности
     
-    ⚠️ Внимание: генерация видео может занимать много времени (5-15 минут)
+    Если клиент закрывает соединение, задание отменяется и процесс генерации останавливается
+    
+    ⚠️ Внимание: генерация видео может занимать много времени (5-15 минут).
+    Для долгих генераций используйте асинхронный API: POST /api/jobs/video
     Запускает команду: python generate.py --task ti2v-5B --size 1280*704 --ckpt_dir ./Wan2.2-TI2V-5B --offload_model True --convert_model_dtype --t5_cpu --prompt "..."
     """
     if not request.prompt or not request.prompt.strip():
         raise HTTPException(status_code=400, detail="Prompt не может быть пустым")
     
-    logger.info(f"Received video generation request: {request.duration}s, {request.fps}fps")
+    logger.info("Received video generation request: %ss, %sfps", request.duration, request.fps)
+    
+    job = await job_manager.submit(video_job_params(request), priority=request.priority, client=client)
     
     try:
-        result = await generate_video(
-            prompt=request.prompt,
-            duration=request.duration,
-            fps=request.fps,
-            size=request.size,
-            task=request.task,
-            ckpt_dir=request.ckpt_dir,
-            generate_script_path=request.generate_script_path,
-            timeout=request.timeout
-        )
+        await until_disconnected(http_request, job.wait(), on_disconnect=lambda: job_manager.cancel(job.id))
         
-        return result
+        if job.status == REJECTED:
+            if job.deadline is not None and remaining(job.deadline) <= 0:
+                raise DeadlineExceeded(job.error)
+            raise AdmissionRejected(job.error, status_code=503, retry_after=job_manager.retry_after())
+        if job.result is None:
+            raise HTTPException(status_code=500, detail=job.error or "Задание не выполнено")
+        return job.result
         
+    except (HTTPException, AdmissionRejected):
+        raise
     except Exception as e:
-        logger.error(f"Error in video generation endpoint: {str(e)}")
+        logger.error("Error in video generation endpoint: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/generate/video/stream")
+async def generate_video_stream_endpoint(
+    request: VideoGenerationRequest,
+    http_request: Request,
+    client: Client = Depends(standard_client)
+):
+    """
+    Генерирует видео, передавая ход выполнения как Server-Sent Events
+    
+    Принимает те же параметры, что и /api/generate/video.
+    События:
+    - job: ID задания
+    - status: задание начало выполняться
+    - log: строка вывода generate.py
+    - progress: шаг денойзинга (step, total, progress)
+    - result: финальное состояние задания с результатом
+    
+    Задание отменяется, если клиент закрывает поток до результата
+    """
+    if not request.prompt or not request.prompt.strip():
+        raise HTTPException(status_code=400, detail="Prompt не может быть пустым")
+    
+    logger.info("Received streaming video generation request: %ss, %sfps", request.duration, request.fps)
+    
+    job = await job_manager.submit(video_job_params(request), priority=request.priority, client=client)
+    return job_event_stream(job, http_request)
+
+
 @router.get("/health")
 async def health_check():
-    """Проверка здоровья API шлюза"""
+    """
+    Проверка здоровья API шлюза
+    
+    status "degraded" означает, что circuit breaker открыт у всех апстримов
+    и запросы текста и изображений сейчас отклоняются
+    """
+    circuits = backend_pool.circuit_states()
+    degraded = not get_wan_mock_mode() and all(state == OPEN for state in circuits.values())
     return {
-        "status": "healthy",
+        "status": "degraded" if degraded else "healthy",
         "service": "WAN2.2 API Gateway",
+        "mock_mode": get_wan_mock_mode(),
+        "upstreams": circuits,
         "capabilities": {
             "text_generation": True,
             "image_generation": True,
@@ -0,0 +1,66 @@
+import asyncio
+
+from fastapi import APIRouter, Depends, HTTPException, Response
+
+from app.routers.generate import VideoGenerationRequest, batch_client, job_event_stream, video_job_params
+from app.services.clients import Client
+from app.services.jobs import job_manager
+
+router = APIRouter(prefix="/api/jobs", tags=["WAN Jobs"])
+
+
+@router.post("/video", status_code=202)
+async def create_video_job(
+    request: VideoGenerationRequest,
+    response: Response,
+    client: Client = Depends(batch_client)
+):
+    """
+    Ставит генерацию видео в очередь и сразу возвращает ID задания
+
+    Принимает те же параметры, что и /api/generate/video.
+    Статус и результат доступны через GET /api/jobs/{job_id}
+    """
+    if not request.prompt or not request.prompt.strip():
+        raise HTTPException(status_code=400, detail="Prompt не может быть пустым")
+
+    job = await job_manager.submit(video_job_params(request), priority=request.priority, client=client)
+    response.headers["Location"] = f"/api/jobs/{job.id}"
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/jobs/{job.id}"
+    }
+
+
+@router.get("/{job_id}")
+async def get_job(job_id: str):
+    """Возвращает статус, прогресс и результат задания"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return job.snapshot()
+
+
+@router.get("/{job_id}/events")
+async def get_job_events(job_id: str):
+    """Поток событий задания (log, progress, result) в формате Server-Sent Events"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return job_event_stream(job)
+
+
+@router.delete("/{job_id}")
+async def cancel_job(job_id: str):
+    """Отменяет задание в очереди или прерывает выполняющуюся генерацию"""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    
+    # Даем выполняющемуся заданию остановить процесс генерации
+    try:
+        await asyncio.wait_for(job.wait(), timeout=5)
+    except asyncio.TimeoutError:
+        pass
+    return job.snapshot()
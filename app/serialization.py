@@ -0,0 +1,90 @@
+"""
+Сериализация JSON для ответов шлюза и разбора ответов апстрима
+
+Библиотека выбирается по JSON_BACKEND при импорте:
+    - auto: orjson, если установлен, иначе стандартный json (по умолчанию)
+    - orjson: orjson; если пакет не установлен — предупреждение и стандартный json
+    - stdlib: стандартный json
+
+orjson ставится опционально: pip install -e ".[fast-json]"
+
+Ответы endpoints генерации описаны typed моделями (response_model), их
+FastAPI сериализует без обхода jsonable_encoder. Остальные endpoints
+с orjson отвечают через FastJSONResponse.
+"""
+import json
+from typing import Any, Optional, Union
+
+from fastapi.datastructures import Default
+from fastapi.responses import JSONResponse
+
+from app.config import get_json_backend
+from app.logger import logger
+
+ORJSON = "orjson"
+STDLIB = "stdlib"
+
+
+def _load_orjson() -> Optional[Any]:
+    backend = get_json_backend()
+    if backend == STDLIB:
+        return None
+    try:
+        import orjson
+    except ImportError:
+        if backend == ORJSON:
+            logger.warning("JSON_BACKEND=orjson, но пакет orjson не установлен. Используется стандартный json")
+        return None
+    return orjson
+
+
+_orjson = _load_orjson()
+
+
+def json_backend() -> str:
+    """Используемая библиотека JSON: orjson или stdlib"""
+    return ORJSON if _orjson is not None else STDLIB
+
+
+def json_loads(data: Union[bytes, str]) -> Any:
+    """
+    Разбирает JSON
+
+    Raises:
+        ValueError: некорректный JSON
+    """
+    if _orjson is not None:
+        return _orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(value: Any) -> bytes:
+    """
+    Сериализует значение в компактный JSON (UTF-8)
+
+    Raises:
+        TypeError: значение не сериализуется в JSON
+    """
+    if _orjson is not None:
+        return _orjson.dumps(value, option=_orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse, сериализующий через выбранную библиотеку JSON"""
+
+    def render(self, content: Any) -> bytes:
+        return json_dumps(content)
+
+
+def default_response_class() -> Any:
+    """
+    Класс ответа по умолчанию для приложения
+
+    С orjson — FastJSONResponse: ответы с response_model проходят
+    model_dump + orjson, что на ответах с изображениями base64 быстрее
+    сериализации pydantic-core. Со стандартным json остается класс FastAPI
+    по умолчанию: тогда ответы с response_model сериализуются pydantic-core
+    сразу в байты, что быстрее, чем отдавать их в json.dumps
+    """
+    return FastJSONResponse if _orjson is not None else Default(JSONResponse)
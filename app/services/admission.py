@@ -0,0 +1,267 @@
+"""
+Ограничение параллелизма и контроль допуска запросов
+
+На каждый тип генерации свой лимитер: не больше max_concurrent запросов
+выполняются одновременно, еще не больше max_queue ждут свободного места,
+но не дольше max_wait секунд. Остальные сразу отклоняются с Retry-After,
+чтобы задержка оставалась предсказуемой при перегрузке.
+
+Ожидание ограничено и дедлайном запроса (app.services.deadlines): запрос,
+который по оценке не дождется слота и выполнения до дедлайна, отклоняется
+сразу с 504 (DEADLINE_EARLY_REJECT), а не занимает место в очереди.
+
+Очередь ожидания справедлива между клиентами API (app.services.clients):
+клиент с большим потоком запросов не вытесняет остальных.
+"""
+import asyncio
+import math
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+from app.config import (
+    get_client_max_queue_share,
+    get_deadline_early_reject,
+    get_image_max_concurrency,
+    get_image_max_queue,
+    get_image_max_wait,
+    get_text_max_concurrency,
+    get_text_max_queue,
+    get_text_max_wait,
+)
+from app.metrics import metrics
+from app.services.clients import Client, default_client
+from app.services.deadlines import remaining
+from app.services.fair_queue import FairQueue
+
+
+class AdmissionRejected(Exception):
+    """Запрос отклонен контролем допуска"""
+
+    def __init__(self, message: str, status_code: int = 429, retry_after: int = 1):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(AdmissionRejected):
+    """Дедлайн запроса истек или работа не успеет завершиться до него (504)"""
+
+    def __init__(self, message: str):
+        super().__init__(message, status_code=504)
+
+
+def estimate_retry_after(avg_duration: float, queued: int, concurrency: int) -> int:
+    """Оценивает, через сколько секунд в очереди освободится место"""
+    if avg_duration <= 0:
+        return 1
+    return max(1, math.ceil(avg_duration * (queued + 1) / max(concurrency, 1)))
+
+
+def client_queue_quota(max_queue: int) -> int:
+    """Сколько мест в очереди может занять один клиент (CLIENT_MAX_QUEUE_SHARE)"""
+    return max(math.floor(max_queue * get_client_max_queue_share()), 1)
+
+
+class ConcurrencyLimiter:
+    """
+    Семафор с ограниченной очередью ожидания и таймаутом ожидания
+
+    Ожидающие обслуживаются справедливо между клиентами (FairQueue):
+    сначала по классу приоритета, затем пропорционально весам клиентов.
+    Один клиент не может занять больше client_queue_quota() мест в очереди.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_wait_timeout = 0
+        self.rejected_client_quota = 0
+        self.rejected_deadline = 0
+        self._waiters = FairQueue()
+        # Выполняющиеся запросы по меткам клиентов
+        self._active_clients: Dict[str, int] = defaultdict(int)
+        self._waiting_clients: Dict[str, int] = defaultdict(int)
+        # Скользящее среднее времени удержания слота для Retry-After
+        self._avg_hold = 0.0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _retry_after(self) -> int:
+        return estimate_retry_after(self._avg_hold, self.waiting, self.max_concurrent)
+
+    async def acquire(self, client: Optional[Client] = None):
+        """
+        Занимает слот для клиента
+
+        Raises:
+            AdmissionRejected: очередь ожидания или квота клиента заполнены (429)
+                или место не освободилось за max_wait (503)
+            DeadlineExceeded: место не освободится до дедлайна запроса (504)
+        """
+        client = client or default_client()
+        started = time.monotonic()
+        left = remaining()
+        if left is not None and left <= 0:
+            self.rejected_deadline += 1
+            raise DeadlineExceeded(f"Дедлайн запроса истек до выполнения {self.name}")
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            self._admit(client, started)
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise AdmissionRejected(
+                f"Слишком много запросов {self.name}: очередь заполнена ({self.max_queue})",
+                status_code=429,
+                retry_after=self._retry_after(),
+            )
+        quota = client_queue_quota(self.max_queue)
+        if self._waiters.depth(client.id) >= quota:
+            self.rejected_client_quota += 1
+            raise AdmissionRejected(
+                f"Слишком много запросов {self.name} от клиента {client.label}: в очереди уже {quota}",
+                status_code=429,
+                retry_after=self._retry_after(),
+            )
+        if left is not None and get_deadline_early_reject() and self._avg_hold > 0:
+            # Оценка: ожидание слота в очереди плюс само выполнение
+            expected = self._avg_hold * (self.waiting + 1) / max(self.max_concurrent, 1) + self._avg_hold
+            if left < expected:
+                self.rejected_deadline += 1
+                raise DeadlineExceeded(
+                    f"Запрос {self.name} не успеет выполниться до дедлайна: "
+                    f"осталось {left:.1f}s, ожидается {expected:.1f}s"
+                )
+
+        max_wait = self.max_wait if left is None else min(self.max_wait, left)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.push(waiter, client.id, weight=client.weight, priority_class=client.priority)
+        self._waiting_clients[client.label] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # Слот был передан в момент таймаута/отмены — возвращаем его
+                self.release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            if max_wait < self.max_wait:
+                self.rejected_deadline += 1
+                raise DeadlineExceeded(f"Дедлайн запроса истек в очереди {self.name}")
+            self.rejected_wait_timeout += 1
+            raise AdmissionRejected(
+                f"Нет свободных слотов {self.name} за {self.max_wait:.0f}s",
+                status_code=503,
+                retry_after=self._retry_after(),
+            )
+        finally:
+            self._waiting_clients[client.label] -= 1
+            if not self._waiting_clients[client.label]:
+                del self._waiting_clients[client.label]
+        self._admit(client, started)
+
+    def _admit(self, client: Client, started: float):
+        self.admitted += 1
+        self._active_clients[client.label] += 1
+        metrics.record_queue_wait(self.name, client.label, client.priority_class, time.monotonic() - started)
+
+    def release(self, client: Optional[Client] = None):
+        """Освобождает слот, передавая его следующему ожидающему"""
+        if client is not None:
+            self._active_clients[client.label] -= 1
+            if not self._active_clients[client.label]:
+                del self._active_clients[client.label]
+        # После уменьшения max_concurrent лишние слоты не передаются, а освобождаются
+        if self.active <= self.max_concurrent and self._wake_one():
+            # Слот переходит ожидающему без уменьшения active
+            return
+        self.active -= 1
+
+    def _wake_one(self) -> bool:
+        """Передает слот следующему ожидающему; False — ожидающих нет"""
+        while self._waiters:
+            waiter = self._waiters.pop()
+            if not waiter.done():
+                waiter.set_result(None)
+                return True
+        return False
+
+    def configure(self, max_concurrent: int, max_queue: int, max_wait: float):
+        """
+        Меняет лимиты на ходу (перечитывание настроек)
+
+        Выполняющиеся и уже ожидающие запросы не прерываются: при уменьшении
+        лимитов лишние слоты освобождаются по мере завершения запросов,
+        при увеличении свободные слоты сразу получают ожидающие
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        while self.active < self.max_concurrent and self._wake_one():
+            self.active += 1
+
+    @asynccontextmanager
+    async def slot(self, client: Optional[Client] = None):
+        """Контекстный менеджер: занимает слот на время выполнения блока"""
+        client = client or default_client()
+        await self.acquire(client)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            held = time.monotonic() - started
+            self._avg_hold = held if self._avg_hold == 0 else 0.8 * self._avg_hold + 0.2 * held
+            self.release(client)
+
+    def clients(self) -> Dict[str, Dict[str, int]]:
+        """Запросы в работе и в очереди по клиентам"""
+        labels = set(self._active_clients) | set(self._waiting_clients)
+        return {
+            label: {"active": self._active_clients.get(label, 0), "waiting": self._waiting_clients.get(label, 0)}
+            for label in sorted(labels)
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "max_wait": self.max_wait,
+            "client_queue_quota": client_queue_quota(self.max_queue),
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_wait_timeout": self.rejected_wait_timeout,
+            "rejected_client_quota": self.rejected_client_quota,
+            "rejected_deadline": self.rejected_deadline,
+            "avg_hold_seconds": round(self._avg_hold, 3),
+            "clients": self.clients(),
+        }
+
+
+# Лимитеры по типам генерации (видео ограничивается очередью заданий)
+text_limiter = ConcurrencyLimiter(
+    "text", get_text_max_concurrency(), get_text_max_queue(), get_text_max_wait()
+)
+image_limiter = ConcurrencyLimiter(
+    "image", get_image_max_concurrency(), get_image_max_queue(), get_image_max_wait()
+)
+
+
+def reconfigure_limiters():
+    """Применяет текущие лимиты TEXT_* и IMAGE_* к лимитерам"""
+    text_limiter.configure(get_text_max_concurrency(), get_text_max_queue(), get_text_max_wait())
+    image_limiter.configure(get_image_max_concurrency(), get_image_max_queue(), get_image_max_wait())
@@ -0,0 +1,343 @@
+"""
+Реестр сгенерированных файлов (артефактов), доступных для скачивания
+
+Клиенты получают artifact_id/artifact_url в ответе генерации и скачивают
+файл через GET /api/artifacts/{artifact_id}. Отдаются только файлы,
+зарегистрированные в реестре, произвольные пути с диска недоступны.
+
+Каждое задание генерации получает собственный путь результата в ARTIFACT_DIR
+(передается в generate.py как --save_file) и временную директорию, которая
+удаляется после завершения. Для готового файла реестр хранит размер,
+контрольную сумму и длительность видео.
+
+Фоновая очистка раз в ARTIFACT_JANITOR_INTERVAL секунд удаляет из ARTIFACT_DIR
+файлы старше ARTIFACT_MAX_AGE, а при превышении квоты ARTIFACT_MAX_BYTES —
+самые старые файлы. Файлы выполняющихся заданий не удаляются.
+"""
+import asyncio
+import hashlib
+import os
+import shutil
+import struct
+import time
+import uuid
+from contextlib import asynccontextmanager
+from threading import Lock
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from app.config import (
+    get_artifact_dir,
+    get_artifact_janitor_interval,
+    get_artifact_max_age,
+    get_artifact_max_bytes,
+    get_timeout,
+)
+from app.logger import logger
+
+# Поддиректория ARTIFACT_DIR с временными директориями заданий
+_SCRATCH_DIR = ".scratch"
+# Блок чтения файла при подсчете контрольной суммы
+_CHUNK_SIZE = 1024 * 1024
+# Поля метаданных файла в результате генерации
+METADATA_FIELDS = ("size_bytes", "checksum", "video_duration")
+
+
+class Artifact:
+    """Зарегистрированный файл"""
+
+    def __init__(self, artifact_id: str, path: str, media_type: str):
+        self.id = artifact_id
+        self.path = path
+        self.media_type = media_type
+        self.size_bytes: Optional[int] = None
+        # "sha256:<hex>"
+        self.checksum: Optional[str] = None
+        # Длительность видео в секундах (из заголовка MP4)
+        self.video_duration: Optional[float] = None
+
+    @property
+    def url(self) -> str:
+        return f"/api/artifacts/{self.id}"
+
+    def metadata(self) -> Dict[str, Any]:
+        """Известные метаданные файла"""
+        values = {name: getattr(self, name) for name in METADATA_FIELDS}
+        return {name: value for name, value in values.items() if value is not None}
+
+
+class JobOutput:
+    """Путь результата и временная директория одного задания генерации"""
+
+    def __init__(self, save_file: str, scratch_dir: str):
+        self.save_file = save_file
+        self.scratch_dir = scratch_dir
+        # Сохранить файл результата после завершения (иначе он удаляется как недописанный)
+        self.keep = False
+
+
+def _media_type(path: str) -> str:
+    extension = os.path.splitext(path)[1].lower()
+    return {
+        ".mp4": "video/mp4",
+        ".avi": "video/x-msvideo",
+        ".png": "image/png",
+        ".jpg": "image/jpeg",
+        ".jpeg": "image/jpeg",
+        ".webp": "image/webp",
+        ".gif": "image/gif",
+    }.get(extension, "application/octet-stream")
+
+
+def _artifact_id(path: str) -> str:
+    return hashlib.sha256(path.encode("utf-8")).hexdigest()[:32]
+
+
+def _mp4_duration(path: str) -> Optional[float]:
+    """Длительность MP4 из атома moov/mvhd, без сторонних библиотек"""
+    try:
+        with open(path, "rb") as f:
+            end = os.fstat(f.fileno()).st_size
+            containers = {b"moov"}
+            while f.tell() + 8 <= end:
+                start = f.tell()
+                size, kind = struct.unpack(">I4s", f.read(8))
+                header = 8
+                if size == 1:
+                    size = struct.unpack(">Q", f.read(8))[0]
+                    header = 16
+                elif size == 0:
+                    size = end - start
+                if size < header:
+                    return None
+                if kind in containers:
+                    # Спускаемся внутрь контейнера
+                    end = start + size
+                    continue
+                if kind == b"mvhd":
+                    version = f.read(4)[0]
+                    if version == 1:
+                        _, _, timescale, duration = struct.unpack(">QQIQ", f.read(28))
+                    else:
+                        _, _, timescale, duration = struct.unpack(">IIII", f.read(16))
+                    return round(duration / timescale, 3) if timescale else None
+                f.seek(start + size)
+    except (OSError, struct.error, IndexError):
+        return None
+    return None
+
+
+def describe_file(path: str) -> Dict[str, Any]:
+    """Размер, контрольная сумма и длительность видео (читает файл целиком, вызывать в потоке)"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+    metadata: Dict[str, Any] = {"size_bytes": size, "checksum": f"sha256:{digest.hexdigest()}"}
+    if _media_type(path).startswith("video/"):
+        duration = _mp4_duration(path)
+        if duration is not None:
+            metadata["video_duration"] = duration
+    return metadata
+
+
+class ArtifactRegistry:
+    """Отображение artifact_id -> файл на диске и очистка директории результатов"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._artifacts: Dict[str, Artifact] = {}
+        # Пути результатов и временные директории выполняющихся заданий
+        self._reserved: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.disk_bytes = 0
+        self.disk_files = 0
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+
+    def register(self, path: str, metadata: Optional[Dict[str, Any]] = None) -> Artifact:
+        """
+        Регистрирует файл. ID вычисляется из абсолютного пути, поэтому
+        повторная регистрация того же файла (например, из кэша) дает тот же ID
+        """
+        path = os.path.abspath(path)
+        artifact_id = _artifact_id(path)
+        with self._lock:
+            artifact = self._artifacts.get(artifact_id)
+            if artifact is None:
+                artifact = Artifact(artifact_id, path, _media_type(path))
+                self._artifacts[artifact_id] = artifact
+            for name in METADATA_FIELDS:
+                if metadata and metadata.get(name) is not None:
+                    setattr(artifact, name, metadata[name])
+            return artifact
+
+    async def inspect(self, path: str) -> Artifact:
+        """Регистрирует файл, посчитав его метаданные в отдельном потоке"""
+        metadata = await asyncio.to_thread(describe_file, path)
+        return self.register(path, metadata)
+
+    def get(self, artifact_id: str) -> Optional[Artifact]:
+        with self._lock:
+            return self._artifacts.get(artifact_id)
+
+    @asynccontextmanager
+    async def output(self, extension: str = ".mp4") -> AsyncIterator[JobOutput]:
+        """
+        Выделяет заданию путь результата и временную директорию
+
+        Временная директория удаляется при выходе, файл результата —
+        тоже, если задание не отметило его output.keep
+        """
+        name = uuid.uuid4().hex
+        directory = os.path.abspath(get_artifact_dir())
+        output = JobOutput(
+            os.path.join(directory, f"{name}{extension}"),
+            os.path.join(directory, _SCRATCH_DIR, name),
+        )
+        await asyncio.to_thread(os.makedirs, output.scratch_dir, exist_ok=True)
+        with self._lock:
+            self._reserved.update((output.save_file, output.scratch_dir))
+        try:
+            yield output
+        finally:
+            await asyncio.to_thread(_cleanup_output, output)
+            with self._lock:
+                self._reserved.difference_update((output.save_file, output.scratch_dir))
+
+    # --- Очистка директории результатов ---
+
+    def start(self):
+        """Запускает фоновую очистку (вызывается из lifespan приложения)"""
+        if get_artifact_janitor_interval() > 0:
+            self._task = asyncio.create_task(self._run_janitor())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run_janitor(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                logger.error("Ошибка очистки директории результатов: %s", e, exc_info=True)
+            await asyncio.sleep(get_artifact_janitor_interval())
+
+    def sweep(self):
+        """Удаляет просроченные файлы и самые старые файлы сверх квоты"""
+        directory = os.path.abspath(get_artifact_dir())
+        if not os.path.isdir(directory):
+            return
+        now = time.time()
+        with self._lock:
+            reserved = set(self._reserved)
+
+        files: List[Tuple[float, int, str]] = []
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.path not in reserved:
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+
+        deadline = now - get_artifact_max_age()
+        total = sum(size for _, size, _ in files)
+        removed: List[str] = []
+        for mtime, size, path in files:
+            if mtime >= deadline and total <= get_artifact_max_bytes():
+                break
+            if _remove_file(path):
+                total -= size
+                removed.append(path)
+                self.evicted_files += 1
+                self.evicted_bytes += size
+
+        self._remove_stale_scratch(directory, reserved, now)
+        with self._lock:
+            self.disk_bytes = total
+            self.disk_files = len(files) - len(removed)
+            # Записи реестра для удаленных файлов (в том числе вытесненных из кэша)
+            stale = [
+                artifact_id for artifact_id, artifact in self._artifacts.items()
+                if not os.path.exists(artifact.path)
+            ]
+            for artifact_id in stale:
+                del self._artifacts[artifact_id]
+        if removed:
+            logger.info(
+                "Очистка результатов: удалено файлов %s, осталось %s байт в %s",
+                len(removed), total, directory
+            )
+
+    @staticmethod
+    def _remove_stale_scratch(directory: str, reserved: Set[str], now: float):
+        """Временные директории заданий, оставшиеся после падения процесса"""
+        scratch_root = os.path.join(directory, _SCRATCH_DIR)
+        if not os.path.isdir(scratch_root):
+            return
+        # Директории других процессов шлюза старше таймаута генерации уже не используются
+        deadline = now - 2 * get_timeout(kind="video")
+        for entry in os.scandir(scratch_root):
+            if entry.path in reserved or not entry.is_dir():
+                continue
+            if entry.stat().st_mtime < deadline:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "artifacts": len(self._artifacts),
+                "active_outputs": len(self._reserved) // 2,
+                "disk_files": self.disk_files,
+                "disk_bytes": self.disk_bytes,
+                "max_bytes": get_artifact_max_bytes(),
+                "evicted_files": self.evicted_files,
+                "evicted_bytes": self.evicted_bytes,
+            }
+
+
+def _remove_file(path: str) -> bool:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        logger.warning("Не удалось удалить файл результата %s: %s", path, e)
+        return False
+    return True
+
+
+def _cleanup_output(output: JobOutput):
+    shutil.rmtree(output.scratch_dir, ignore_errors=True)
+    if not output.keep and os.path.exists(output.save_file):
+        _remove_file(output.save_file)
+
+
+def attach_artifact(response: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Регистрирует video_path из ответа генерации и добавляет artifact_id/artifact_url
+
+    Метаданные файла (size_bytes, checksum, video_duration), если они есть
+    в результате, сохраняются в реестре
+    """
+    result = response.get("result")
+    if not isinstance(result, dict):
+        return response
+    video_path = result.get("video_path")
+    if not video_path or not os.path.exists(video_path):
+        return response
+    artifact = artifact_registry.register(video_path, result)
+    return {
+        **response,
+        "result": {**result, **artifact.metadata(), "artifact_id": artifact.id, "artifact_url": artifact.url},
+    }
+
+
+# Глобальный реестр артефактов
+artifact_registry = ArtifactRegistry()
@@ -0,0 +1,225 @@
+"""
+Пул апстримов WAN2.2 API с балансировкой нагрузки
+
+Стратегии выбора (WAN_LB_STRATEGY):
+    - round_robin: взвешенный round-robin (smooth WRR, как в nginx)
+    - least_outstanding: наименьшее число запросов в работе с учетом веса
+    - ewma: наименьшая ожидаемая задержка (EWMA задержки × (запросов в работе + 1))
+
+Апстрим исключается из ротации после BACKEND_MAX_FAILURES ошибок подряд
+(по запросам или активным проверкам здоровья) и возвращается после
+успешной проверки здоровья. Если проверки отключены (BACKEND_HEALTH_INTERVAL=0),
+апстримы не исключаются. Апстримы с открытым circuit breaker не выбираются,
+а если открыты все — запрос сразу отклоняется.
+"""
+import asyncio
+import random
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import httpx
+
+from app.config import (
+    get_backend_health_interval,
+    get_backend_health_path,
+    get_backend_health_timeout,
+    get_backend_max_failures,
+    get_lb_strategy,
+    get_wan_api_urls,
+)
+from app.logger import logger
+from app.services.circuit_breaker import circuit_breakers
+
+# Коэффициент сглаживания EWMA задержки
+_EWMA_ALPHA = 0.3
+
+
+class Backend:
+    """Один апстрим WAN2.2 API и его текущее состояние"""
+
+    def __init__(self, url: str, weight: int = 1):
+        self.url = url
+        self.weight = max(weight, 1)
+        self.healthy = True
+        self.outstanding = 0
+        self.ewma_latency: Optional[float] = None
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_at: Optional[float] = None
+        # Текущий вес для smooth weighted round-robin
+        self._current_weight = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "weight": self.weight,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "ewma_latency_ms": round(self.ewma_latency * 1000, 2) if self.ewma_latency is not None else None,
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "ejections": self.ejections,
+            "circuit": circuit_breakers.get(self.url).snapshot(),
+        }
+
+
+class BackendPool:
+    """Набор апстримов, стратегия выбора и проверки здоровья"""
+
+    def __init__(self):
+        self.strategy = get_lb_strategy()
+        self.backends: List[Backend] = [Backend(url, weight) for url, weight in get_wan_api_urls()]
+        self._health_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Запускает активные проверки здоровья (вызывается из lifespan приложения)"""
+        logger.info(
+            "Пул апстримов: %s, стратегия %s",
+            ", ".join(f"{b.url} (вес {b.weight})" for b in self.backends), self.strategy
+        )
+        if get_backend_health_interval() > 0:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def reconfigure(self):
+        """Применяет новую стратегию и параметры проверок здоровья (перечитывание настроек)"""
+        self.strategy = get_lb_strategy()
+        await self.stop()
+        if get_backend_health_interval() > 0:
+            self._health_task = asyncio.create_task(self._health_loop())
+        else:
+            # Без активных проверок исключенные апстримы не вернулись бы в ротацию
+            for backend in self.backends:
+                backend.healthy = True
+
+    async def stop(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+
+    # --- Выбор апстрима ---
+
+    def select(self, exclude: Iterable[str] = ()) -> Backend:
+        """
+        Выбирает апстрим для запроса согласно стратегии
+
+        Raises:
+            CircuitOpen: circuit breaker открыт у всех апстримов
+        """
+        excluded = set(exclude)
+        pool = [b for b in self.backends if b.url not in excluded] or self.backends
+        available = [b for b in pool if circuit_breakers.get(b.url).available()]
+        if not available:
+            rejections = [circuit_breakers.get(b.url).reject() for b in pool]
+            raise min(rejections, key=lambda e: e.retry_after)
+        # Все апстримы исключены проверками здоровья — лучше попробовать любой, чем отказать сразу
+        candidates = [b for b in available if b.healthy] or available
+
+        if len(candidates) == 1:
+            return candidates[0]
+        if self.strategy == "least_outstanding":
+            return self._least_outstanding(candidates)
+        if self.strategy == "ewma":
+            return self._ewma(candidates)
+        return self._round_robin(candidates)
+
+    @staticmethod
+    def _round_robin(candidates: List[Backend]) -> Backend:
+        total = sum(b.weight for b in candidates)
+        best = None
+        for backend in candidates:
+            backend._current_weight += backend.weight
+            if best is None or backend._current_weight > best._current_weight:
+                best = backend
+        best._current_weight -= total
+        return best
+
+    @staticmethod
+    def _least_outstanding(candidates: List[Backend]) -> Backend:
+        lowest = min(b.outstanding / b.weight for b in candidates)
+        return random.choice([b for b in candidates if b.outstanding / b.weight == lowest])
+
+    @staticmethod
+    def _ewma(candidates: List[Backend]) -> Backend:
+        # Апстримы без замеров пробуем первыми, чтобы получить по ним оценку
+        unmeasured = [b for b in candidates if b.ewma_latency is None]
+        if unmeasured:
+            return random.choice(unmeasured)
+        return min(candidates, key=lambda b: b.ewma_latency * (b.outstanding + 1) / b.weight)
+
+    # --- Учет результатов запросов ---
+
+    def on_start(self, backend: Backend):
+        backend.outstanding += 1
+        backend.requests += 1
+
+    def on_finish(self, backend: Backend, latency: float, success: Optional[bool]):
+        """
+        Учитывает завершение запроса: success=True — ответ получен,
+        False — ошибка апстрима, None — запрос отменен (не влияет на здоровье)
+        """
+        backend.outstanding -= 1
+        if success is None:
+            return
+        if not success:
+            self._record_failure(backend)
+            return
+        backend.consecutive_failures = 0
+        if backend.ewma_latency is None:
+            backend.ewma_latency = latency
+        else:
+            backend.ewma_latency = _EWMA_ALPHA * latency + (1 - _EWMA_ALPHA) * backend.ewma_latency
+
+    def _record_failure(self, backend: Backend):
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        # Без активных проверок исключенный апстрим некому вернуть в ротацию
+        if get_backend_health_interval() <= 0:
+            return
+        if backend.healthy and backend.consecutive_failures >= get_backend_max_failures():
+            backend.healthy = False
+            backend.ejections += 1
+            backend.ejected_at = time.time()
+            logger.warning(
+                "Апстрим %s исключен из ротации после %s ошибок подряд", backend.url, backend.consecutive_failures
+            )
+
+    # --- Активные проверки здоровья ---
+
+    async def _health_loop(self):
+        async with httpx.AsyncClient(timeout=get_backend_health_timeout()) as client:
+            while True:
+                await asyncio.gather(*(self._check(client, b) for b in self.backends))
+                await asyncio.sleep(get_backend_health_interval())
+
+    async def _check(self, client: httpx.AsyncClient, backend: Backend):
+        try:
+            response = await client.get(f"{backend.url}{get_backend_health_path()}")
+            ok = response.status_code < 500
+        except httpx.HTTPError:
+            ok = False
+
+        if ok:
+            backend.consecutive_failures = 0
+            if not backend.healthy:
+                backend.healthy = True
+                backend.ejected_at = None
+                logger.info("Апстрим %s возвращен в ротацию", backend.url)
+        else:
+            self._record_failure(backend)
+
+    def circuit_states(self) -> Dict[str, str]:
+        """Состояние circuit breaker каждого апстрима"""
+        return {b.url: circuit_breakers.get(b.url).state for b in self.backends}
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "strategy": self.strategy,
+            "backends": {b.url: b.snapshot() for b in self.backends},
+        }
+
+
+# Глобальный пул апстримов
+backend_pool = BackendPool()
@@ -0,0 +1,315 @@
+"""
+Кэш результатов детерминированных запросов генерации
+
+Ключ — хэш нормализованных параметров запроса (после подстановки значений
+по умолчанию для task/size/ckpt_dir). Два уровня:
+    - память: LRU для небольших результатов (ограничение по числу и байтам)
+    - диск: JSON результата и копия артефакта (видео) в CACHE_DIR
+Оба уровня вытесняют записи по TTL и по размеру. Дисковые операции
+выполняются в потоках, чтобы не блокировать event loop.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Optional, Tuple
+
+from app.config import (
+    get_cache_dir,
+    get_cache_disk_max_bytes,
+    get_cache_enabled,
+    get_cache_memory_item_max_bytes,
+    get_cache_memory_max_bytes,
+    get_cache_memory_max_items,
+    get_cache_ttl,
+)
+from app.logger import logger
+
+
+def cache_key(kind: str, params: Dict[str, Any]) -> str:
+    """Канонический хэш нормализованных параметров запроса"""
+    normalized = {}
+    for name, value in params.items():
+        if isinstance(value, str):
+            value = value.strip() or None
+        normalized[name] = value
+    canonical = json.dumps(
+        {"kind": kind, "params": normalized},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def is_cacheable(response: Dict[str, Any]) -> bool:
+    """Кэшируются только успешные ответы реального API (не ошибки и не mock)"""
+    return (
+        response.get("result") is not None
+        and "error" not in response
+        and "warning" not in response
+    )
+
+
+class ResultCache:
+    """Двухуровневый кэш результатов: LRU в памяти + директория на диске"""
+
+    def __init__(self):
+        self._lock = Lock()
+        # key -> (expires_at, value, size)
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any], int]]" = OrderedDict()
+        self._memory_bytes = 0
+        # key -> (last_access, size, expires_at)
+        self._disk: Dict[str, Tuple[float, int, float]] = {}
+        self._disk_bytes = 0
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.bytes_served = 0
+
+    @property
+    def enabled(self) -> bool:
+        return get_cache_enabled()
+
+    async def startup(self):
+        """Строит индекс дискового уровня (вызывается из lifespan приложения)"""
+        if not self.enabled:
+            return
+        await asyncio.to_thread(self._scan_disk)
+        logger.info("Кэш результатов: %s записей на диске, %s байт", len(self._disk), self._disk_bytes)
+
+    # --- Пути на диске ---
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(get_cache_dir(), f"{key}.json")
+
+    def _artifact_path(self, key: str, source_path: str) -> str:
+        extension = os.path.splitext(source_path)[1] or ".bin"
+        return os.path.join(get_cache_dir(), f"{key}{extension}")
+
+    def _scan_disk(self):
+        cache_dir = get_cache_dir()
+        if not os.path.isdir(cache_dir):
+            return
+        now = time.time()
+        ttl = get_cache_ttl()
+        sizes: Dict[str, int] = {}
+        access: Dict[str, float] = {}
+        for entry in os.scandir(cache_dir):
+            if not entry.is_file():
+                continue
+            key = entry.name.split(".", 1)[0]
+            stat = entry.stat()
+            sizes[key] = sizes.get(key, 0) + stat.st_size
+            if entry.name.endswith(".json"):
+                access[key] = stat.st_mtime
+        with self._lock:
+            for key, last_access in access.items():
+                self._disk[key] = (last_access, sizes[key], last_access + ttl)
+                self._disk_bytes += sizes[key]
+        # Артефакты без метаданных и просроченные записи
+        for key in set(sizes) - set(access):
+            self._remove_disk_files(key)
+        for key, (_, _, expires_at) in list(self._disk.items()):
+            if expires_at < now:
+                self._evict_disk(key)
+
+    # --- Чтение ---
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Возвращает закэшированный ответ или None"""
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, value, size = entry
+                # Артефакт мог удалить janitor или оператор; дисковая запись тогда тоже устарела
+                if expires_at >= now and _artifact_exists(value):
+                    self._memory.move_to_end(key)
+                    self.hits_memory += 1
+                    self.bytes_served += size
+                    return _mark_hit(value)
+                self._drop_memory(key)
+
+        value = await asyncio.to_thread(self._read_disk, key, now)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits_disk += 1
+            self.bytes_served += self._disk.get(key, (0, 0, 0))[1]
+        self._put_memory(key, value, now + get_cache_ttl())
+        return _mark_hit(value)
+
+    def _read_disk(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._disk.get(key)
+        if entry is None:
+            return None
+        _, size, expires_at = entry
+        if expires_at < now:
+            self._evict_disk(key)
+            return None
+        try:
+            with open(self._meta_path(key), "r", encoding="utf-8") as f:
+                value = json.load(f)
+            if not _artifact_exists(value):
+                raise FileNotFoundError(value["result"]["video_path"])
+            os.utime(self._meta_path(key))
+        except (OSError, ValueError) as e:
+            logger.warning("Запись кэша %s повреждена, удаляем: %s", key, e)
+            self._evict_disk(key)
+            return None
+        with self._lock:
+            self._disk[key] = (now, size, expires_at)
+        return value
+
+    # --- Запись ---
+
+    async def set(self, key: str, response: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Сохраняет успешный ответ. Видео копируется в директорию кэша,
+        возвращается ответ с путем к закэшированной копии
+        """
+        if not self.enabled or not is_cacheable(response):
+            return response
+
+        try:
+            response = await asyncio.to_thread(self._write_disk, key, response)
+        except OSError as e:
+            logger.warning("Не удалось сохранить результат в кэш: %s", e)
+            return response
+
+        self._put_memory(key, response, time.time() + get_cache_ttl())
+        with self._lock:
+            self.stores += 1
+        return response
+
+    def _write_disk(self, key: str, response: Dict[str, Any]) -> Dict[str, Any]:
+        os.makedirs(get_cache_dir(), exist_ok=True)
+        size = 0
+
+        result = response.get("result")
+        video_path = result.get("video_path") if isinstance(result, dict) else None
+        if video_path and os.path.exists(video_path):
+            cached_path = self._artifact_path(key, video_path)
+            try:
+                # Жесткая ссылка не копирует данные, если файлы на одном разделе
+                os.link(video_path, cached_path)
+            except OSError:
+                shutil.copyfile(video_path, cached_path)
+            size += os.path.getsize(cached_path)
+            response = {**response, "result": {**result, "video_path": os.path.abspath(cached_path)}}
+
+        data = json.dumps(response, ensure_ascii=False)
+        meta_path = self._meta_path(key)
+        tmp_path = f"{meta_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, meta_path)
+        size += len(data.encode("utf-8"))
+
+        now = time.time()
+        with self._lock:
+            previous = self._disk.get(key)
+            if previous is not None:
+                self._disk_bytes -= previous[1]
+            self._disk[key] = (now, size, now + get_cache_ttl())
+            self._disk_bytes += size
+        self._enforce_disk_limit()
+        return response
+
+    def _put_memory(self, key: str, value: Dict[str, Any], expires_at: float):
+        size = len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        if size > get_cache_memory_item_max_bytes():
+            # Большие результаты (base64 изображения) живут только на диске
+            return
+        with self._lock:
+            self._drop_memory(key)
+            self._memory[key] = (expires_at, value, size)
+            self._memory_bytes += size
+            while self._memory and (
+                len(self._memory) > get_cache_memory_max_items()
+                or self._memory_bytes > get_cache_memory_max_bytes()
+            ):
+                oldest = next(iter(self._memory))
+                self._drop_memory(oldest)
+                self.evictions += 1
+
+    def _drop_memory(self, key: str):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= entry[2]
+
+    # --- Вытеснение с диска ---
+
+    def _enforce_disk_limit(self):
+        limit = get_cache_disk_max_bytes()
+        while True:
+            with self._lock:
+                if self._disk_bytes <= limit or not self._disk:
+                    return
+                oldest = min(self._disk, key=lambda k: self._disk[k][0])
+            self._evict_disk(oldest)
+
+    def _evict_disk(self, key: str):
+        with self._lock:
+            entry = self._disk.pop(key, None)
+            if entry is None:
+                return
+            self._disk_bytes -= entry[1]
+            self._drop_memory(key)
+            self.evictions += 1
+        self._remove_disk_files(key)
+
+    def _remove_disk_files(self, key: str):
+        cache_dir = get_cache_dir()
+        try:
+            names = [name for name in os.listdir(cache_dir) if name.split(".", 1)[0] == key]
+        except OSError:
+            return
+        for name in names:
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except OSError:
+                pass
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "bytes_served": self.bytes_served,
+                "memory_items": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_items": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
+
+
+def _artifact_exists(value: Dict[str, Any]) -> bool:
+    """Файл видео из закэшированного ответа на месте (у ответов без видео — всегда)"""
+    result = value.get("result")
+    artifact = result.get("video_path") if isinstance(result, dict) else None
+    return not artifact or os.path.exists(artifact)
+
+
+def _mark_hit(value: Dict[str, Any]) -> Dict[str, Any]:
+    return {**value, "cached": True}
+
+
+# Глобальный кэш результатов
+result_cache = ResultCache()
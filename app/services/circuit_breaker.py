@@ -0,0 +1,179 @@
+"""
+Circuit breaker для апстримов WAN2.2 API
+
+Состояния:
+    - closed: запросы проходят, ошибки и медленные ответы считаются
+      в скользящем окне BREAKER_WINDOW секунд
+    - open: доля ошибок или медленных ответов превысила порог — запросы
+      сразу отклоняются, не дожидаясь соединения или таймаута
+    - half_open: через BREAKER_OPEN_SECONDS пропускается несколько пробных
+      запросов; успех закрывает breaker, ошибка снова открывает
+"""
+import math
+import time
+from collections import deque
+from threading import Lock
+from typing import Any, Dict
+
+from app.config import (
+    get_breaker_enabled,
+    get_breaker_error_rate,
+    get_breaker_half_open_max_calls,
+    get_breaker_min_requests,
+    get_breaker_open_seconds,
+    get_breaker_slow_call_rate,
+    get_breaker_slow_call_seconds,
+    get_breaker_window,
+)
+from app.logger import logger
+from app.services.admission import AdmissionRejected
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(AdmissionRejected):
+    """Апстрим отключен circuit breaker'ом — запрос отклоняется сразу с 503"""
+
+    def __init__(self, url: str, retry_after: float):
+        super().__init__(
+            f"Апстрим {url} временно отключен (circuit breaker open)",
+            status_code=503,
+            retry_after=max(math.ceil(retry_after), 1),
+        )
+        self.url = url
+
+
+class CircuitBreaker:
+    """Circuit breaker одного апстрима"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.opens = 0
+        self.rejected = 0
+        self._half_open_calls = 0
+        # (время, успех, медленный)
+        self._window = deque()
+
+    def _trim(self, now: float):
+        horizon = now - get_breaker_window()
+        while self._window and self._window[0][0] < horizon:
+            self._window.popleft()
+
+    def available(self) -> bool:
+        """Пропустит ли breaker запрос сейчас (без резервирования пробного слота)"""
+        if not get_breaker_enabled() or self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return time.monotonic() - self.opened_at >= get_breaker_open_seconds()
+        return self._half_open_calls < get_breaker_half_open_max_calls()
+
+    def retry_after(self) -> float:
+        return max(get_breaker_open_seconds() - (time.monotonic() - self.opened_at), 0.0)
+
+    def acquire(self):
+        """
+        Резервирует право на запрос
+
+        Raises:
+            CircuitOpen: breaker открыт или все пробные слоты заняты
+        """
+        if not get_breaker_enabled():
+            return
+        if self.state == OPEN and time.monotonic() - self.opened_at >= get_breaker_open_seconds():
+            self.state = HALF_OPEN
+            self._half_open_calls = 0
+            logger.info("Circuit breaker %s: half-open, пробные запросы", self.url)
+        if self.state == OPEN or (
+            self.state == HALF_OPEN and self._half_open_calls >= get_breaker_half_open_max_calls()
+        ):
+            raise self.reject()
+        if self.state == HALF_OPEN:
+            self._half_open_calls += 1
+
+    def reject(self) -> CircuitOpen:
+        """Учитывает отклоненный запрос и возвращает исключение для него"""
+        self.rejected += 1
+        return CircuitOpen(self.url, self.retry_after())
+
+    def record(self, success: bool, latency: float):
+        """Учитывает результат запроса, пропущенного через acquire()"""
+        if not get_breaker_enabled():
+            return
+        slow = latency >= get_breaker_slow_call_seconds()
+
+        if self.state == HALF_OPEN:
+            self._half_open_calls = max(self._half_open_calls - 1, 0)
+            if success and not slow:
+                self.state = CLOSED
+                self._window.clear()
+                logger.info("Circuit breaker %s: closed", self.url)
+            else:
+                self._open()
+            return
+        if self.state == OPEN:
+            return
+
+        now = time.monotonic()
+        self._window.append((now, success, slow))
+        self._trim(now)
+        total = len(self._window)
+        if total < get_breaker_min_requests():
+            return
+        errors = sum(1 for _, ok, _ in self._window if not ok)
+        slow_calls = sum(1 for _, _, is_slow in self._window if is_slow)
+        if errors / total >= get_breaker_error_rate() or slow_calls / total >= get_breaker_slow_call_rate():
+            self._open()
+
+    def release(self):
+        """Возвращает пробный слот, если запрос отменен без результата"""
+        if self.state == HALF_OPEN:
+            self._half_open_calls = max(self._half_open_calls - 1, 0)
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.opens += 1
+        self._window.clear()
+        logger.warning("Circuit breaker %s: open на %ss", self.url, get_breaker_open_seconds())
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        self._trim(now)
+        total = len(self._window)
+        errors = sum(1 for _, ok, _ in self._window if not ok)
+        return {
+            "state": self.state,
+            "window_requests": total,
+            "window_error_rate": round(errors / total, 3) if total else 0.0,
+            "opens": self.opens,
+            "rejected": self.rejected,
+            "retry_after": round(self.retry_after(), 1) if self.state == OPEN else 0,
+        }
+
+
+class CircuitBreakerRegistry:
+    """Circuit breaker'ы по URL апстрима"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, url: str) -> CircuitBreaker:
+        breaker = self._breakers.get(url)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(url, CircuitBreaker(url))
+        return breaker
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {url: breaker.snapshot() for url, breaker in breakers.items()}
+
+
+# Глобальный реестр circuit breaker'ов
+circuit_breakers = CircuitBreakerRegistry()
@@ -0,0 +1,104 @@
+"""
+Клиенты API и классы приоритета
+
+Клиент определяется по заголовку X-API-Key. Известные ключи задаются
+в API_CLIENTS через запятую в формате "ключ=имя[:вес[:класс]]":
+
+    API_CLIENTS="k1=frontend:4:interactive,k2=nightly-batch:1:batch"
+
+Вес задает долю клиента в справедливой очереди, класс — максимальный
+класс приоритета, который клиент может запросить. Запросы без ключа
+относятся к клиенту "anonymous", запросы с неизвестным ключом — к общему
+клиенту "unknown": новый ключ не дает ни новой квоты, ни новой доли очереди.
+Класс приоритета обоих ограничен CLIENT_ANONYMOUS_MAX_CLASS.
+
+Класс приоритета запроса задается заголовком X-Priority-Class, по умолчанию
+он зависит от endpoint: синхронные запросы текста и изображений —
+interactive, синхронная генерация видео (и ее поток) — standard, пакетные
+запросы изображений и задания /api/jobs/video — batch.
+"""
+from typing import Dict, Optional, Tuple
+
+from app.config import get_api_clients, get_client_anonymous_max_class, parse_api_clients
+
+BATCH = "batch"
+STANDARD = "standard"
+INTERACTIVE = "interactive"
+
+# Класс приоритета -> ранг (больше — обслуживается раньше)
+PRIORITY_CLASSES = {BATCH: 0, STANDARD: 1, INTERACTIVE: 2}
+
+ANONYMOUS = "anonymous"
+UNKNOWN = "unknown"
+
+
+class Client:
+    """Клиент API и класс приоритета текущего запроса"""
+
+    def __init__(
+        self,
+        id: str,
+        weight: float = 1.0,
+        priority_class: str = STANDARD,
+        label: Optional[str] = None
+    ):
+        self.id = id
+        self.weight = weight
+        self.priority_class = priority_class
+        # Метка клиента в метриках
+        self.label = label or id
+
+    @property
+    def priority(self) -> int:
+        return PRIORITY_CLASSES[self.priority_class]
+
+    def snapshot(self) -> Dict[str, object]:
+        return {"client": self.label, "weight": self.weight, "priority_class": self.priority_class}
+
+
+_parsed: Tuple[str, Dict[str, Tuple[str, float, str]]] = ("", {})
+
+
+def _known_clients() -> Dict[str, Tuple[str, float, str]]:
+    global _parsed
+    value = get_api_clients()
+    if _parsed[0] != value:
+        _parsed = (value, parse_api_clients(value))
+    return _parsed[1]
+
+
+def resolve_client(
+    api_key: Optional[str],
+    priority_class: Optional[str] = None,
+    default_class: str = STANDARD
+) -> Client:
+    """
+    Определяет клиента по API ключу и класс приоритета запроса
+
+    Запрошенный класс понижается до максимального класса клиента из API_CLIENTS
+    (для запросов без ключа и с неизвестным ключом — до CLIENT_ANONYMOUS_MAX_CLASS)
+
+    Raises:
+        ValueError: неизвестный класс приоритета
+    """
+    requested = (priority_class or default_class).strip().lower()
+    if requested not in PRIORITY_CLASSES:
+        raise ValueError(
+            f"Неизвестный класс приоритета '{priority_class}', допустимы: {', '.join(PRIORITY_CLASSES)}"
+        )
+
+    if not api_key:
+        name, weight, max_class = ANONYMOUS, 1.0, get_client_anonymous_max_class()
+    elif api_key in _known_clients():
+        name, weight, max_class = _known_clients()[api_key]
+    else:
+        # Все неизвестные ключи — один клиент; сам ключ не попадает ни в логи, ни в метрики
+        name, weight, max_class = UNKNOWN, 1.0, get_client_anonymous_max_class()
+    if PRIORITY_CLASSES[requested] > PRIORITY_CLASSES[max_class]:
+        requested = max_class
+    return Client(name, weight=weight, priority_class=requested)
+
+
+def default_client() -> Client:
+    """Клиент для вызовов без HTTP запроса"""
+    return Client(ANONYMOUS)
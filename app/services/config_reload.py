@@ -0,0 +1,153 @@
+"""
+Перечитывание настроек без перезапуска
+
+Настройки перечитываются по сигналу SIGHUP (kill -HUP <pid> каждого worker'а
+uvicorn) и при изменении файла CONFIG_FILE (проверка раз в
+CONFIG_WATCH_INTERVAL секунд). Новые настройки сначала полностью
+проверяются: при ошибке в файле остаются прежние, ошибка пишется в лог
+и видна в /metrics. Корректные настройки подменяются одним присваиванием
+(app.config.replace_settings), поэтому запрос видит либо старые, либо новые
+значения целиком; запросы в работе не прерываются.
+
+Большинство значений читаются при каждом обращении и применяются сразу.
+То, что построено при запуске (лимитеры, пул HTTP соединений, уровень
+логов, проверки здоровья апстримов), обновляют подписчики (subscribe).
+Поля из app.config.RESTART_REQUIRED применяются только после перезапуска.
+"""
+import asyncio
+import inspect
+import os
+import signal
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+from app.config import (
+    RESTART_REQUIRED,
+    get_config_file,
+    get_config_watch_interval,
+    load_settings,
+    replace_settings,
+)
+from app.logger import logger
+
+# Подписчик получает список измененных полей ("секция.поле")
+Listener = Callable[[List[str]], Union[None, Awaitable[None]]]
+
+
+class ConfigReloader:
+    """Перечитывает настройки по SIGHUP и изменению файла и оповещает подписчиков"""
+
+    def __init__(self):
+        self._listeners: List[Listener] = []
+        self._task: Optional[asyncio.Task] = None
+        self._signal_installed = False
+        self._lock = asyncio.Lock()
+        self._mtime: Optional[float] = None
+        self.version = 1
+        self.reloads = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.loaded_at = time.time()
+
+    def subscribe(self, listener: Listener):
+        """Добавляет подписчика на изменение настроек"""
+        self._listeners.append(listener)
+
+    def start(self):
+        """Устанавливает обработчик SIGHUP и слежение за файлом (вызывается из lifespan приложения)"""
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGHUP, self._on_signal)
+            self._signal_installed = True
+        except (AttributeError, NotImplementedError, RuntimeError):
+            # Windows или event loop не в главном потоке
+            logger.warning("SIGHUP недоступен, настройки перечитываются только при изменении файла")
+        path = get_config_file()
+        if path and get_config_watch_interval() > 0:
+            self._mtime = self._file_mtime(path)
+            self._task = asyncio.create_task(self._watch(path))
+        logger.info(
+            "Настройки: файл %s, проверка изменений %s",
+            path or "не задан", f"раз в {get_config_watch_interval()}s" if self._task else "отключена"
+        )
+
+    async def stop(self):
+        if self._signal_installed:
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+            self._signal_installed = False
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _on_signal(self):
+        logger.info("Получен SIGHUP, перечитываем настройки")
+        asyncio.get_running_loop().create_task(self.reload())
+
+    @staticmethod
+    def _file_mtime(path: str) -> Optional[float]:
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    async def _watch(self, path: str):
+        while True:
+            await asyncio.sleep(get_config_watch_interval())
+            mtime = self._file_mtime(path)
+            if mtime is not None and mtime != self._mtime:
+                self._mtime = mtime
+                logger.info("Файл настроек %s изменен, перечитываем", path)
+                await self.reload()
+
+    async def reload(self) -> bool:
+        """
+        Перечитывает и применяет настройки
+
+        Returns:
+            False, если новые настройки некорректны (остаются прежние)
+        """
+        async with self._lock:
+            try:
+                settings = await asyncio.to_thread(load_settings)
+            except (OSError, ValueError) as e:
+                self.failures += 1
+                self.last_error = str(e)
+                logger.error("Настройки не применены, остаются прежние: %s", e)
+                return False
+
+            changed = replace_settings(settings)
+            self.reloads += 1
+            self.last_error = None
+            self.loaded_at = time.time()
+            if not changed:
+                logger.info("Настройки перечитаны, изменений нет")
+                return True
+            self.version += 1
+            logger.info("Настройки перечитаны (версия %s), изменены: %s", self.version, ", ".join(changed))
+            pending = [name for name in changed if name in RESTART_REQUIRED]
+            if pending:
+                logger.warning("Изменения вступят в силу после перезапуска: %s", ", ".join(pending))
+
+            for listener in self._listeners:
+                try:
+                    result = listener(changed)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception as e:
+                    logger.error("Ошибка применения настроек в %s: %s", listener, e, exc_info=True)
+            return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "file": get_config_file() or None,
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "reloads": self.reloads,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+# Глобальный reloader настроек
+config_reloader = ConfigReloader()
@@ -0,0 +1,76 @@
+"""
+Дедлайн запроса
+
+Клиент задает дедлайн заголовком X-Request-Deadline (Unix-время в секундах,
+можно дробное) или бюджетом времени X-Request-Timeout (секунд от получения
+запроса). Дедлайн хранится в контексте запроса (deadline_var) и сопровождает
+работу через очередь допуска, повторы запросов к апстриму, очередь заданий
+видео и процесс generate.py: каждое ожидание ограничено оставшимся временем,
+а апстрим получает дедлайн в том же заголовке X-Request-Deadline.
+
+Дедлайн — абсолютное время (time.time()), поэтому он сохраняется вместе
+с заданием видео и переживает перезапуск шлюза.
+"""
+import math
+import time
+from contextvars import ContextVar
+from typing import Iterable, Optional
+
+DEADLINE_HEADER = "X-Request-Deadline"
+TIMEOUT_HEADER = "X-Request-Timeout"
+
+# Дедлайн текущего запроса (Unix-время) или None, если клиент его не задал
+deadline_var: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+def parse_deadline(deadline: Optional[str], timeout: Optional[str]) -> Optional[float]:
+    """
+    Дедлайн запроса из заголовков; при обоих заголовках берется более ранний
+
+    Raises:
+        ValueError: значение заголовка не положительное число
+    """
+    result = None
+    for name, value in ((DEADLINE_HEADER, deadline), (TIMEOUT_HEADER, timeout)):
+        if not value:
+            continue
+        try:
+            number = float(value)
+        except ValueError:
+            raise ValueError(f"Некорректный заголовок {name}: {value!r}") from None
+        if not math.isfinite(number) or number <= 0:
+            raise ValueError(f"Некорректный заголовок {name}: {value!r}")
+        if name == TIMEOUT_HEADER:
+            number += time.time()
+        result = number if result is None else min(result, number)
+    return result
+
+
+def remaining(deadline: Optional[float] = None) -> Optional[float]:
+    """
+    Сколько секунд осталось до дедлайна (по умолчанию — дедлайна текущего запроса)
+
+    None — дедлайна нет; ноль или меньше — дедлайн истек
+    """
+    if deadline is None:
+        deadline = deadline_var.get()
+    if deadline is None:
+        return None
+    return deadline - time.time()
+
+
+def bound_timeout(timeout: float, deadline: Optional[float] = None) -> float:
+    """Таймаут, ограниченный оставшимся до дедлайна временем"""
+    left = remaining(deadline)
+    return timeout if left is None else min(timeout, left)
+
+
+def latest(deadlines: Iterable[Optional[float]]) -> Optional[float]:
+    """
+    Общий дедлайн нескольких запросов, выполняемых вместе: самый поздний,
+    а если у кого-то дедлайна нет — None
+    """
+    values = list(deadlines)
+    if not values or any(value is None for value in values):
+        return None
+    return max(values)
@@ -0,0 +1,134 @@
+"""
+Взвешенная справедливая очередь по клиентам
+
+Вариант start-time fair queuing. При постановке элементу выдается слот
+виртуального времени: max(текущее виртуальное время, конец последнего
+слота клиента), длиной cost / weight. Элементы обслуживаются по классу
+приоритета (строго), затем по началу слота. Поэтому клиент с длинной
+очередью не задерживает новые запросы других клиентов: их слоты начинаются
+с текущего виртуального времени и встают перед его хвостом, а в среднем
+клиенты получают обслуживание пропорционально весам.
+
+Числовой приоритет элемента меняет порядок только внутри очереди своего
+клиента (слоты клиента перераспределяются между его элементами), так что
+он не позволяет обойти других клиентов.
+"""
+import itertools
+from collections import defaultdict
+from typing import Any, Dict, Hashable, Iterator, List, Optional
+
+
+class _Entry:
+    __slots__ = ("item", "client", "priority_class", "priority", "start", "seq")
+
+    def __init__(self, item: Any, client: str, priority_class: int, priority: int, start: float, seq: int):
+        self.item = item
+        self.client = client
+        self.priority_class = priority_class
+        self.priority = priority
+        self.start = start
+        self.seq = seq
+
+    def order(self):
+        return -self.priority_class, self.start, self.seq
+
+
+class FairQueue:
+    """Очередь элементов, обслуживаемых справедливо между клиентами"""
+
+    def __init__(self):
+        self._entries: List[_Entry] = []
+        self._by_item: Dict[Hashable, _Entry] = {}
+        self._depth: Dict[str, int] = defaultdict(int)
+        # Конец последнего выданного слота по клиентам
+        self._finish: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, item: Hashable) -> bool:
+        return item in self._by_item
+
+    def __iter__(self) -> Iterator[Any]:
+        """Элементы в порядке обслуживания"""
+        return iter([entry.item for entry in self._entries])
+
+    def push(
+        self,
+        item: Hashable,
+        client: str,
+        weight: float = 1.0,
+        priority_class: int = 0,
+        priority: int = 0,
+        cost: float = 1.0
+    ):
+        """Ставит элемент в очередь клиента"""
+        start = max(self._virtual_time, self._finish.get(client, 0.0))
+        self._finish[client] = start + cost / weight
+        entry = _Entry(item, client, priority_class, priority, start, next(self._seq))
+        self._entries.append(entry)
+        self._by_item[item] = entry
+        self._depth[client] += 1
+        self._reorder(client, priority_class)
+        self._entries.sort(key=_Entry.order)
+
+    def _reorder(self, client: str, priority_class: int):
+        """Отдает ранние слоты клиента его элементам с большим приоритетом"""
+        own = [
+            entry for entry in self._entries
+            if entry.client == client and entry.priority_class == priority_class
+        ]
+        starts = sorted(entry.start for entry in own)
+        for entry, start in zip(sorted(own, key=lambda entry: (-entry.priority, entry.seq)), starts):
+            entry.start = start
+
+    def peek(self) -> Optional[Any]:
+        return self._entries[0].item if self._entries else None
+
+    def pop(self) -> Any:
+        """
+        Извлекает следующий элемент
+
+        Raises:
+            IndexError: очередь пуста
+        """
+        item = self._entries[0].item
+        self.take(item)
+        return item
+
+    def take(self, item: Hashable):
+        """Извлекает элемент для обслуживания, сдвигая виртуальное время"""
+        entry = self._remove(item)
+        self._virtual_time = max(self._virtual_time, entry.start)
+        if not self._entries:
+            # Очередь опустела — прошлое потребление клиентов больше не учитывается
+            self._finish.clear()
+            self._virtual_time = 0.0
+
+    def remove(self, item: Hashable) -> bool:
+        """Убирает элемент без обслуживания (отмена, таймаут ожидания)"""
+        if item not in self._by_item:
+            return False
+        self._remove(item)
+        return True
+
+    def _remove(self, item: Hashable) -> _Entry:
+        entry = self._by_item.pop(item)
+        self._entries.remove(entry)
+        self._depth[entry.client] -= 1
+        if not self._depth[entry.client]:
+            del self._depth[entry.client]
+        return entry
+
+    def depth(self, client: str) -> int:
+        """Сколько элементов клиента в очереди"""
+        return self._depth.get(client, 0)
+
+    def clear(self):
+        self._entries.clear()
+        self._by_item.clear()
+        self._depth.clear()
+        self._finish.clear()
+        self._virtual_time = 0.0
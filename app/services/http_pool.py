@@ -0,0 +1,207 @@
+"""
+Пул долгоживущих httpx.AsyncClient для обращений к WAN2.2 API
+
+Один клиент на каждый апстрим из WAN_API_URLS создается при старте
+приложения (lifespan в app/main.py) и переиспользует keep-alive соединения
+между запросами вместо нового TCP/TLS handshake на каждый вызов.
+
+Адреса из параметра запроса api_url задает клиент API, поэтому их клиенты
+хранятся отдельно и ограниченно: не больше _MAX_ADHOC_CLIENTS, давно не
+использованный клиент закрывается, когда его запросы завершатся.
+
+При изменении лимитов пула на ходу (reconfigure) новые запросы получают
+новые клиенты, а прежние закрываются, когда их запросы завершатся.
+"""
+import asyncio
+import importlib.util
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, List, Optional, Set
+
+import httpx
+
+from app.config import (
+    get_connect_timeout,
+    get_http2_enabled,
+    get_http_keepalive_expiry,
+    get_http_max_connections,
+    get_http_max_keepalive_connections,
+    get_pool_timeout,
+    get_timeout,
+    get_wan_api_urls,
+    get_write_timeout,
+)
+from app.logger import logger
+
+# Как часто проверять, освободился ли закрываемый клиент (в секундах)
+_RETIRE_POLL_INTERVAL = 1.0
+# Сколько клиентов для адресов из параметра api_url держать открытыми
+_MAX_ADHOC_CLIENTS = 8
+
+
+def upstream_timeout(read: float) -> httpx.Timeout:
+    """
+    Таймауты фаз запроса к апстриму: чтение ответа — read, установка
+    соединения, отправка тела и ожидание соединения пула — WAN_CONNECT_TIMEOUT,
+    WAN_WRITE_TIMEOUT и WAN_POOL_TIMEOUT, но не дольше read
+    """
+    return httpx.Timeout(
+        connect=min(get_connect_timeout(), read),
+        read=read,
+        write=min(get_write_timeout(), read),
+        pool=min(get_pool_timeout(), read),
+    )
+
+
+class HTTPClientPool:
+    """Реестр общих AsyncClient, по одному на base URL"""
+
+    def __init__(self):
+        self._lock = Lock()
+        # Клиенты апстримов из WAN_API_URLS
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        # Клиенты адресов из параметра api_url, от давно использованных к недавним
+        self._adhoc: "OrderedDict[str, httpx.AsyncClient]" = OrderedDict()
+        self._http2 = False
+        # Вытесненные клиенты и клиенты прежних настроек, ожидающие завершения своих запросов
+        self._retiring: Set[asyncio.Task] = set()
+
+    def _build_client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=get_http_max_connections(),
+            max_keepalive_connections=get_http_max_keepalive_connections(),
+            keepalive_expiry=get_http_keepalive_expiry(),
+        )
+        return httpx.AsyncClient(
+            limits=limits,
+            timeout=upstream_timeout(get_timeout()),
+            http2=self._http2,
+        )
+
+    def startup(self):
+        """Создает клиенты апстримов (вызывается из lifespan приложения)"""
+        self._http2 = get_http2_enabled()
+        if self._http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("HTTP/2 включен, но пакет h2 не установлен. Используется HTTP/1.1")
+            self._http2 = False
+        with self._lock:
+            self._create_backend_clients()
+
+    def _create_backend_clients(self):
+        for url, _ in get_wan_api_urls():
+            self._clients[url] = self._build_client()
+            logger.info("Создан HTTP клиент для %s", url)
+
+    def get_client(self, base_url: str) -> httpx.AsyncClient:
+        """
+        Возвращает общий клиент для base URL
+
+        Для адреса не из WAN_API_URLS клиент создается при первом обращении
+        и вытесняет давно не использованный, если их больше _MAX_ADHOC_CLIENTS
+        """
+        client = self._clients.get(base_url)
+        if client is not None and not client.is_closed:
+            return client
+        evicted = None
+        with self._lock:
+            client = self._clients.get(base_url)
+            if client is not None:
+                if client.is_closed:
+                    client = self._clients[base_url] = self._build_client()
+                return client
+            client = self._adhoc.get(base_url)
+            if client is not None and not client.is_closed:
+                self._adhoc.move_to_end(base_url)
+                return client
+            client = self._adhoc[base_url] = self._build_client()
+            logger.info("Создан HTTP клиент для %s (api_url из запроса)", base_url)
+            if len(self._adhoc) > _MAX_ADHOC_CLIENTS:
+                _, evicted = self._adhoc.popitem(last=False)
+        if evicted is not None:
+            self._schedule_retire([evicted])
+        return client
+
+    def reconfigure(self):
+        """Применяет новые лимиты пула (HTTP_*) к следующим запросам"""
+        with self._lock:
+            clients = list(self._clients.values()) + list(self._adhoc.values())
+            self._clients.clear()
+            self._adhoc.clear()
+            self._create_backend_clients()
+        self._schedule_retire(clients)
+        if clients:
+            logger.info("Пул HTTP соединений пересоздается, прежних клиентов: %s", len(clients))
+
+    def _schedule_retire(self, clients: List[httpx.AsyncClient]):
+        for client in clients:
+            task = asyncio.create_task(self._retire(client))
+            self._retiring.add(task)
+            task.add_done_callback(self._retiring.discard)
+
+    @staticmethod
+    async def _retire(client: httpx.AsyncClient):
+        """Закрывает клиент, когда в нем не останется запросов (но не позже таймаута запроса)"""
+        deadline = time.monotonic() + get_timeout()
+        try:
+            while time.monotonic() < deadline:
+                # Запрос мог получить клиент, но еще не занять соединение
+                await asyncio.sleep(_RETIRE_POLL_INTERVAL)
+                stats = _pool_stats(client)
+                if stats["active"] == 0 and stats["waiting"] == 0:
+                    break
+        finally:
+            await client.aclose()
+
+    async def shutdown(self):
+        """Закрывает все клиенты и их соединения"""
+        with self._lock:
+            clients = list(self._clients.values()) + list(self._adhoc.values())
+            self._clients.clear()
+            self._adhoc.clear()
+        retiring = list(self._retiring)
+        for task in retiring:
+            task.cancel()
+        await asyncio.gather(*retiring, return_exceptions=True)
+        for client in clients:
+            await client.aclose()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Статистика пулов соединений по каждому base URL"""
+        with self._lock:
+            clients = {**self._clients, **self._adhoc}
+
+        stats = {}
+        for base_url, client in clients.items():
+            stats[base_url] = _pool_stats(client)
+        return {
+            "http2": self._http2,
+            "max_connections": get_http_max_connections(),
+            "max_keepalive_connections": get_http_max_keepalive_connections(),
+            "keepalive_expiry": get_http_keepalive_expiry(),
+            "adhoc_clients": len(self._adhoc),
+            "retiring": len(self._retiring),
+            "pools": stats,
+        }
+
+
+def _pool_stats(client: httpx.AsyncClient) -> Dict[str, Optional[int]]:
+    """Считает idle/active соединения и ожидающие запросы в пуле httpcore"""
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    if pool is None:
+        return {"idle": None, "active": None, "waiting": None}
+
+    try:
+        connections = list(pool.connections)
+        idle = sum(1 for conn in connections if conn.is_idle())
+        active = sum(1 for conn in connections if not conn.is_idle() and not conn.is_closed())
+        waiting = sum(1 for request in list(pool._requests) if request.is_queued())
+    except Exception:
+        # Внутренности httpcore могут меняться между версиями
+        return {"idle": None, "active": None, "waiting": None}
+
+    return {"idle": idle, "active": active, "waiting": waiting}
+
+
+# Глобальный пул клиентов
+http_pool = HTTPClientPool()
@@ -0,0 +1,246 @@
+"""
+Хранилище заданий генерации видео
+
+Задания сохраняются, чтобы пережить перезапуск шлюза: при старте
+незавершенные задания снова ставятся в очередь (или сразу завершаются,
+если результат уже есть в кэше), а завершенные остаются доступны
+через GET /api/jobs/{id} до истечения JOB_RETENTION.
+
+Запись не добавляет задержку обработке запросов: изменения заданий
+накапливаются в памяти и раз в JOB_STORE_FLUSH_INTERVAL секунд
+записываются одной транзакцией в отдельном потоке.
+
+Хранилища (JOB_STORE):
+    - sqlite: SQLite в режиме WAL, файл JOB_STORE_PATH (по умолчанию)
+    - memory: без сохранения
+
+Каждая запись помечена pid процесса-владельца. При нескольких worker'ах
+(gunicorn) процесс забирает только задания умерших процессов, а не
+выполняющиеся у соседей.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+from app.config import get_job_store, get_job_store_flush_interval, get_job_store_path
+from app.logger import logger
+
+
+class JobStore:
+    """Интерфейс хранилища заданий; эта реализация ничего не сохраняет"""
+
+    def adopt(self, statuses: List[str]) -> List[Dict[str, Any]]:
+        """Забирает задания умерших процессов в указанных статусах"""
+        return []
+
+    def load(self, statuses: List[str]) -> List[Dict[str, Any]]:
+        """Возвращает задания в указанных статусах"""
+        return []
+
+    def write(self, records: List[Dict[str, Any]], deleted: List[str]):
+        """Сохраняет записи и удаляет задания с ID из deleted"""
+
+    def close(self):
+        pass
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SqliteJobStore(JobStore):
+    """Задания в SQLite (WAL: чтение не блокируется записью)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                owner INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                finished_at REAL,
+                data TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+
+    def adopt(self, statuses: List[str]) -> List[Dict[str, Any]]:
+        pid = os.getpid()
+        placeholders = ",".join("?" * len(statuses))
+        with self._lock:
+            # BEGIN IMMEDIATE: два одновременно стартующих процесса не заберут одно задание
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    f"SELECT id, owner, data FROM jobs WHERE status IN ({placeholders}) ORDER BY created_at",
+                    statuses,
+                ).fetchall()
+                # Свой pid тоже считается умершим: в контейнере новый процесс часто получает тот же pid
+                adopted = [(job_id, data) for job_id, owner, data in rows if owner == pid or not _pid_alive(owner)]
+                self._conn.executemany("UPDATE jobs SET owner = ? WHERE id = ?", [(pid, job_id) for job_id, _ in adopted])
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [json.loads(data) for _, data in adopted]
+
+    def load(self, statuses: List[str]) -> List[Dict[str, Any]]:
+        placeholders = ",".join("?" * len(statuses))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT data FROM jobs WHERE status IN ({placeholders}) ORDER BY created_at",
+                statuses,
+            ).fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def write(self, records: List[Dict[str, Any]], deleted: List[str]):
+        pid = os.getpid()
+        rows = [
+            (
+                record["job_id"],
+                record["status"],
+                pid,
+                record["created_at"],
+                record.get("finished_at"),
+                json.dumps(record, ensure_ascii=False, default=str),
+            )
+            for record in records
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO jobs (id, status, owner, created_at, finished_at, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                self._conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in deleted])
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JobStoreWriter:
+    """
+    Пакетная запись изменений заданий
+
+    save() только отмечает задание измененным; его состояние сериализуется
+    в event loop при сбросе, а запись в хранилище идет в отдельном потоке.
+    """
+
+    def __init__(self, store: JobStore):
+        self.store = store
+        self._dirty: Dict[str, Any] = {}
+        self._deleted: Dict[str, None] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._stopped = False
+        self.flushes = 0
+        self.written = 0
+        self.errors = 0
+
+    def save(self, job):
+        """Отмечает задание (объект с id и to_record()) для записи"""
+        if not self._stopped:
+            self._dirty[job.id] = job
+            self._deleted.pop(job.id, None)
+
+    def delete(self, job_id: str):
+        if not self._stopped:
+            self._dirty.pop(job_id, None)
+            self._deleted[job_id] = None
+
+    def start(self):
+        self._stopped = False
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(get_job_store_flush_interval())
+            await self.flush()
+
+    async def flush(self):
+        """Записывает накопленные изменения одной транзакцией"""
+        if not self._dirty and not self._deleted:
+            return
+        dirty = self._dirty
+        deleted = list(self._deleted)
+        records = [job.to_record() for job in dirty.values()]
+        # Изменения, сделанные во время записи, попадут в следующий сброс
+        self._dirty = {}
+        self._deleted = {}
+        try:
+            await asyncio.to_thread(self.store.write, records, deleted)
+        except Exception as e:
+            self.errors += 1
+            logger.error("Не удалось сохранить задания (%s шт.), повтор при следующем сбросе: %s", len(records), e)
+            self._requeue(dirty, deleted)
+            return
+        self.flushes += 1
+        self.written += len(records)
+
+    def _requeue(self, dirty: Dict[str, Any], deleted: List[str]):
+        """Возвращает незаписанный пакет; более новые save()/delete() того же задания важнее"""
+        for job_id, job in dirty.items():
+            if job_id not in self._dirty and job_id not in self._deleted:
+                self._dirty[job_id] = job
+        for job_id in deleted:
+            if job_id not in self._dirty and job_id not in self._deleted:
+                self._deleted[job_id] = None
+
+    async def stop(self):
+        """
+        Записывает оставшиеся изменения и прекращает запись
+
+        Дальнейшие изменения (отмена заданий при остановке) не сохраняются,
+        поэтому прерванные задания будут подобраны при следующем запуске
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        self._stopped = True
+        self.store.close()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "store": type(self.store).__name__,
+            "pending_writes": len(self._dirty) + len(self._deleted),
+            "flushes": self.flushes,
+            "written": self.written,
+            "errors": self.errors,
+        }
+
+
+def create_job_store() -> JobStore:
+    """Хранилище заданий по конфигурации JOB_STORE"""
+    kind = get_job_store()
+    if kind == "sqlite":
+        return SqliteJobStore(get_job_store_path())
+    if kind != "memory":
+        logger.warning("Неизвестное хранилище заданий JOB_STORE=%s, задания не сохраняются", kind)
+    return JobStore()
@@ -0,0 +1,630 @@
+"""
+Очередь заданий генерации видео
+
+Задания попадают в ограниченную очередь внутри процесса и выполняются
+фиксированным числом исполнителей через generate_video. Асинхронный API
+(/api/jobs) и синхронный /api/generate/video используют одну и ту же очередь,
+поэтому она же служит контролем допуска для видео: VIDEO_MAX_CONCURRENCY
+исполнителей, VIDEO_MAX_QUEUE мест в очереди и VIDEO_MAX_WAIT секунд ожидания.
+
+Совместимые задания (одна модель и размер) на резидентных воркерах
+объединяются в пакеты, чтобы GPU не простаивал между короткими заданиями.
+
+Состояние заданий сохраняется в хранилище (app.services.job_store) и
+переживает перезапуск шлюза.
+
+Дедлайн запроса, создавшего задание (app.services.deadlines), сохраняется
+вместе с ним: задание, которое по оценке не успеет выполниться, отклоняется
+при постановке в очередь, истекшее в очереди — отклоняется, а генерация
+ограничена оставшимся до дедлайна временем.
+"""
+import asyncio
+import time
+import uuid
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+
+from app.config import (
+    get_deadline_early_reject,
+    get_job_retention,
+    get_video_batch_max_delay,
+    get_video_batch_max_size,
+    get_video_max_concurrency,
+    get_video_max_queue,
+    get_video_max_wait,
+)
+from app.logger import logger, request_id_var
+from app.metrics import metrics
+from app.services.admission import AdmissionRejected, DeadlineExceeded, client_queue_quota, estimate_retry_after
+from app.services.artifacts import attach_artifact
+from app.services.clients import STANDARD, Client, default_client
+from app.services.deadlines import deadline_var, latest, remaining
+from app.services.fair_queue import FairQueue
+from app.services.job_store import JobStore, JobStoreWriter, create_job_store
+from app.services.wan_client import (
+    generate_video,
+    generate_video_batch,
+    get_cached_video,
+    video_batch_capacity,
+    video_batch_key,
+)
+
+# Статусы задания
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+# Задание не дождалось исполнителя за VIDEO_MAX_WAIT или до дедлайна запроса
+REJECTED = "rejected"
+
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED, REJECTED)
+
+# Сколько последних событий задания хранить для новых подписчиков
+_EVENT_HISTORY = 50
+# Очередь событий одного подписчика; медленный подписчик теряет старые события
+_SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class Job:
+    """Задание на генерацию видео"""
+
+    def __init__(
+        self,
+        params: Dict[str, Any],
+        priority: int = 0,
+        client: Optional[Client] = None,
+        on_change: Optional[Callable[["Job"], None]] = None
+    ):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.priority = priority
+        self.client = client or default_client()
+        # ID запроса, создавшего задание, — для сквозных логов исполнения
+        self.request_id = request_id_var.get()
+        # Дедлайн запроса, создавшего задание (Unix-время), или None
+        self.deadline = deadline_var.get()
+        self.status = QUEUED
+        self.progress = 0.0
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        # Время постановки в очередь (после перезапуска шлюза — время повторной постановки)
+        self.queued_at = self.created_at
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # Сколько раз задание возвращалось в очередь после перезапуска шлюза
+        self.requeues = 0
+        # Вызывается при смене статуса (запись в хранилище заданий)
+        self._on_change = on_change
+        self._done = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # Задания пакета, в котором выполняется это задание
+        self._batch: Optional[List["Job"]] = None
+        self._history = deque(maxlen=_EVENT_HISTORY)
+        self._subscribers: Set[asyncio.Queue] = set()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def _finish(self, status: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        self.status = status
+        self.result = result
+        self.error = error
+        self.finished_at = time.time()
+        if status == SUCCEEDED:
+            self.progress = 1.0
+        self._done.set()
+        self.publish({"event": "result", **self.snapshot()})
+        self._changed()
+
+    def _changed(self):
+        if self._on_change is not None:
+            self._on_change(self)
+
+    def publish(self, event: Dict[str, Any]):
+        """Публикует событие выполнения (лог, прогресс, результат) подписчикам"""
+        if event.get("event") == "progress":
+            self.progress = event["progress"]
+        self._history.append(event)
+        for queue in self._subscribers:
+            _put_dropping_oldest(queue, event)
+
+    async def events(self) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Поток событий задания: сначала недавняя история, затем новые события.
+        Заканчивается событием "result"
+        """
+        queue = asyncio.Queue(maxsize=_SUBSCRIBER_QUEUE_SIZE)
+        for event in self._history:
+            _put_dropping_oldest(queue, event)
+        self._subscribers.add(queue)
+        try:
+            while True:
+                event = await queue.get()
+                yield event
+                if event.get("event") == "result":
+                    return
+        finally:
+            self._subscribers.discard(queue)
+
+    async def wait(self) -> "Job":
+        """Ждет завершения задания"""
+        await self._done.wait()
+        return self
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "priority": self.priority,
+            "client": self.client.label,
+            "priority_class": self.client.priority_class,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "requeues": self.requeues,
+            "deadline": self.deadline,
+        }
+
+    def to_record(self) -> Dict[str, Any]:
+        """Состояние задания для хранилища заданий"""
+        return {
+            **self.snapshot(),
+            "params": self.params,
+            "request_id": self.request_id,
+            "client_id": self.client.id,
+            "client_weight": self.client.weight,
+            "queued_at": self.queued_at,
+        }
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any], on_change: Optional[Callable[["Job"], None]] = None) -> "Job":
+        """Восстанавливает задание из записи хранилища"""
+        client = Client(
+            record["client_id"],
+            weight=record.get("client_weight", 1.0),
+            priority_class=record.get("priority_class", STANDARD),
+            label=record.get("client"),
+        )
+        job = cls(record["params"], priority=record.get("priority", 0), client=client, on_change=on_change)
+        job.id = record["job_id"]
+        job.request_id = record.get("request_id") or job.request_id
+        job.status = record["status"]
+        job.progress = record.get("progress", 0.0)
+        job.result = record.get("result")
+        job.error = record.get("error")
+        job.created_at = record["created_at"]
+        job.queued_at = record.get("queued_at", job.created_at)
+        job.started_at = record.get("started_at")
+        job.finished_at = record.get("finished_at")
+        job.requeues = record.get("requeues", 0)
+        job.deadline = record.get("deadline")
+        if job.finished:
+            job._done.set()
+        return job
+
+
+class JobManager:
+    """
+    Очередь заданий с приоритетами и пул исполнителей
+
+    Задания выбираются справедливо между клиентами API (FairQueue): сначала
+    по классу приоритета, затем пропорционально весам клиентов; priority
+    задания меняет порядок только среди заданий того же клиента.
+
+    Если резидентные воркеры принимают пакеты, исполнитель собирает
+    совместимые задания (video_batch_key) в один пакет размером до
+    VIDEO_BATCH_MAX_SIZE, ожидая добора не дольше VIDEO_BATCH_MAX_DELAY
+    секунд с момента поступления первого задания.
+
+    generator, batch_generator и batch_capacity по умолчанию — функции
+    wan_client; их можно заменить, например, для нагрузочной проверки.
+    """
+
+    def __init__(
+        self,
+        generator: Optional[Callable[..., Awaitable[dict]]] = None,
+        batch_generator: Optional[Callable[..., Awaitable[List[dict]]]] = None,
+        batch_capacity: Optional[Callable[[Dict[str, Any]], int]] = None,
+        store: Optional[JobStore] = None
+    ):
+        self.jobs: Dict[str, Job] = {}
+        self._generate = generator or generate_video
+        self._generate_batch = batch_generator or generate_video_batch
+        self._batch_capacity = batch_capacity or video_batch_capacity
+        # Хранилище по умолчанию создается при старте (JOB_STORE)
+        self._store = store
+        self._writer: Optional[JobStoreWriter] = None
+        # Задания в очереди, справедливо между клиентами
+        self._pending = FairQueue()
+        self._ready: Optional[asyncio.Condition] = None
+        # Ключи пакетов, которые сейчас добирают исполнители
+        self._collecting: Set[tuple] = set()
+        self._workers: List[asyncio.Task] = []
+        self.rejected_queue_full = 0
+        self.rejected_wait_timeout = 0
+        self.rejected_client_quota = 0
+        self.rejected_deadline = 0
+        self.batches = 0
+        self.batched_jobs = 0
+        # Скользящее среднее длительности задания для Retry-After
+        self._avg_duration = 0.0
+
+    async def start(self, workers: Optional[int] = None):
+        """Запускает исполнителей (вызывается из lifespan приложения)"""
+        workers = workers or get_video_max_concurrency()
+        self._ready = asyncio.Condition()
+        self._writer = JobStoreWriter(self._store or create_job_store())
+        await self._restore()
+        self._writer.start()
+        self._workers = [asyncio.create_task(self._run_worker()) for _ in range(workers)]
+        logger.info("Очередь заданий запущена: %s исполнитель(ей), размер очереди %s", workers, get_video_max_queue())
+
+    async def stop(self):
+        """
+        Останавливает исполнителей и отменяет незавершенные задания
+
+        В хранилище незавершенные задания остаются в очереди/выполнении
+        и будут поставлены в очередь при следующем запуске
+        """
+        if self._writer is not None:
+            await self._writer.stop()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        self._pending.clear()
+        self._collecting.clear()
+        for job in self.jobs.values():
+            if not job.finished:
+                job._finish(CANCELLED, error="Шлюз остановлен")
+
+    async def submit(self, params: Dict[str, Any], priority: int = 0, client: Optional[Client] = None) -> Job:
+        """
+        Ставит задание в очередь. Если результат уже есть в кэше,
+        задание сразу завершается без постановки в очередь
+
+        Args:
+            params: Параметры generate_video
+            priority: Приоритет среди заданий того же клиента (больше — раньше)
+            client: Клиент API и класс приоритета
+
+        Raises:
+            AdmissionRejected: очередь или квота клиента заполнены (429)
+            DeadlineExceeded: задание не успеет выполниться до дедлайна запроса (504)
+        """
+        self._prune()
+        job = Job(params, priority=priority, client=client, on_change=self._save)
+        if await self._finish_from_cache(job):
+            return job
+        if len(self._pending) >= get_video_max_queue():
+            self.rejected_queue_full += 1
+            raise AdmissionRejected(
+                f"Очередь заданий заполнена ({get_video_max_queue()})",
+                status_code=429,
+                retry_after=self.retry_after(),
+            )
+        quota = client_queue_quota(get_video_max_queue())
+        if self._pending.depth(job.client.id) >= quota:
+            self.rejected_client_quota += 1
+            raise AdmissionRejected(
+                f"Слишком много заданий от клиента {job.client.label}: в очереди уже {quota}",
+                status_code=429,
+                retry_after=self.retry_after(),
+            )
+        self._check_deadline(job)
+        await self._enqueue(job)
+        logger.info(
+            "Задание %s поставлено в очередь (клиент %s, класс %s, в очереди: %s)",
+            job.id, job.client.label, job.client.priority_class, len(self._pending)
+        )
+        return job
+
+    def _check_deadline(self, job: Job):
+        """Отклоняет задание, которое по оценке не дождется исполнителя и выполнения до дедлайна"""
+        left = remaining(job.deadline)
+        if left is None:
+            return
+        if left <= 0:
+            self.rejected_deadline += 1
+            raise DeadlineExceeded("Дедлайн запроса истек до постановки задания в очередь")
+        if not get_deadline_early_reject() or self._avg_duration <= 0:
+            return
+        # Ожидание исполнителя плюс само выполнение
+        expected = self._avg_duration * (len(self._pending) / max(len(self._workers), 1) + 1)
+        if left < expected:
+            self.rejected_deadline += 1
+            raise DeadlineExceeded(
+                f"Задание не успеет выполниться до дедлайна: осталось {left:.1f}s, ожидается {expected:.1f}s"
+            )
+
+    async def _finish_from_cache(self, job: Job) -> bool:
+        """Завершает задание результатом из кэша, если он есть"""
+        if not job.params.get("cache", True):
+            return False
+        cached = await get_cached_video(**job.params)
+        if cached is None:
+            return False
+        job.started_at = job.created_at
+        self.jobs[job.id] = job
+        job._finish(SUCCEEDED, result=cached)
+        logger.info("Задание %s выполнено из кэша", job.id)
+        return True
+
+    async def _enqueue(self, job: Job):
+        self._pending.push(
+            job,
+            job.client.id,
+            weight=job.client.weight,
+            priority_class=job.client.priority,
+            priority=job.priority,
+        )
+        self.jobs[job.id] = job
+        self._save(job)
+        if job.deadline is not None:
+            asyncio.get_running_loop().call_later(max(remaining(job.deadline), 0), self._expire_deadline, job)
+        async with self._ready:
+            self._ready.notify_all()
+
+    async def _restore(self):
+        """
+        Загружает задания из хранилища: завершенные — для GET /api/jobs/{id},
+        прерванные перезапуском — снова в очередь
+        """
+        store = self._writer.store
+        finished = await asyncio.to_thread(store.load, list(FINISHED_STATUSES))
+        interrupted = await asyncio.to_thread(store.adopt, [QUEUED, RUNNING])
+        for record in finished:
+            job = Job.from_record(record, on_change=self._save)
+            if job.result is not None:
+                # ID артефакта вычисляется из пути, ссылки остаются прежними
+                job.result = attach_artifact(job.result)
+            self.jobs[job.id] = job
+        self._prune()
+
+        for record in interrupted:
+            job = Job.from_record(record, on_change=self._save)
+            job.status = QUEUED
+            job.progress = 0.0
+            job.started_at = None
+            job.queued_at = time.time()
+            job.requeues += 1
+            if not await self._finish_from_cache(job):
+                await self._enqueue(job)
+        if finished or interrupted:
+            logger.info(
+                "Из хранилища загружено заданий: %s завершенных, %s прерванных перезапуском",
+                len(finished), len(interrupted)
+            )
+
+    def _save(self, job: Job):
+        if self._writer is not None:
+            self._writer.save(job)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Отменяет задание в очереди или прерывает выполняющееся"""
+        job = self.jobs.get(job_id)
+        if job is None or job.finished:
+            return job
+        if job._batch is not None:
+            # Пакет прерывается, только когда отменены все его задания
+            job._finish(CANCELLED, error="Задание отменено")
+            if all(member.finished for member in job._batch):
+                job._task.cancel()
+        elif job._task is not None:
+            job._task.cancel()
+        else:
+            self._pending.remove(job)
+            job._finish(CANCELLED, error="Задание отменено")
+        logger.info("Задание %s отменено", job.id)
+        return job
+
+    async def _run_worker(self):
+        while True:
+            batch = await self._next_batch()
+            token = request_id_var.set(batch[0].request_id)
+            # Генерация ограничена дедлайном задания (у пакета — самым поздним)
+            deadline_token = deadline_var.set(latest(job.deadline for job in batch))
+            try:
+                if len(batch) == 1:
+                    await self._execute(batch[0])
+                else:
+                    await self._execute_batch(batch)
+            finally:
+                deadline_var.reset(deadline_token)
+                request_id_var.reset(token)
+
+    def _expire(self):
+        """Отклоняет задания, ждавшие исполнителя дольше VIDEO_MAX_WAIT"""
+        deadline = time.time() - get_video_max_wait()
+        for job in [job for job in self._pending if job.queued_at < deadline]:
+            self._pending.remove(job)
+            self.rejected_wait_timeout += 1
+            job._finish(REJECTED, error=f"Задание ждало в очереди дольше {get_video_max_wait():.0f}s")
+
+    def _expire_deadline(self, job: Job):
+        """Отклоняет задание, дедлайн которого истек, пока оно ждало в очереди"""
+        if self._pending.remove(job):
+            self.rejected_deadline += 1
+            job._finish(REJECTED, error="Дедлайн запроса истек, пока задание ждало в очереди")
+
+    async def _next_batch(self) -> List[Job]:
+        """
+        Выбирает следующее задание и совместимые с ним задания для пакета
+
+        Пакет забирается, когда он заполнен или истекло VIDEO_BATCH_MAX_DELAY
+        с момента поступления его первого задания. Пока пакет добирается,
+        другие исполнители берут задания с другими ключами.
+        """
+        async with self._ready:
+            while True:
+                self._expire()
+                head = next(
+                    (job for job in self._pending if video_batch_key(job.params) not in self._collecting),
+                    None
+                )
+                if head is None:
+                    await self._ready.wait()
+                    continue
+
+                capacity = min(get_video_batch_max_size(), self._batch_capacity(head.params))
+                if capacity <= 1:
+                    self._pending.take(head)
+                    return [head]
+
+                key = video_batch_key(head.params)
+                batch = [job for job in self._pending if video_batch_key(job.params) == key][:capacity]
+                wait_left = head.queued_at + get_video_batch_max_delay() - time.time()
+                if len(batch) >= capacity or wait_left <= 0:
+                    for job in batch:
+                        self._pending.take(job)
+                    return batch
+
+                self._collecting.add(key)
+                try:
+                    await asyncio.wait_for(self._ready.wait(), timeout=wait_left)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    self._collecting.discard(key)
+                    # Другие исполнители могли ждать, пока ключ добирается
+                    self._ready.notify_all()
+
+    async def _execute(self, job: Job):
+        job.status = RUNNING
+        job.started_at = time.time()
+        _record_wait(job)
+        self._save(job)
+        job.publish({"event": "status", "status": RUNNING})
+        job._task = asyncio.create_task(self._generate(**job.params, on_event=job.publish))
+        try:
+            result = await job._task
+            self._update_duration(time.time() - job.started_at)
+        except asyncio.CancelledError:
+            job._finish(CANCELLED, error="Задание отменено")
+            if asyncio.current_task().cancelling():
+                # Отменен сам исполнитель (остановка шлюза)
+                raise
+            return
+        except Exception as e:
+            logger.error("Задание %s завершилось исключением: %s", job.id, e, exc_info=True)
+            job._finish(FAILED, error=str(e))
+            return
+
+        _finish_with_result(job, result)
+
+    async def _execute_batch(self, batch: List[Job]):
+        """Выполняет совместимые задания одним пакетом"""
+        started_at = time.time()
+        logger.info("Пакет из %s заданий: %s", len(batch), ", ".join(job.id for job in batch))
+        for job in batch:
+            job.status = RUNNING
+            job.started_at = started_at
+            job._batch = batch
+            _record_wait(job)
+            self._save(job)
+            job.publish({"event": "status", "status": RUNNING, "batch_size": len(batch)})
+        task = asyncio.create_task(
+            self._generate_batch([job.params for job in batch], [job.publish for job in batch])
+        )
+        for job in batch:
+            job._task = task
+        self.batches += 1
+        self.batched_jobs += len(batch)
+        try:
+            results = await task
+            self._update_duration((time.time() - started_at) / len(batch))
+        except asyncio.CancelledError:
+            for job in batch:
+                if not job.finished:
+                    job._finish(CANCELLED, error="Задание отменено")
+            if asyncio.current_task().cancelling():
+                raise
+            return
+        except Exception as e:
+            logger.error("Пакет заданий завершился исключением: %s", e, exc_info=True)
+            for job in batch:
+                if not job.finished:
+                    job._finish(FAILED, error=str(e))
+            return
+
+        for job, result in zip(batch, results):
+            if not job.finished:
+                _finish_with_result(job, result)
+
+    def _update_duration(self, duration: float):
+        self._avg_duration = duration if self._avg_duration == 0 else 0.8 * self._avg_duration + 0.2 * duration
+
+    def _prune(self):
+        """Удаляет завершенные задания старше JOB_RETENTION"""
+        deadline = time.time() - get_job_retention()
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job.finished and job.finished_at < deadline
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+            if self._writer is not None:
+                self._writer.delete(job_id)
+
+    def retry_after(self) -> int:
+        """Оценка Retry-After для отклоненных заданий"""
+        queued = len(self._pending)
+        return estimate_retry_after(self._avg_duration, queued, len(self._workers))
+
+    def snapshot(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        clients: Dict[str, Dict[str, int]] = {}
+        for job in self.jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+            if job.status in (QUEUED, RUNNING):
+                client = clients.setdefault(job.client.label, {"active": 0, "waiting": 0})
+                client["active" if job.status == RUNNING else "waiting"] += 1
+        return {
+            "queue_size": len(self._pending),
+            "queue_capacity": get_video_max_queue(),
+            "workers": len(self._workers),
+            "max_wait": get_video_max_wait(),
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_wait_timeout": self.rejected_wait_timeout,
+            "rejected_client_quota": self.rejected_client_quota,
+            "rejected_deadline": self.rejected_deadline,
+            "client_queue_quota": client_queue_quota(get_video_max_queue()),
+            "batch_max_size": get_video_batch_max_size(),
+            "batch_max_delay": get_video_batch_max_delay(),
+            "batches": self.batches,
+            "batched_jobs": self.batched_jobs,
+            "avg_duration_seconds": round(self._avg_duration, 3),
+            "jobs": counts,
+            "clients": dict(sorted(clients.items())),
+            "store": self._writer.snapshot() if self._writer is not None else None,
+        }
+
+
+def _record_wait(job: Job):
+    metrics.record_queue_wait("video", job.client.label, job.client.priority_class, job.started_at - job.queued_at)
+
+
+def _finish_with_result(job: Job, result: Dict[str, Any]):
+    if result.get("result") is None:
+        job._finish(FAILED, result=result, error=result.get("error"))
+    else:
+        job._finish(SUCCEEDED, result=result)
+
+
+def _put_dropping_oldest(queue: asyncio.Queue, event: Dict[str, Any]):
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(event)
+
+
+# Глобальный менеджер заданий
+job_manager = JobManager()
@@ -0,0 +1,304 @@
+"""
+Потоковая обработка больших ответов апстрима с изображениями
+
+Апстрим может возвращать изображение строкой base64 внутри JSON
+({"image": "iVBORw0KGgo..."} или data URI). При обычном разборе в памяти
+одновременно лежат сырое тело, разобранный JSON и повторно сериализованный
+ответ шлюза — для 2048x2048 это несколько копий по десятку мегабайт.
+
+Режимы результата (IMAGE_OUTPUT или поле output запроса):
+    - inline: JSON апстрима возвращается как есть (по умолчанию)
+    - artifact: тело читается блоками, изображения base64 декодируются
+      сразу в файлы ARTIFACT_DIR и заменяются в ответе ссылкой на артефакт;
+      память на запрос ограничена блоком чтения и IMAGE_ARTIFACT_MIN_BYTES
+    - stream: тело ответа апстрима передается клиенту по частям без разбора
+"""
+import asyncio
+import binascii
+import hashlib
+import json
+import os
+import re
+from contextlib import AsyncExitStack
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from app.config import get_image_artifact_min_bytes
+from app.serialization import json_loads
+from app.services.artifacts import Artifact, JobOutput, artifact_registry
+
+INLINE = "inline"
+ARTIFACT = "artifact"
+STREAM = "stream"
+IMAGE_OUTPUTS = (INLINE, ARTIFACT, STREAM)
+
+# Символы, на которых меняется состояние разбора строки JSON
+_STRING_SPECIAL = re.compile(rb'["\\]')
+_BASE64_CHARS = re.compile(rb"[A-Za-z0-9+/=]*")
+_DATA_URI = re.compile(rb"data:([\w.+-]+/[\w.+-]+);base64,")
+# Метка на месте извлеченной строки; \u0000 не встречается в обычных значениях
+_PLACEHOLDER = "\x00artifact:"
+
+_MEDIA_EXTENSIONS = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/webp": ".webp",
+    "image/gif": ".gif",
+}
+
+# Состояния разбора
+_OUTSIDE = 0
+_STRING = 1
+_RAW_STRING = 2
+_BASE64 = 3
+
+
+def _sniff_extension(data: bytes, media_type: Optional[str]) -> Optional[str]:
+    """Расширение файла по сигнатуре содержимого или MIME из data URI, None — не изображение"""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if data.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ".webp"
+    if data.startswith(b"GIF8"):
+        return ".gif"
+    return _MEDIA_EXTENSIONS.get(media_type or "")
+
+
+class Base64Extractor:
+    """
+    Инкрементальный разбор JSON с извлечением изображений base64
+
+    feed() принимает очередной блок тела и возвращает события:
+        ("open", расширение) — началась строка base64, данные пойдут в новый файл
+        ("data", байты)      — очередная порция декодированных данных
+        ("close", None)      — строка закончилась
+    Остальной JSON копируется в скелет (finish()), строка base64 заменяется
+    в нем меткой. Строка извлекается, если ее первые min_bytes — base64
+    с сигнатурой PNG/JPEG/WebP/GIF (или data URI изображения). Короткие строки
+    буферизуются до min_bytes, остальные длинные строки копируются в скелет
+    без буферизации.
+    """
+
+    def __init__(self, min_bytes: int):
+        self.min_bytes = max(min_bytes, 16)
+        self.extracted = 0
+        self._skeleton = bytearray()
+        self._state = _OUTSIDE
+        # Начало текущей строки, пока не ясно, base64 ли это
+        self._pending = bytearray()
+        # Блок закончился на "\" внутри строки
+        self._escape = False
+        # Символы base64, не кратные 4
+        self._carry = b""
+
+    def feed(self, chunk: bytes) -> List[Tuple[str, Any]]:
+        events: List[Tuple[str, Any]] = []
+        pos = 0
+        while pos < len(chunk):
+            if self._state == _OUTSIDE:
+                index = chunk.find(b'"', pos)
+                if index < 0:
+                    self._skeleton += chunk[pos:]
+                    break
+                self._skeleton += chunk[pos:index]
+                self._state = _STRING
+                pos = index + 1
+            elif self._state == _BASE64:
+                pos = self._scan_base64(chunk, pos, events)
+            else:
+                pos = self._scan_string(chunk, pos, events)
+        return events
+
+    def finish(self) -> bytes:
+        """
+        Скелет JSON после прочтения всего тела
+
+        Raises:
+            ValueError: тело оборвано внутри строки
+        """
+        if self._state != _OUTSIDE:
+            raise ValueError("Ответ апстрима оборван внутри строки")
+        return bytes(self._skeleton)
+
+    def _scan_string(self, chunk: bytes, pos: int, events: List[Tuple[str, Any]]) -> int:
+        target = self._pending if self._state == _STRING else self._skeleton
+        if self._escape:
+            target.append(chunk[pos])
+            self._escape = False
+            pos += 1
+        match = _STRING_SPECIAL.search(chunk, pos)
+        end = match.start() if match else len(chunk)
+        target += chunk[pos:end]
+        if match is None:
+            pos = len(chunk)
+        elif chunk[end] == ord('"'):
+            if self._state == _STRING:
+                self._skeleton += b'"' + self._pending + b'"'
+                self._pending.clear()
+            else:
+                self._skeleton += b'"'
+            self._state = _OUTSIDE
+            return end + 1
+        else:
+            target.append(chunk[end])
+            if end + 1 < len(chunk):
+                target.append(chunk[end + 1])
+                pos = end + 2
+            else:
+                self._escape = True
+                pos = end + 1
+        if self._state == _STRING and not self._escape and len(self._pending) >= self.min_bytes:
+            self._classify(events)
+        return pos
+
+    def _classify(self, events: List[Tuple[str, Any]]):
+        """Решает по началу длинной строки, извлекать ли ее"""
+        text = bytes(self._pending).replace(b"\\/", b"/").replace(b"\\n", b"").replace(b"\\r", b"")
+        media_type = None
+        match = _DATA_URI.match(text)
+        if match:
+            media_type = match.group(1).decode("ascii")
+            text = text[match.end():]
+        extension = None
+        if _BASE64_CHARS.fullmatch(text):
+            usable = len(text) // 4 * 4
+            data = binascii.a2b_base64(text[:usable])
+            extension = _sniff_extension(data, media_type)
+        if extension is None:
+            # Длинная строка, но не изображение — остается в ответе
+            self._skeleton += b'"' + self._pending
+            self._pending.clear()
+            self._state = _RAW_STRING
+            return
+        self._carry = text[usable:]
+        events.append(("open", extension))
+        events.append(("data", data))
+        self._skeleton += json.dumps(f"{_PLACEHOLDER}{self.extracted}").encode("ascii")
+        self.extracted += 1
+        self._pending.clear()
+        self._state = _BASE64
+
+    def _scan_base64(self, chunk: bytes, pos: int, events: List[Tuple[str, Any]]) -> int:
+        if self._escape:
+            self._escape = False
+            escaped = chunk[pos:pos + 1]
+            if escaped == b"/":
+                self._carry += b"/"
+            elif escaped not in (b"n", b"r"):
+                raise ValueError(f"Недопустимый символ в строке base64: {escaped!r}")
+            return pos + 1
+        match = _STRING_SPECIAL.search(chunk, pos)
+        end = match.start() if match else len(chunk)
+        data = self._carry + chunk[pos:end]
+        usable = len(data) // 4 * 4
+        if usable:
+            events.append(("data", binascii.a2b_base64(data[:usable])))
+        self._carry = data[usable:]
+        if match is None:
+            return len(chunk)
+        if chunk[end] == ord("\\"):
+            self._escape = True
+            return end + 1
+        if self._carry:
+            events.append(("data", binascii.a2b_base64(self._carry + b"=" * (-len(self._carry) % 4))))
+            self._carry = b""
+        events.append(("close", None))
+        self._state = _OUTSIDE
+        return end + 1
+
+
+class _Sink:
+    """Файл артефакта, в который пишутся декодированные данные"""
+
+    def __init__(self, output: JobOutput):
+        self.output = output
+        self.file = open(output.save_file, "wb")
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes):
+        self.file.write(data)
+        self.digest.update(data)
+        self.size += len(data)
+
+    def close(self):
+        self.file.close()
+
+    def metadata(self) -> Dict[str, Any]:
+        return {"size_bytes": self.size, "checksum": f"sha256:{self.digest.hexdigest()}"}
+
+
+def _artifact_reference(artifact: Artifact) -> Dict[str, Any]:
+    """Значение, которое заменяет строку base64 в ответе"""
+    return {
+        "artifact_id": artifact.id,
+        "artifact_url": artifact.url,
+        "media_type": artifact.media_type,
+        "path": artifact.path,
+        **artifact.metadata(),
+    }
+
+
+def _replace_placeholders(value: Any, artifacts: List[Artifact]) -> Any:
+    if isinstance(value, str) and value.startswith(_PLACEHOLDER):
+        return _artifact_reference(artifacts[int(value[len(_PLACEHOLDER):])])
+    if isinstance(value, dict):
+        return {key: _replace_placeholders(item, artifacts) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_replace_placeholders(item, artifacts) for item in value]
+    return value
+
+
+async def read_image_payload(chunks: AsyncIterator[bytes]) -> Any:
+    """
+    Разбирает JSON из потока блоков, сохраняя изображения base64 в артефакты
+
+    Строка заменяется объектом со ссылкой на артефакт (artifact_id,
+    artifact_url, media_type, size_bytes, checksum). При ошибке уже
+    записанные файлы удаляются.
+
+    Raises:
+        ValueError: некорректный JSON или base64
+    """
+    extractor = Base64Extractor(get_image_artifact_min_bytes())
+    sinks: List[_Sink] = []
+    async with AsyncExitStack() as stack:
+        async for chunk in chunks:
+            for event, value in extractor.feed(chunk):
+                if event == "open":
+                    output = await stack.enter_async_context(artifact_registry.output(value))
+                    sink = _Sink(output)
+                    # Файл закрывается раньше, чем output удаляет его при ошибке
+                    stack.callback(sink.close)
+                    sinks.append(sink)
+                elif event == "data":
+                    await asyncio.to_thread(sinks[-1].write, value)
+                else:
+                    sinks[-1].close()
+        result = json_loads(extractor.finish())
+        artifacts = []
+        for sink in sinks:
+            sink.close()
+            sink.output.keep = True
+            artifacts.append(artifact_registry.register(sink.output.save_file, sink.metadata()))
+    return _replace_placeholders(result, artifacts)
+
+
+def restore_artifacts(value: Any) -> bool:
+    """
+    Регистрирует артефакты из ранее полученного результата (например, из кэша)
+
+    Returns:
+        False, если какой-то файл уже удален и результат нужно получить заново
+    """
+    if isinstance(value, dict):
+        if "artifact_id" in value and "path" in value:
+            if not os.path.exists(value["path"]):
+                return False
+            artifact_registry.register(value["path"], value)
+            return True
+        return all(restore_artifacts(item) for item in value.values())
+    if isinstance(value, list):
+        return all(restore_artifacts(item) for item in value)
+    return True
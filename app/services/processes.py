@@ -0,0 +1,86 @@
+"""
+Остановка процессов генерации вместе с их потомками
+
+generate.py и резидентные воркеры запускаются в собственной группе процессов.
+Сигнал отправляется всей группе, поэтому дочерние процессы, которые они
+породили, не остаются сиротами и не держат память GPU. Сначала группа
+получает SIGTERM, и если она не завершилась за VIDEO_KILL_GRACE секунд, —
+SIGKILL.
+
+На Linux процесс, запущенный с bound_command(), также получает SIGKILL,
+если шлюз умер, не успев его остановить (SIGKILL, OOM killer). Иначе после
+перезапуска задание, восстановленное из хранилища, выполнялось бы на GPU
+второй раз рядом с осиротевшим процессом.
+"""
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+from typing import Any, Dict, List, Optional
+
+from app.config import get_video_kill_grace
+from app.logger import logger
+
+# Обертка, которая привязывает процесс к шлюзу (PR_SET_PDEATHSIG) и запускает скрипт
+_BIND_TO_PARENT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "workers", "bind_to_parent.py"
+)
+
+
+def bound_command(cmd: List[str]) -> List[str]:
+    """
+    Команда запуска Python скрипта, который завершится вместе со шлюзом
+
+    На Linux скрипт запускается через workers/bind_to_parent.py, на остальных
+    платформах команда не меняется. Привязка выставляется в самом дочернем
+    процессе: preexec_fn между fork и exec небезопасен в многопоточном шлюзе.
+
+    Args:
+        cmd: [интерпретатор, скрипт, аргументы...]
+    """
+    if not sys.platform.startswith("linux"):
+        return cmd
+    return [cmd[0], _BIND_TO_PARENT, str(os.getpid()), *cmd[1:]]
+
+
+def process_group_kwargs() -> Dict[str, Any]:
+    """Аргументы create_subprocess_exec для запуска в отдельной группе процессов"""
+    if sys.platform == "win32":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+
+def _signal_group(process: asyncio.subprocess.Process, sig: int):
+    if sys.platform == "win32":
+        # На Windows нет групп сигналов POSIX, завершаем сам процесс
+        if process.returncode is None and sig == signal.SIGTERM:
+            process.terminate()
+        elif process.returncode is None:
+            process.kill()
+        return
+    try:
+        os.killpg(process.pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+async def terminate_process_group(process: asyncio.subprocess.Process, grace: Optional[float] = None):
+    """
+    Останавливает процесс и его группу: SIGTERM, затем SIGKILL через grace секунд
+
+    Args:
+        process: Процесс, запущенный с process_group_kwargs()
+        grace: Пауза до SIGKILL (по умолчанию VIDEO_KILL_GRACE)
+    """
+    grace = get_video_kill_grace() if grace is None else grace
+    if process.returncode is None:
+        _signal_group(process, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(process.wait(), timeout=grace)
+        except asyncio.TimeoutError:
+            logger.warning("Процесс %s не завершился за %.0fs после SIGTERM, отправляем SIGKILL", process.pid, grace)
+    # Потомки могли пережить лидера группы
+    if sys.platform != "win32" or process.returncode is None:
+        _signal_group(process, signal.SIGKILL)
+    await process.wait()
@@ -0,0 +1,180 @@
+"""
+Повторы и hedged запросы к апстриму WAN2.2 API
+
+Повторяются только запросы, которые не дошли до генерации или были
+отвергнуты перегруженным апстримом: ошибка или таймаут соединения, обрыв
+соединения и ответы 502/503/504. Таймаут чтения не повторяется: апстрим
+мог продолжать генерацию, а повтор удвоил бы время ответа. Повтор по
+возможности уходит в другой апстрим пула.
+
+Пауза перед повтором — full jitter: случайная от 0 до
+min(UPSTREAM_RETRY_BACKOFF_MAX, UPSTREAM_RETRY_BACKOFF * 2^попытка), чтобы
+повторы разных запросов не приходили в апстрим одной волной.
+
+Бюджет повторов общий для процесса: в окне UPSTREAM_RETRY_BUDGET_WINDOW
+повторов и hedged запросов не больше UPSTREAM_RETRY_BUDGET_RATIO от числа
+запросов плюс UPSTREAM_RETRY_BUDGET_MIN. Когда апстримы лежат, запросы
+быстро получают ошибку, а не умножают нагрузку в (1 + UPSTREAM_RETRIES) раз.
+
+Hedged запрос (UPSTREAM_HEDGE_ENDPOINTS): если ответ не пришел за
+UPSTREAM_HEDGE_QUANTILE последних задержек endpoint'а, тот же запрос
+отправляется в другой апстрим; берется первый успешный ответ, второй
+запрос отменяется.
+"""
+import random
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+import httpx
+
+from app.config import (
+    get_upstream_hedge_endpoints,
+    get_upstream_hedge_min_delay,
+    get_upstream_hedge_quantile,
+    get_upstream_retry_backoff,
+    get_upstream_retry_backoff_max,
+    get_upstream_retry_budget_min,
+    get_upstream_retry_budget_ratio,
+    get_upstream_retry_budget_window,
+)
+
+# Ответы апстрима, после которых запрос повторяется
+RETRY_STATUSES = (502, 503, 504)
+# Ошибки httpx, при которых запрос не был обработан апстримом (или соединение оборвано)
+_RETRY_ERRORS = (
+    httpx.ConnectError,
+    httpx.ConnectTimeout,
+    httpx.ReadError,
+    httpx.WriteError,
+    httpx.RemoteProtocolError,
+)
+# Сколько последних задержек endpoint'а хранить для перцентиля
+_LATENCY_SAMPLES = 256
+# Без стольких замеров hedged запросы не отправляются
+_MIN_LATENCY_SAMPLES = 20
+# Перцентиль пересчитывается после стольких новых замеров
+_RECOMPUTE_EVERY = 16
+
+
+def is_retryable(e: Exception) -> bool:
+    """Можно ли повторить запрос после этой ошибки"""
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code in RETRY_STATUSES
+    return isinstance(e, _RETRY_ERRORS)
+
+
+def backoff_delay(attempt: int) -> float:
+    """Пауза перед повтором номер attempt (с 0) в секундах"""
+    ceiling = min(get_upstream_retry_backoff_max(), get_upstream_retry_backoff() * 2 ** attempt)
+    return random.uniform(0, ceiling)
+
+
+class RetryBudget:
+    """Ограничение доли повторов и hedged запросов в скользящем окне"""
+
+    def __init__(self):
+        self._requests: Deque[float] = deque()
+        self._retries: Deque[float] = deque()
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.exhausted = 0
+
+    def _trim(self, now: float):
+        horizon = now - get_upstream_retry_budget_window()
+        for window in (self._requests, self._retries):
+            while window and window[0] < horizon:
+                window.popleft()
+
+    def record_request(self):
+        """Учитывает исходный запрос (не повтор) — он пополняет бюджет"""
+        self._requests.append(time.monotonic())
+
+    def try_acquire(self, hedge: bool = False) -> bool:
+        """Берет из бюджета один повтор или hedged запрос; False — бюджет исчерпан"""
+        now = time.monotonic()
+        self._trim(now)
+        allowed = get_upstream_retry_budget_min() + get_upstream_retry_budget_ratio() * len(self._requests)
+        if len(self._retries) >= allowed:
+            self.exhausted += 1
+            return False
+        self._retries.append(now)
+        if hedge:
+            self.hedges += 1
+        else:
+            self.retries += 1
+        return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        self._trim(time.monotonic())
+        return {
+            "window_requests": len(self._requests),
+            "window_retries": len(self._retries),
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "budget_exhausted": self.exhausted,
+        }
+
+
+class LatencyTracker:
+    """
+    Последние задержки успешных запросов по endpoint: задержка hedged запроса
+    и оценка, успеет ли запрос к дедлайну
+    """
+
+    def __init__(self):
+        self._samples: Dict[str, Deque[float]] = {}
+        # Сколько всего замеров получено по endpoint
+        self._observed: Dict[str, int] = {}
+        # (endpoint, q) -> (замеров на момент пересчета, перцентиль)
+        self._quantiles: Dict[Tuple[str, float], Tuple[int, float]] = {}
+
+    def observe(self, endpoint: str, latency: float):
+        samples = self._samples.get(endpoint)
+        if samples is None:
+            samples = self._samples[endpoint] = deque(maxlen=_LATENCY_SAMPLES)
+        samples.append(latency)
+        self._observed[endpoint] = self._observed.get(endpoint, 0) + 1
+
+    def quantile(self, endpoint: str, q: float) -> Optional[float]:
+        """Перцентиль q последних задержек или None, если замеров мало"""
+        samples = self._samples.get(endpoint)
+        if not samples or len(samples) < _MIN_LATENCY_SAMPLES:
+            return None
+        observed = self._observed[endpoint]
+        cached = self._quantiles.get((endpoint, q))
+        if cached is not None and observed - cached[0] < _RECOMPUTE_EVERY:
+            return cached[1]
+        ordered = sorted(samples)
+        value = ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+        self._quantiles[(endpoint, q)] = (observed, value)
+        return value
+
+    def hedge_delay(self, endpoint: str) -> Optional[float]:
+        """Через сколько секунд отправлять hedged запрос; None — не отправлять"""
+        if endpoint not in get_upstream_hedge_endpoints():
+            return None
+        value = self.quantile(endpoint, get_upstream_hedge_quantile())
+        if value is None:
+            return None
+        return max(value, get_upstream_hedge_min_delay())
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Текущая задержка hedged запроса по endpoints (мс)"""
+        result = {}
+        for endpoint in get_upstream_hedge_endpoints():
+            delay = self.hedge_delay(endpoint)
+            result[endpoint] = round(delay * 1000, 2) if delay is not None else None
+        return result
+
+
+# Глобальный бюджет повторов и задержки endpoints апстрима
+retry_budget = RetryBudget()
+upstream_latency = LatencyTracker()
+
+
+def retries_snapshot() -> Dict[str, Any]:
+    """Повторы и hedged запросы для /metrics"""
+    return {**retry_budget.snapshot(), "hedge_delay_ms": upstream_latency.snapshot()}
@@ -0,0 +1,367 @@
+"""
+Пул резидентных процессов для генерации видео
+
+Каждый воркер — долгоживущий процесс (workers/wan_worker.py), который один раз
+загружает модель из CKPT_DIR и затем принимает задания через stdin/stdout.
+
+Протокол (JSON строки):
+    воркер -> шлюз: {"event": "ready", "batch": true} после загрузки модели
+        ("batch" — воркер запущен с --batch и генерирует промпты пакета вместе)
+    шлюз -> воркер: {"id": "...", "prompt": "...", "size": "...", ...}
+    воркер -> шлюз: {"id": "...", "event": "log", "line": "..."}
+    воркер -> шлюз: {"id": "...", "event": "done", "status": "success", "video_path": "...", "stdout": "..."}
+    воркер -> шлюз: {"id": "...", "event": "done", "status": "error", "error": "..."}
+
+Пакетное задание (несколько промптов на одной загруженной модели):
+    шлюз -> воркер: {"id": "...", "batch": [{"prompt": "...", "size": "..."}, ...]}
+    воркер -> шлюз: {"id": "...", "event": "log", "index": 0, "line": "..."}
+    воркер -> шлюз: {"id": "...", "event": "done", "status": "success",
+                     "results": [{"status": "success", "video_path": "..."}, {"status": "error", ...}]}
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.config import (
+    get_ckpt_dir,
+    get_generate_script_path,
+    get_ti2v_task,
+    get_video_batch_max_size,
+    get_video_worker_batch,
+    get_video_worker_ready_timeout,
+    get_video_worker_script,
+    get_video_workers,
+    get_wan_python_path,
+)
+from app.logger import logger
+from app.serialization import json_loads
+from app.services.processes import bound_command, process_group_kwargs, terminate_process_group
+
+# Максимальная длина строки протокола (stdout воркера)
+_STREAM_LIMIT = 1024 * 1024
+# Сколько последних строк stderr хранить для диагностики
+_STDERR_TAIL_LINES = 50
+
+
+# Получает строку лога задания и индекс элемента пакета (0 для одиночного задания)
+LineCallback = Callable[[str, int], None]
+
+
+class WorkerUnavailable(Exception):
+    """Нет готового резидентного воркера, нужно использовать запасной путь"""
+
+
+class WorkerCrashed(Exception):
+    """Воркер завершился во время выполнения задания"""
+
+
+class VideoWorker:
+    """Один резидентный процесс генерации видео"""
+
+    def __init__(self, index: int, task: str, ckpt_dir: str):
+        self.index = index
+        self.task = task
+        self.ckpt_dir = ckpt_dir
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.ready = asyncio.Event()
+        self.busy = False
+        # Принимает ли воркер пакетные задания (из события ready)
+        self.batch = False
+        self.restarts = 0
+        self.jobs_done = 0
+        # Номер запуска процесса: записи очереди свободных от прежних запусков устаревают
+        self.generation = 0
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._line_callbacks: Dict[str, LineCallback] = {}
+        self._stderr_tail = deque(maxlen=_STDERR_TAIL_LINES)
+        self._reader_tasks: List[asyncio.Task] = []
+
+    async def spawn(self):
+        """Запускает процесс воркера"""
+        script_path = get_generate_script_path()
+        cmd = [
+            get_wan_python_path(),
+            os.path.abspath(get_video_worker_script()),
+            "--task", self.task,
+            "--ckpt_dir", self.ckpt_dir,
+            "--wan_dir", os.path.abspath(os.path.dirname(script_path) or os.getcwd()),
+        ]
+        if get_video_worker_batch():
+            cmd.append("--batch")
+        logger.info("Запуск видео воркера #%s: %s", self.index, ' '.join(cmd))
+
+        self.ready.clear()
+        self._stderr_tail.clear()
+        self.generation += 1
+        self.process = await asyncio.create_subprocess_exec(
+            *bound_command(cmd),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=os.path.dirname(script_path) or os.getcwd(),
+            limit=_STREAM_LIMIT,
+            **process_group_kwargs(),
+        )
+        self._reader_tasks = [
+            asyncio.create_task(self._read_stdout(self.process)),
+            asyncio.create_task(self._read_stderr(self.process)),
+        ]
+
+    async def _read_stdout(self, process: asyncio.subprocess.Process):
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                return
+            try:
+                message = json_loads(line)
+            except ValueError:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Видео воркер #%s: %s", self.index, line.decode("utf-8", errors="ignore").rstrip())
+                continue
+            self._handle_message(message)
+
+    async def _read_stderr(self, process: asyncio.subprocess.Process):
+        while True:
+            line = await process.stderr.readline()
+            if not line:
+                return
+            text = line.decode("utf-8", errors="ignore").rstrip()
+            self._stderr_tail.append(text)
+            logger.debug("Видео воркер #%s stderr: %s", self.index, text)
+
+    def _handle_message(self, message: Dict[str, Any]):
+        event = message.get("event")
+        if event == "ready":
+            logger.info("Видео воркер #%s готов (модель загружена)", self.index)
+            self.batch = bool(message.get("batch"))
+            self.ready.set()
+            return
+
+        job_id = message.get("id")
+        future = self._pending.get(job_id)
+        if future is None:
+            return
+        if event == "log":
+            on_line = self._line_callbacks.get(job_id)
+            if on_line is not None:
+                on_line(str(message.get("line", "")), int(message.get("index", 0)))
+        elif event == "done" and not future.done():
+            future.set_result(message)
+
+    async def run_job(
+        self,
+        params: Dict[str, Any],
+        timeout: float,
+        on_line: Optional[LineCallback] = None
+    ) -> Dict[str, Any]:
+        """Отправляет задание воркеру и ждет ответа, передавая строки лога в on_line"""
+        job_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._pending[job_id] = future
+        if on_line is not None:
+            self._line_callbacks[job_id] = on_line
+        self.busy = True
+        try:
+            payload = json.dumps({"id": job_id, **params}, ensure_ascii=False) + "\n"
+            self.process.stdin.write(payload.encode("utf-8"))
+            await self.process.stdin.drain()
+            return await asyncio.wait_for(future, timeout=timeout)
+        except (BrokenPipeError, ConnectionResetError) as e:
+            raise WorkerCrashed(f"Видео воркер #{self.index} недоступен: {e}")
+        finally:
+            self._pending.pop(job_id, None)
+            self._line_callbacks.pop(job_id, None)
+            self.busy = False
+            self.jobs_done += 1
+
+    def fail_pending(self, error: str):
+        """Завершает ожидающие задания ошибкой (при падении процесса)"""
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(WorkerCrashed(error))
+        self._pending.clear()
+
+    def stderr_tail(self) -> str:
+        return "\n".join(self._stderr_tail)
+
+    async def kill(self, grace: Optional[float] = None):
+        """Завершает процесс воркера и его потомков (SIGTERM, затем SIGKILL)"""
+        if self.process is not None:
+            await terminate_process_group(self.process, grace)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "index": self.index,
+            "pid": self.process.pid if self.process else None,
+            "alive": self.process is not None and self.process.returncode is None,
+            "ready": self.ready.is_set(),
+            "busy": self.busy,
+            "restarts": self.restarts,
+            "jobs_done": self.jobs_done,
+        }
+
+
+class VideoWorkerPool:
+    """Пул резидентных воркеров с автоматическим перезапуском"""
+
+    def __init__(self):
+        self.workers: List[VideoWorker] = []
+        # Свободные воркеры: (воркер, номер запуска), по одной записи на запуск
+        self._idle: Optional[asyncio.Queue] = None
+        self._monitors: List[asyncio.Task] = []
+        self._stopping = False
+        self.task = get_ti2v_task()
+        self.ckpt_dir = get_ckpt_dir()
+
+    @property
+    def started(self) -> bool:
+        return bool(self.workers) and not self._stopping
+
+    async def start(self, count: Optional[int] = None):
+        """Запускает count воркеров (по умолчанию VIDEO_WORKERS)"""
+        count = count or get_video_workers()
+        self._stopping = False
+        self._idle = asyncio.Queue()
+        self.task = get_ti2v_task()
+        self.ckpt_dir = get_ckpt_dir()
+        for index in range(count):
+            worker = VideoWorker(index, self.task, self.ckpt_dir)
+            self.workers.append(worker)
+            self._monitors.append(asyncio.create_task(self._supervise(worker)))
+        logger.info("Пул видео воркеров запускается: %s процесс(ов), task=%s", count, self.task)
+
+    async def _supervise(self, worker: VideoWorker):
+        """Держит воркер запущенным, перезапуская его при падении"""
+        backoff = 1.0
+        while not self._stopping:
+            try:
+                await worker.spawn()
+            except Exception as e:
+                logger.error("Не удалось запустить видео воркер #%s: %s", worker.index, e)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+                continue
+
+            ready_task = asyncio.create_task(worker.ready.wait())
+            exit_task = asyncio.create_task(worker.process.wait())
+            done, _ = await asyncio.wait(
+                {ready_task, exit_task},
+                timeout=get_video_worker_ready_timeout(),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            ready_task.cancel()
+
+            if ready_task in done and exit_task not in done:
+                backoff = 1.0
+                self._idle.put_nowait((worker, worker.generation))
+            elif not done:
+                logger.error("Видео воркер #%s не загрузился за %ss", worker.index, get_video_worker_ready_timeout())
+                await worker.kill()
+
+            returncode = await exit_task
+            for task in worker._reader_tasks:
+                await task
+            worker.ready.clear()
+            worker.fail_pending(f"Видео воркер #{worker.index} завершился с кодом {returncode}")
+            if self._stopping:
+                return
+
+            worker.restarts += 1
+            logger.error(
+                "Видео воркер #%s завершился с кодом %s, перезапуск через %.0fs\nSTDERR: %s",
+                worker.index, returncode, backoff, worker.stderr_tail()
+            )
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+    def accepts(self, task: str, ckpt_dir: str, generate_script_path: Optional[str]) -> bool:
+        """Может ли пул выполнить задание (модель загружена именно для этих параметров)"""
+        if not self.started:
+            return False
+        if generate_script_path and generate_script_path != get_generate_script_path():
+            return False
+        return task == self.task and ckpt_dir == self.ckpt_dir
+
+    def max_batch(self) -> int:
+        """Сколько промптов можно передать воркеру одним пакетным заданием"""
+        ready = [worker for worker in self.workers if worker.ready.is_set()]
+        if not ready or not all(worker.batch for worker in ready):
+            return 1
+        return get_video_batch_max_size()
+
+    @staticmethod
+    def _usable(worker: VideoWorker, generation: int) -> bool:
+        """Жив ли тот же запуск воркера, что записан в очередь свободных"""
+        return (
+            worker.generation == generation
+            and worker.ready.is_set()
+            and worker.process.returncode is None
+        )
+
+    async def _acquire(self) -> Tuple[VideoWorker, int]:
+        if not any(worker.ready.is_set() for worker in self.workers):
+            raise WorkerUnavailable("Нет готовых резидентных видео воркеров")
+        while True:
+            worker, generation = await self._idle.get()
+            # Воркер мог упасть (и перезапуститься), пока стоял в очереди свободных:
+            # после перезапуска _supervise кладет в очередь новую запись
+            if self._usable(worker, generation):
+                return worker, generation
+
+    async def generate(
+        self,
+        params: Dict[str, Any],
+        timeout: float,
+        on_line: Optional[LineCallback] = None
+    ) -> Dict[str, Any]:
+        """
+        Выполняет задание на свободном воркере
+
+        Пакетное задание передается как {"batch": [...]}, если max_batch() > 1
+
+        Raises:
+            WorkerUnavailable: нет ни одного готового воркера
+            WorkerCrashed: воркер упал во время выполнения
+            asyncio.TimeoutError: задание не уложилось в timeout
+        """
+        started = time.monotonic()
+        worker, generation = await asyncio.wait_for(self._acquire(), timeout=timeout)
+        remaining = timeout - (time.monotonic() - started)
+        try:
+            return await worker.run_job(params, timeout=remaining, on_line=on_line)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # Воркер занят зависшим или отмененным заданием — перезапускаем его
+            await worker.kill()
+            raise
+        finally:
+            if self._usable(worker, generation):
+                self._idle.put_nowait((worker, generation))
+
+    async def stop(self):
+        """Останавливает все воркеры"""
+        self._stopping = True
+        for worker in self.workers:
+            if worker.process is not None and worker.process.stdin is not None:
+                worker.process.stdin.close()
+            await worker.kill()
+        for monitor in self._monitors:
+            monitor.cancel()
+        await asyncio.gather(*self._monitors, return_exceptions=True)
+        self.workers.clear()
+        self._monitors.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "task": self.task,
+            "ckpt_dir": self.ckpt_dir,
+            "workers": [worker.snapshot() for worker in self.workers],
+        }
+
+
+# Глобальный пул воркеров
+video_worker_pool = VideoWorkerPool()
@@ -1,111 +1,701 @@
 import asyncio
 import os
+import re
 import sys
 import time
-from typing import Any, Dict, Optional
+from collections import deque
+from contextlib import AsyncExitStack
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
 
 import httpx
 
 from app.config import (
     get_ckpt_dir,
+    get_deadline_early_reject,
     get_generate_script_path,
+    get_image_output,
     get_ti2v_task,
     get_timeout,
+    get_upstream_chunk_size,
+    get_upstream_retries,
     get_video_size,
-    get_wan_api_url,
+    get_singleflight_enabled,
+    get_video_worker_mode,
+    get_wan_batch_enabled,
+    get_wan_batch_max_delay,
+    get_wan_batch_max_size,
+    get_wan_mock_mode,
     get_wan_python_path,
 )
 from app.logger import logger
+from app.metrics import metrics
+from app.serialization import json_loads
+from app.services.admission import DeadlineExceeded
+from app.services.artifacts import JobOutput, artifact_registry, attach_artifact
+from app.services.backends import backend_pool
+from app.services.cache import cache_key, result_cache
+from app.services.circuit_breaker import CircuitOpen, circuit_breakers
+from app.services.deadlines import DEADLINE_HEADER, bound_timeout, deadline_var, latest, remaining
+from app.services.http_pool import http_pool, upstream_timeout
+from app.services.payloads import ARTIFACT, read_image_payload, restore_artifacts
+from app.services.processes import bound_command, process_group_kwargs, terminate_process_group
+from app.services.retries import backoff_delay, is_retryable, retry_budget, upstream_latency
+from app.services.video_workers import WorkerCrashed, WorkerUnavailable, video_worker_pool
+
+# Сколько последних строк вывода generate.py хранить в памяти
+_OUTPUT_TAIL_LINES = 200
+# Максимальная длина одной строки вывода (остальное отбрасывается)
+_MAX_LINE_LENGTH = 4096
+# tqdm перерисовывает строку через \r, поэтому делим и по нему
+_LINE_SPLIT = re.compile(rb"[\r\n]")
+# Прогресс шагов денойзинга из tqdm: " 40%|████      | 20/50 [01:23<02:04,  4.15s/it]"
+_PROGRESS_RE = re.compile(r"(\d+)/(\d+)\s*\[")
+
+EventCallback = Callable[[Dict[str, Any]], None]
+
+
+class _Flight:
+    """Одно общее выполнение, число ожидающих его вызывающих и их подписчики на события"""
+
+    def __init__(self, deadline: Optional[float] = None):
+        self.task: Optional[asyncio.Task] = None
+        self.refs = 0
+        self.listeners: List[EventCallback] = []
+        # Дедлайн запроса, запустившего выполнение (выполнение идет в его контексте)
+        self.deadline = deadline
+
+    def broadcast(self, event: Dict[str, Any]):
+        """Рассылает событие выполнения всем ожидающим его вызывающим"""
+        for listener in list(self.listeners):
+            try:
+                listener(event)
+            except Exception as e:
+                logger.warning("Ошибка в обработчике события генерации: %s", e)
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные одинаковые вызовы в одно выполнение
+    
+    Все вызывающие с одинаковым ключом ждут одну задачу и получают ее результат.
+    Отмена считается по ссылкам: общая задача отменяется только когда от нее
+    отказались все ожидающие, поэтому отключение одного клиента не убивает
+    генерацию для остальных.
+    
+    Выполнение ограничено дедлайном запустившего его запроса, поэтому
+    вызывающий с более поздним дедлайном (или без дедлайна) выполняется
+    отдельно, а каждый присоединившийся ждет не дольше своего дедлайна.
+    """
+    
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self.executions = 0
+        self.coalesced = 0
+        self.separate = 0
+    
+    async def do(
+        self,
+        key: str,
+        fn: Callable[[EventCallback], Awaitable[dict]],
+        listener: Optional[EventCallback] = None
+    ) -> dict:
+        """
+        Выполняет fn(emit) или присоединяется к уже идущему выполнению с тем же ключом
+        
+        События, опубликованные выполнением через emit, получают listener
+        всех присоединившихся вызывающих
+        """
+        if not get_singleflight_enabled():
+            return await fn(listener or _ignore_event)
+        
+        deadline = deadline_var.get()
+        flight = self._flights.get(key)
+        if flight is not None and not _covers(flight.deadline, deadline):
+            # Общее выполнение может прерваться по более раннему дедлайну
+            self.separate += 1
+            return await fn(listener or _ignore_event)
+        if flight is None:
+            flight = _Flight(deadline)
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(fn(flight.broadcast))
+            self.executions += 1
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        else:
+            self.coalesced += 1
+            logger.info("Запрос присоединен к уже выполняющейся генерации (%s ожидающих)", flight.refs)
+        
+        flight.refs += 1
+        if listener is not None:
+            flight.listeners.append(listener)
+        try:
+            result = await asyncio.wait_for(asyncio.shield(flight.task), timeout=remaining(deadline))
+        except asyncio.CancelledError:
+            self._abandon(key, flight)
+            raise
+        except asyncio.TimeoutError:
+            if flight.task.done():
+                raise
+            self._abandon(key, flight)
+            raise DeadlineExceeded("Дедлайн запроса истек до завершения генерации") from None
+        finally:
+            flight.refs -= 1
+            if listener is not None:
+                flight.listeners.remove(listener)
+        # Каждый вызывающий получает свою копию ответа
+        return dict(result)
+    
+    def _abandon(self, key: str, flight: _Flight):
+        """Последний ожидающий отказался от выполнения — оно больше никому не нужно"""
+        if flight.refs == 1 and not flight.task.done():
+            flight.task.cancel()
+            self._forget(key, flight)
+    
+    def _forget(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._flights),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "separate_deadline": self.separate,
+        }
+
+
+def _covers(flight_deadline: Optional[float], deadline: Optional[float]) -> bool:
+    """Успеет ли выполнение с дедлайном flight_deadline к дедлайну вызывающего"""
+    return flight_deadline is None or (deadline is not None and deadline <= flight_deadline)
+
+
+# Общий слой объединения одинаковых запросов к апстриму и generate.py
+singleflight = SingleFlight()
+
+
+def _ignore_event(event: Dict[str, Any]):
+    pass
+
+
+def _emit_line(emit: EventCallback, stream: str, line: str):
+    """Публикует строку вывода генерации и, если в ней есть счетчик шагов, прогресс"""
+    emit({"event": "log", "stream": stream, "line": line})
+    match = _PROGRESS_RE.search(line)
+    if match:
+        step, total = int(match.group(1)), int(match.group(2))
+        if total > 0:
+            emit({"event": "progress", "step": step, "total": total, "progress": round(step / total, 4)})
+
+
+async def _read_lines(
+    stream: asyncio.StreamReader,
+    name: str,
+    tail: deque,
+    emit: EventCallback
+):
+    """
+    Читает вывод процесса по мере поступления, складывая последние строки
+    в ограниченный буфер tail вместо накопления всего вывода
+    """
+    buffer = b""
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            break
+        buffer += chunk
+        *lines, buffer = _LINE_SPLIT.split(buffer)
+        if len(buffer) > _MAX_LINE_LENGTH:
+            lines.append(buffer[:_MAX_LINE_LENGTH])
+            buffer = b""
+        for raw in lines:
+            if raw.strip():
+                line = raw[:_MAX_LINE_LENGTH].decode("utf-8", errors="ignore")
+                tail.append(line)
+                _emit_line(emit, name, line)
+    if buffer.strip():
+        line = buffer[:_MAX_LINE_LENGTH].decode("utf-8", errors="ignore")
+        tail.append(line)
+        _emit_line(emit, name, line)
+
+
+class _UpstreamCall:
+    """Учет одного запроса к апстриму: балансировщик, circuit breaker и метрики"""
+
+    def __init__(self, endpoint: str, api_url: Optional[str] = None, exclude: Iterable[str] = ()):
+        """
+        Выбирает апстрим и занимает место в его circuit breaker
+
+        Явно указанный api_url идет мимо балансировщика, exclude — апстримы,
+        которые по возможности не выбирать (уже пробовали).
+        Открытый circuit breaker отклоняет запрос сразу (CircuitOpen, 503)
+        """
+        self.endpoint = endpoint
+        self.backend = None
+        if not api_url:
+            self.backend = backend_pool.select(exclude)
+            api_url = self.backend.url
+        self.api_url = api_url
+        self.breaker = circuit_breakers.get(api_url)
+        self.breaker.acquire()
+        if self.backend is not None:
+            backend_pool.on_start(self.backend)
+        metrics.upstream_started(api_url)
+        self.start_time = time.time()
+        # None — запрос отменен, на здоровье апстрима не влияет
+        self.success: Optional[bool] = None
+
+    def fail(self, e: Exception) -> dict:
+        """Ответ шлюза для ошибки запроса"""
+        elapsed = time.time() - self.start_time
+        if isinstance(e, httpx.ConnectError):
+            self.success = False
+            logger.error("API недоступно по адресу %s: %s", self.api_url, e)
+            error = f"API недоступно по адресу {self.api_url}"
+        elif isinstance(e, (httpx.TimeoutException, TimeoutError)):
+            self.success = False
+            logger.error("Request timeout after %.2fs", elapsed)
+            error = f"Timeout after {elapsed:.2f}s"
+        else:
+            # Ответ 4xx означает, что апстрим жив — это ошибка запроса, а не апстрима
+            self.success = isinstance(e, httpx.HTTPStatusError) and e.response.status_code < 500
+            logger.error("Error during request: %s", e)
+            error = str(e)
+        return {
+            "result": None,
+            "error": error,
+            "elapsed_time": elapsed,
+            "api_url": self.api_url
+        }
+
+    def finish(self):
+        latency = time.time() - self.start_time
+        if self.success is None:
+            self.breaker.release()
+        else:
+            self.breaker.record(self.success, latency)
+        if self.backend is not None:
+            backend_pool.on_finish(self.backend, latency, self.success)
+        outcome = "cancelled" if self.success is None else ("success" if self.success else "failure")
+        metrics.record_upstream(self.api_url, self.endpoint, latency, outcome)
+
+
+async def _attempt(
+    call: _UpstreamCall,
+    payload: Dict[str, Any],
+    timeout: float,
+    extract_images: bool
+) -> Tuple[dict, bool]:
+    """
+    Одна попытка запроса к выбранному апстриму, целиком не дольше timeout
+
+    Returns:
+        ответ шлюза и можно ли повторить запрос после ошибки
+    """
+    full_url = f"{call.api_url}{call.endpoint}"
+    
+    try:
+        client = http_pool.get_client(call.api_url)
+        logger.info("Sending request to %s", full_url)
+        
+        async with asyncio.timeout(timeout):
+            if extract_images:
+                async with client.stream(
+                    "POST", full_url, json=payload, headers=_deadline_headers(), timeout=upstream_timeout(timeout)
+                ) as response:
+                    if response.is_error:
+                        await response.aread()
+                    response.raise_for_status()
+                    result = await read_image_payload(response.aiter_bytes(get_upstream_chunk_size()))
+            else:
+                response = await client.post(
+                    full_url,
+                    json=payload,
+                    headers=_deadline_headers(),
+                    timeout=upstream_timeout(timeout),
+                )
+                response.raise_for_status()
+                result = json_loads(response.content)
+        
+        elapsed = time.time() - call.start_time
+        
+        logger.info("Request completed in %.2fs", elapsed)
+        call.success = True
+        upstream_latency.observe(call.endpoint, elapsed)
+        
+        return {
+            "result": result,
+            "elapsed_time": elapsed,
+            "api_url": call.api_url
+        }, False
+        
+    except Exception as e:
+        return call.fail(e), is_retryable(e)
+    
+    finally:
+        call.finish()
+
+
+def _deadline_headers() -> Optional[Dict[str, str]]:
+    """Дедлайн запроса для апстрима, чтобы он тоже не тратил время на опоздавшую работу"""
+    deadline = deadline_var.get()
+    return {DEADLINE_HEADER: f"{deadline:.3f}"} if deadline is not None else None
+
+
+async def _hedged_attempt(
+    call: _UpstreamCall,
+    payload: Dict[str, Any],
+    deadline: float,
+    extract_images: bool,
+    tried: List[str]
+) -> Tuple[dict, bool]:
+    """
+    Попытка запроса с hedged запросом в другой апстрим, если ответа нет дольше
+    перцентиля задержки endpoint'а (UPSTREAM_HEDGE_ENDPOINTS)
+
+    Берется первый успешный ответ, оставшийся запрос отменяется. Если оба
+    завершились ошибкой, возвращается последняя
+    """
+    delay = upstream_latency.hedge_delay(call.endpoint) if call.backend is not None else None
+    untried = [b for b in backend_pool.backends if b.url not in tried]
+    if delay is None or not untried:
+        return await _attempt(call, payload, deadline - time.monotonic(), extract_images)
+    
+    primary = asyncio.ensure_future(_attempt(call, payload, deadline - time.monotonic(), extract_images))
+    tasks = [primary]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done or not retry_budget.try_acquire(hedge=True):
+            return await primary
+        try:
+            hedge_call = _UpstreamCall(call.endpoint, exclude=tried)
+        except CircuitOpen:
+            return await primary
+        tried.append(hedge_call.api_url)
+        logger.info("Hedged запрос %s в %s через %.3fs", call.endpoint, hedge_call.api_url, delay)
+        hedge = asyncio.ensure_future(_attempt(hedge_call, payload, deadline - time.monotonic(), extract_images))
+        tasks.append(hedge)
+        
+        pending = set(tasks)
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                response, retryable = task.result()
+                if "error" not in response:
+                    if task is hedge:
+                        retry_budget.hedge_wins += 1
+                        response["hedged"] = True
+                    return response, False
+            if not pending:
+                return response, retryable
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 
 async def _make_request(
     endpoint: str,
     payload: Dict[str, Any],
     api_url: Optional[str] = None,
-    timeout: Optional[int] = None
+    timeout: Optional[int] = None,
+    extract_images: bool = False
 ) -> dict:
     """
     Базовая функция для выполнения запросов к WAN2.2 API
     
+    Обрыв соединения и ответы 502/503/504 повторяются до UPSTREAM_RETRIES раз
+    с паузой full jitter в пределах бюджета повторов (app.services.retries);
+    все попытки укладываются в timeout и дедлайн запроса. Запрос, которому
+    до дедлайна осталось меньше медианы ответа endpoint'а, отклоняется
+    сразу (DEADLINE_EARLY_REJECT)
+    
     Args:
         endpoint: endpoint API (например, "/generate", "/generate/image", "/generate/video")
         payload: данные для отправки
-        api_url: URL API (по умолчанию из конфига)
+        api_url: URL API (по умолчанию апстрим из пула WAN_API_URLS)
         timeout: таймаут запроса в секундах
+        extract_images: читать ответ потоком, сохраняя base64 изображения в артефакты
         
     Returns:
         dict с полем result и метриками производительности
+        
+    Raises:
+        CircuitOpen: circuit breaker апстрима открыт
+        DeadlineExceeded: запрос не успеет выполниться до дедлайна (504)
     """
-    api_url = api_url or get_wan_api_url()
-    timeout = timeout or get_timeout()
-    
-    full_url = f"{api_url}{endpoint}"
+    if get_wan_mock_mode():
+        return _mock_response(payload)
     
+    _check_deadline(endpoint)
     start_time = time.time()
+    deadline = time.monotonic() + bound_timeout(timeout or get_timeout())
+    retry_budget.record_request()
+    tried: List[str] = []
+    retries = 0
+    
+    while True:
+        try:
+            call = _UpstreamCall(endpoint, api_url, exclude=tried)
+        except CircuitOpen:
+            if not tried:
+                raise
+            # Все апстримы отключены — отдаем ошибку предыдущей попытки
+            break
+        tried.append(call.api_url)
+        response, retryable = await _hedged_attempt(call, payload, deadline, extract_images, tried)
+        if not retryable or retries >= get_upstream_retries():
+            break
+        delay = backoff_delay(retries)
+        if time.monotonic() + delay >= deadline or not retry_budget.try_acquire():
+            break
+        retries += 1
+        logger.warning(
+            "Повтор %s/%s запроса %s через %.2fs: %s",
+            retries, get_upstream_retries(), endpoint, delay, response.get("error")
+        )
+        await asyncio.sleep(delay)
+    
+    if retries:
+        response["elapsed_time"] = time.time() - start_time
+        response["retries"] = retries
+    return response
+
+
+def _check_deadline(endpoint: str):
+    """
+    Raises:
+        DeadlineExceeded: дедлайн запроса истек или до него осталось меньше медианы ответа endpoint'а
+    """
+    left = remaining()
+    if left is None:
+        return
+    if left <= 0:
+        raise DeadlineExceeded(f"Дедлайн запроса истек до запроса {endpoint}")
+    typical = upstream_latency.quantile(endpoint, 0.5) if get_deadline_early_reject() else None
+    if typical is not None and left < typical:
+        raise DeadlineExceeded(
+            f"Запрос {endpoint} не успеет выполниться до дедлайна: осталось {left:.1f}s, медиана ответа {typical:.1f}s"
+        )
+
+
+async def _stream_request(
+    endpoint: str,
+    payload: Dict[str, Any],
+    api_url: Optional[str] = None,
+    timeout: Optional[int] = None
+) -> AsyncIterator[Any]:
+    """
+    Запрос к апстриму с передачей тела ответа по частям
+    
+    Первый элемент — httpx.Response с заголовками ответа или dict с ошибкой
+    (после него генератор завершается), дальше — блоки тела. Учет запроса
+    завершается, когда тело прочитано или генератор закрыт
     
+    Raises:
+        CircuitOpen: circuit breaker апстрима открыт
+        DeadlineExceeded: запрос не успеет выполниться до дедлайна (504)
+    """
+    _check_deadline(endpoint)
+    read_timeout = bound_timeout(timeout or get_timeout())
+    call = _UpstreamCall(endpoint, api_url)
+    full_url = f"{call.api_url}{endpoint}"
+    started = False
     try:
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            logger.info(f"Sending request to {full_url}")
-            
-            response = await client.post(
-                full_url,
-                json=payload,
-            )
+        client = http_pool.get_client(call.api_url)
+        logger.info("Sending streaming request to %s", full_url)
+        async with client.stream(
+            "POST", full_url, json=payload, headers=_deadline_headers(), timeout=upstream_timeout(read_timeout)
+        ) as response:
+            if response.is_error:
+                await response.aread()
             response.raise_for_status()
-            
-            elapsed = time.time() - start_time
-            
-            result = response.json()
-            
-            logger.info(f"Request completed in {elapsed:.2f}s")
-            
-            return {
-                "result": result,
-                "elapsed_time": elapsed,
-                "api_url": api_url
-            }
-            
-    except httpx.ConnectError:
-        elapsed = time.time() - start_time
-        logger.warning(f"API недоступно по адресу {api_url}. Используется mock.")
-        
-        # Mock для тестирования когда API недоступно
-        mock_result = {
+            started = True
+            yield response
+            async for chunk in response.aiter_bytes(get_upstream_chunk_size()):
+                yield chunk
+        call.success = True
+        logger.info("Streaming request completed in %.2fs", time.time() - call.start_time)
+    except Exception as e:
+        error = call.fail(e)
+        if started:
+            # Клиент уже получил заголовки ответа — остается только оборвать передачу
+            raise
+        yield error
+    finally:
+        call.finish()
+
+
+class UpstreamStream:
+    """Ответ апстрима, тело которого передается клиенту по частям"""
+    
+    def __init__(self, response: httpx.Response, chunks: AsyncIterator[bytes]):
+        self.media_type = response.headers.get("content-type", "application/json")
+        self.chunks = chunks
+    
+    async def aclose(self):
+        await self.chunks.aclose()
+
+
+def _mock_response(payload: Dict[str, Any]) -> dict:
+    """Ответ mock-режима (WAN_MOCK_MODE) для разработки без апстрима"""
+    return {
+        "result": {
             "content": f"Mock result for: {payload.get('prompt', 'N/A')}",
             "status": "mock",
-            "note": f"Реальный API по адресу {api_url} недоступен"
-        }
-        
-        return {
-            "result": mock_result,
-            "elapsed_time": elapsed,
-            "api_url": api_url,
-            "warning": "API недоступно, используется mock"
-        }
-        
-    except httpx.TimeoutException:
-        elapsed = time.time() - start_time
-        logger.error(f"Request timeout after {elapsed:.2f}s")
-        
-        return {
-            "result": None,
-            "error": f"Timeout after {elapsed:.2f}s",
-            "elapsed_time": elapsed,
-            "api_url": api_url
-        }
+            "note": "Включен WAN_MOCK_MODE, реальный API не вызывается"
+        },
+        "elapsed_time": 0.0,
+        "api_url": None,
+        "warning": "Включен mock-режим"
+    }
+
+
+class MicroBatcher:
+    """
+    Собирает одновременные запросы к одному endpoint апстрима в пакет
+    
+    Первый запрос запускает окно WAN_BATCH_MAX_DELAY; запросы, пришедшие
+    за это время, уходят одним вызовом POST {endpoint}/batch с телом
+    {"items": [payload, ...]}. Апстрим отвечает {"results": [...]} в том же
+    порядке; элемент с полем "error" — ошибка только этого запроса.
+    Пакет отправляется сразу, как только набрано WAN_BATCH_MAX_SIZE запросов.
+    С extract_images ответ читается потоком и base64 изображения сохраняются
+    в артефакты (режим IMAGE_OUTPUT=artifact).
+    """
+    
+    def __init__(self, endpoint: str, extract_images: bool = False):
+        self.endpoint = endpoint
+        self.extract_images = extract_images
+        # (payload, timeout, дедлайн, future ожидающего вызывающего)
+        self._items: List[tuple] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._sending: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.batched = 0
+    
+    async def submit(self, payload: Dict[str, Any], timeout: Optional[int] = None) -> dict:
+        """
+        Добавляет запрос в текущий пакет и ждет его результата
         
-    except Exception as e:
-        elapsed = time.time() - start_time
-        logger.error(f"Error during request: {str(e)}")
+        Raises:
+            CircuitOpen: circuit breaker апстрима открыт
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._items.append((payload, timeout, deadline_var.get(), future))
+        if len(self._items) >= get_wan_batch_max_size():
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(get_wan_batch_max_delay(), self._flush)
+        # Отмененный до отправки запрос не попадет в пакет
+        return await future
+    
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        items = [item for item in self._items if not item[3].done()]
+        self._items = []
+        if not items:
+            return
+        task = asyncio.create_task(self._send(items))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+    
+    async def _send(self, items: List[tuple]):
+        self.batches += 1
+        self.batched += len(items)
+        # Задача наследует контекст первого запроса; пакет ограничен самым поздним дедлайном
+        deadline_var.set(latest(deadline for _, _, deadline, _ in items))
+        try:
+            if len(items) == 1:
+                payload, timeout, _, future = items[0]
+                response = await _make_request(
+                    self.endpoint, payload, timeout=timeout, extract_images=self.extract_images
+                )
+                if not future.done():
+                    future.set_result(response)
+                return
+            
+            timeout = max(get_timeout(item_timeout) for _, item_timeout, _, _ in items)
+            response = await _make_request(
+                f"{self.endpoint}/batch",
+                {"items": [payload for payload, _, _, _ in items]},
+                timeout=timeout,
+                extract_images=self.extract_images
+            )
+        except Exception as e:
+            for _, _, _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
         
+        for (_, _, _, future), response in zip(items, _split_batch_response(response, len(items))):
+            if not future.done():
+                future.set_result(response)
+    
+    def snapshot(self) -> Dict[str, Any]:
         return {
-            "result": None,
-            "error": str(e),
-            "elapsed_time": elapsed,
-            "api_url": api_url
+            "pending": len(self._items),
+            "batches": self.batches,
+            "batched_requests": self.batched,
+            "avg_batch_size": round(self.batched / self.batches, 2) if self.batches else 0,
         }
 
 
+def _split_batch_response(response: dict, size: int) -> List[dict]:
+    """Разбирает ответ на пакетный запрос в ответы отдельных запросов"""
+    elapsed, api_url = response.get("elapsed_time"), response.get("api_url")
+    result = response.get("result")
+    results = result.get("results") if isinstance(result, dict) else None
+    if not isinstance(results, list) or len(results) != size:
+        error = response.get("error") or "Некорректный ответ апстрима на пакетный запрос"
+        return [{"result": None, "error": error, "elapsed_time": elapsed, "api_url": api_url} for _ in range(size)]
+    
+    responses = []
+    for item in results:
+        if isinstance(item, dict) and item.get("error"):
+            responses.append({"result": None, "error": str(item["error"]), "elapsed_time": elapsed, "api_url": api_url})
+        else:
+            responses.append({"result": item, "elapsed_time": elapsed, "api_url": api_url, "batch_size": size})
+    return responses
+
+
+# Микро-батчеры по endpoint апстрима (с суффиксом " [artifact]" для извлечения изображений)
+_batchers: Dict[str, MicroBatcher] = {}
+
+
+def _get_batcher(endpoint: str, extract_images: bool = False) -> MicroBatcher:
+    name = f"{endpoint} [artifact]" if extract_images else endpoint
+    batcher = _batchers.get(name)
+    if batcher is None:
+        batcher = _batchers[name] = MicroBatcher(endpoint, extract_images)
+    return batcher
+
+
+async def _upstream_request(
+    endpoint: str,
+    payload: Dict[str, Any],
+    api_url: Optional[str] = None,
+    timeout: Optional[int] = None,
+    extract_images: bool = False
+) -> dict:
+    """Запрос к апстриму через микро-батчер, если он включен и апстрим выбирается пулом"""
+    if api_url or get_wan_mock_mode() or not get_wan_batch_enabled():
+        return await _make_request(
+            endpoint=endpoint, payload=payload, api_url=api_url, timeout=timeout, extract_images=extract_images
+        )
+    return await _get_batcher(endpoint, extract_images).submit(payload, timeout=timeout)
+
+
+def batching_snapshot() -> Dict[str, Any]:
+    """Состояние микро-батчеров для /metrics"""
+    return {
+        "enabled": get_wan_batch_enabled(),
+        "max_size": get_wan_batch_max_size(),
+        "max_delay": get_wan_batch_max_delay(),
+        "endpoints": {endpoint: batcher.snapshot() for endpoint, batcher in _batchers.items()},
+    }
+
+
 async def generate_text(
     prompt: str,
     api_url: Optional[str] = None,
@@ -117,19 +707,35 @@ async def generate_text(
     Args:
         prompt: Текст запроса пользователя
         api_url: URL API (по умолчанию из конфига)
-        timeout: Таймаут запроса в секундах
+        timeout: Таймаут запроса в секундах (по умолчанию WAN_TEXT_TIMEOUT)
         
     Returns:
         dict с полем result и метриками производительности
     """
-    return await _make_request(
-        endpoint="/generate",
-        payload={"prompt": prompt},
-        api_url=api_url,
-        timeout=timeout
+    return await singleflight.do(
+        cache_key("text", {"prompt": prompt, "api_url": api_url}),
+        lambda emit: _upstream_request(
+            endpoint="/generate",
+            payload={"prompt": prompt},
+            api_url=api_url,
+            timeout=get_timeout(timeout, "text")
+        )
     )
 
 
+def _image_payload(prompt: str, negative_prompt: Optional[str], width: int, height: int, steps: int) -> Dict[str, Any]:
+    payload = {
+        "prompt": prompt,
+        "width": width,
+        "height": height,
+        "steps": steps
+    }
+    
+    if negative_prompt:
+        payload["negative_prompt"] = negative_prompt
+    return payload
+
+
 async def generate_image(
     prompt: str,
     negative_prompt: Optional[str] = None,
@@ -137,7 +743,9 @@ async def generate_image(
     height: int = 1024,
     steps: int = 50,
     api_url: Optional[str] = None,
-    timeout: Optional[int] = None
+    timeout: Optional[int] = None,
+    cache: bool = True,
+    output: Optional[str] = None
 ) -> dict:
     """
     Генерирует изображение используя WAN2.2 API
@@ -149,30 +757,382 @@ async def generate_image(
         height: Высота изображения
         steps: Количество шагов генерации
         api_url: URL API (по умолчанию из конфига)
-        timeout: Таймаут запроса в секундах
+        timeout: Таймаут запроса в секундах (по умолчанию WAN_IMAGE_TIMEOUT)
+        cache: Использовать кэш результатов
+        output: "artifact" — сохранить base64 изображения в артефакты и вернуть
+            ссылки, иначе ответ апстрима как есть (по умолчанию IMAGE_OUTPUT)
         
     Returns:
         dict с URL изображения и метриками производительности
     """
-    payload = {
-        "prompt": prompt,
-        "width": width,
-        "height": height,
-        "steps": steps
+    payload = _image_payload(prompt, negative_prompt, width, height, steps)
+    extract_images = (output or get_image_output()) == ARTIFACT
+    
+    key_params = {**payload, "api_url": api_url}
+    if extract_images:
+        key_params["output"] = ARTIFACT
+    key = cache_key("image", key_params)
+    if cache:
+        cached = await result_cache.get(key)
+        # Файлы артефактов из кэша могли быть удалены очисткой директории результатов
+        if cached is not None and (not extract_images or restore_artifacts(cached.get("result"))):
+            logger.info("Результат генерации изображения взят из кэша")
+            return cached
+    
+    async def execute(emit: EventCallback) -> dict:
+        response = await _upstream_request(
+            endpoint="/generate/image",
+            payload=payload,
+            api_url=api_url,
+            timeout=get_timeout(timeout, "image"),
+            extract_images=extract_images
+        )
+        if cache:
+            response = await result_cache.set(key, response)
+        return response
+    
+    return await singleflight.do(key, execute)
+
+
+async def stream_image(
+    prompt: str,
+    negative_prompt: Optional[str] = None,
+    width: int = 1024,
+    height: int = 1024,
+    steps: int = 50,
+    api_url: Optional[str] = None,
+    timeout: Optional[int] = None
+) -> Union[dict, UpstreamStream]:
+    """
+    Генерирует изображение, передавая тело ответа апстрима без разбора
+    
+    Кэш, объединение одинаковых запросов и микро-батчинг не используются:
+    тело ответа не хранится в шлюзе целиком
+    
+    Returns:
+        UpstreamStream с блоками тела или dict с ошибкой (как у generate_image)
+    """
+    payload = _image_payload(prompt, negative_prompt, width, height, steps)
+    if get_wan_mock_mode():
+        return _mock_response(payload)
+    
+    chunks = _stream_request("/generate/image", payload, api_url=api_url, timeout=get_timeout(timeout, "image"))
+    head = await chunks.__anext__()
+    if isinstance(head, dict):
+        await chunks.aclose()
+        return head
+    return UpstreamStream(head, chunks)
+
+
+async def _generate_video_resident(
+    prompt: str,
+    duration: int,
+    fps: int,
+    size: str,
+    task: str,
+    timeout: int,
+    start_time: float,
+    save_file: str,
+    emit: EventCallback
+) -> dict:
+    """
+    Генерирует видео на резидентном воркере (модель уже загружена)
+    
+    Raises:
+        WorkerUnavailable: нет готовых воркеров, нужно использовать generate.py
+    """
+    logger.info("Генерация видео на резидентном воркере: task=%s, size=%s, prompt='%s...'", task, size, prompt[:50])
+    
+    try:
+        response = await video_worker_pool.generate(
+            {"prompt": prompt, "size": size, "save_file": save_file},
+            timeout=timeout,
+            on_line=lambda line, _: _emit_line(emit, "worker", line)
+        )
+    except asyncio.TimeoutError:
+        elapsed = time.time() - start_time
+        error_msg = f"Таймаут генерации видео после {elapsed:.2f}s"
+        logger.error(error_msg)
+        return {
+            "result": None,
+            "error": error_msg,
+            "elapsed_time": elapsed
+        }
+    except WorkerCrashed as e:
+        elapsed = time.time() - start_time
+        error_msg = f"Ошибка генерации видео: {e}"
+        logger.error(error_msg)
+        return {
+            "result": None,
+            "error": error_msg,
+            "elapsed_time": elapsed
+        }
+    
+    return _resident_response(response, duration, fps, size, task, time.time() - start_time)
+
+
+def _resident_response(
+    response: Dict[str, Any],
+    duration: int,
+    fps: int,
+    size: str,
+    task: str,
+    elapsed: float
+) -> dict:
+    """Преобразует ответ резидентного воркера в ответ шлюза"""
+    if response.get("status") != "success":
+        error_msg = f"Ошибка генерации видео: {response.get('error', 'unknown error')}"
+        logger.error(error_msg)
+        return {
+            "result": None,
+            "error": error_msg,
+            "elapsed_time": elapsed
+        }
+    
+    logger.info("Генерация видео завершена успешно за %.2fs", elapsed)
+    
+    stdout_text = response.get("stdout") or ""
+    return {
+        "result": {
+            "status": "success",
+            "video_path": response.get("video_path"),
+            "stdout": stdout_text[-500:],
+            "duration": duration,
+            "fps": fps,
+            "size": size
+        },
+        "elapsed_time": elapsed,
+        "task": task
     }
+
+
+def _video_cache_key(
+    prompt: str,
+    duration: int,
+    fps: int,
+    size: Optional[str],
+    task: Optional[str],
+    ckpt_dir: Optional[str],
+    generate_script_path: Optional[str]
+) -> str:
+    """Ключ кэша видео с подставленными значениями по умолчанию"""
+    return cache_key("video", {
+        "prompt": prompt,
+        "duration": duration,
+        "fps": fps,
+        "size": size or get_video_size(),
+        "task": task or get_ti2v_task(),
+        "ckpt_dir": ckpt_dir or get_ckpt_dir(),
+        "generate_script_path": generate_script_path or get_generate_script_path()
+    })
+
+
+async def get_cached_video(
+    prompt: str,
+    duration: int = 5,
+    fps: int = 24,
+    size: Optional[str] = None,
+    task: Optional[str] = None,
+    ckpt_dir: Optional[str] = None,
+    generate_script_path: Optional[str] = None,
+    **_
+) -> Optional[dict]:
+    """Возвращает закэшированный результат генерации видео или None"""
+    key = _video_cache_key(prompt, duration, fps, size, task, ckpt_dir, generate_script_path)
+    cached = await result_cache.get(key)
+    return attach_artifact(cached) if cached is not None else None
+
+
+async def generate_video(
+    prompt: str,
+    duration: int = 5,
+    fps: int = 24,
+    size: Optional[str] = None,
+    task: Optional[str] = None,
+    ckpt_dir: Optional[str] = None,
+    generate_script_path: Optional[str] = None,
+    timeout: Optional[int] = None,
+    cache: bool = True,
+    on_event: Optional[EventCallback] = None
+) -> dict:
+    """
+    Генерирует видео, используя кэш результатов
     
-    if negative_prompt:
-        payload["negative_prompt"] = negative_prompt
+    Args:
+        prompt: Описание видео
+        duration: Длительность в секундах (используется для логирования)
+        fps: Кадров в секунду (используется для логирования)
+        size: Размер видео в формате "width*height" (например, "1280*704")
+        task: Задача для генерации (например, "ti2v-5B")
+        ckpt_dir: Путь к директории с чекпоинтами
+        generate_script_path: Путь к скрипту generate.py
+        timeout: Таймаут выполнения в секундах (по умолчанию WAN_VIDEO_TIMEOUT)
+        cache: Использовать кэш результатов
+        on_event: Получает события генерации по мере выполнения
+            ({"event": "log", ...} и {"event": "progress", ...})
+        
+    Returns:
+        dict с результатом генерации и метриками производительности
+    """
+    key = _video_cache_key(prompt, duration, fps, size, task, ckpt_dir, generate_script_path)
+    if cache:
+        cached = await result_cache.get(key)
+        if cached is not None:
+            logger.info("Результат генерации видео взят из кэша")
+            return attach_artifact(cached)
     
-    return await _make_request(
-        endpoint="/generate/image",
-        payload=payload,
-        api_url=api_url,
-        timeout=timeout
+    async def execute(emit: EventCallback) -> dict:
+        response = await _generate_video(
+            prompt=prompt,
+            duration=duration,
+            fps=fps,
+            size=size,
+            task=task,
+            ckpt_dir=ckpt_dir,
+            generate_script_path=generate_script_path,
+            timeout=timeout,
+            emit=emit
+        )
+        if cache and (response.get("result") or {}).get("video_path"):
+            response = await result_cache.set(key, response)
+        return response
+    
+    response = await singleflight.do(key, execute, listener=on_event)
+    return attach_artifact(response)
+
+
+def video_batch_key(params: Dict[str, Any]) -> tuple:
+    """
+    Ключ совместимости заданий видео: задания с одинаковым ключом
+    можно выполнить одним пакетом на одной загруженной модели
+    """
+    return (
+        params.get("task") or get_ti2v_task(),
+        params.get("size") or get_video_size(),
+        params.get("ckpt_dir") or get_ckpt_dir(),
+        params.get("generate_script_path") or get_generate_script_path(),
     )
 
 
-async def generate_video(
+def video_batch_capacity(params: Dict[str, Any]) -> int:
+    """Сколько заданий с такими параметрами можно выполнить одним пакетом"""
+    task, _, ckpt_dir, _ = video_batch_key(params)
+    if get_video_worker_mode() != "resident":
+        return 1
+    if not video_worker_pool.accepts(task, ckpt_dir, params.get("generate_script_path")):
+        return 1
+    return video_worker_pool.max_batch()
+
+
+async def generate_video_batch(
+    items: List[Dict[str, Any]],
+    on_events: List[EventCallback]
+) -> List[dict]:
+    """
+    Генерирует несколько видео одним пакетным заданием резидентного воркера
+    
+    Задания должны быть совместимы (одинаковый video_batch_key). Модель
+    загружена один раз, поэтому промпты выполняются друг за другом без
+    повторной инициализации. Результаты из кэша и одинаковые промпты
+    внутри пакета не генерируются повторно.
+    
+    Args:
+        items: Параметры заданий (как у generate_video)
+        on_events: Получатели событий, по одному на задание
+        
+    Returns:
+        Ответы в порядке items
+    """
+    start_time = time.time()
+    responses: List[Optional[dict]] = [None] * len(items)
+    # Ключ кэша -> индексы заданий с этим промптом
+    pending: Dict[str, List[int]] = {}
+    for index, item in enumerate(items):
+        key = _video_cache_key(
+            item["prompt"], item.get("duration", 5), item.get("fps", 24), item.get("size"),
+            item.get("task"), item.get("ckpt_dir"), item.get("generate_script_path")
+        )
+        if item.get("cache", True):
+            cached = await result_cache.get(key)
+            if cached is not None:
+                responses[index] = attach_artifact(cached)
+                continue
+        pending.setdefault(key, []).append(index)
+    
+    if not pending:
+        return responses
+    
+    groups = list(pending.items())
+    task, size, _, _ = video_batch_key(items[0])
+    async with AsyncExitStack() as stack:
+        # У каждого промпта пакета свой файл результата
+        outputs = [await stack.enter_async_context(artifact_registry.output()) for _ in groups]
+        return await _run_video_batch(items, on_events, groups, outputs, responses, task, size, start_time)
+
+
+async def _run_video_batch(
+    items: List[Dict[str, Any]],
+    on_events: List[EventCallback],
+    groups: List[tuple],
+    outputs: List[JobOutput],
+    responses: List[Optional[dict]],
+    task: str,
+    size: str,
+    start_time: float
+) -> List[dict]:
+    """Выполняет пакет промптов groups на резидентном воркере и заполняет responses"""
+    timeout = bound_timeout(sum(get_timeout(items[indexes[0]].get("timeout"), "video") for _, indexes in groups))
+    
+    def on_line(line: str, position: int):
+        if 0 <= position < len(groups):
+            for index in groups[position][1]:
+                _emit_line(on_events[index], "worker", line)
+    
+    logger.info("Пакетная генерация видео на резидентном воркере: %s промпт(ов), task=%s, size=%s", len(groups), task, size)
+    
+    try:
+        response = await video_worker_pool.generate(
+            {"batch": [
+                {"prompt": items[indexes[0]]["prompt"], "size": size, "save_file": output.save_file}
+                for (_, indexes), output in zip(groups, outputs)
+            ]},
+            timeout=timeout,
+            on_line=on_line
+        )
+        results = response.get("results") or []
+        if response.get("status") != "success" or len(results) != len(groups):
+            raise WorkerCrashed(response.get("error", "некорректный ответ на пакетное задание"))
+    except WorkerUnavailable as e:
+        logger.warning("%s. Задания пакета выполняются по одному", e)
+        for _, indexes in groups:
+            for index in indexes:
+                responses[index] = await generate_video(**items[index], on_event=on_events[index])
+        return responses
+    except (asyncio.TimeoutError, WorkerCrashed) as e:
+        elapsed = time.time() - start_time
+        if isinstance(e, asyncio.TimeoutError):
+            error_msg = f"Таймаут пакетной генерации видео после {elapsed:.2f}s"
+        else:
+            error_msg = f"Ошибка генерации видео: {e}"
+        logger.error(error_msg)
+        for _, indexes in groups:
+            for index in indexes:
+                responses[index] = {"result": None, "error": error_msg, "elapsed_time": elapsed}
+        return responses
+    
+    elapsed = time.time() - start_time
+    for (key, indexes), output, result in zip(groups, outputs, results):
+        item = items[indexes[0]]
+        response = _resident_response(result, item.get("duration", 5), item.get("fps", 24), size, task, elapsed)
+        response = await _describe_output(response, output)
+        if item.get("cache", True) and (response.get("result") or {}).get("video_path"):
+            response = await result_cache.set(key, response)
+        for index in indexes:
+            responses[index] = attach_artifact(dict(response))
+    return responses
+
+
+async def _generate_video(
     prompt: str,
     duration: int = 5,
     fps: int = 24,
@@ -180,7 +1140,8 @@ async def generate_video(
     task: Optional[str] = None,
     ckpt_dir: Optional[str] = None,
     generate_script_path: Optional[str] = None,
-    timeout: Optional[int] = None
+    timeout: Optional[int] = None,
+    emit: EventCallback = _ignore_event
 ) -> dict:
     """
     Генерирует видео используя локальный скрипт generate.py
@@ -194,10 +1155,61 @@ async def generate_video(
         ckpt_dir: Путь к директории с чекпоинтами
         generate_script_path: Путь к скрипту generate.py
         timeout: Таймаут выполнения в секундах
+        emit: Получает строки вывода и прогресс по мере выполнения
         
     Returns:
         dict с результатом генерации и метриками производительности
     """
+    async with artifact_registry.output() as output:
+        response = await _generate_video_file(
+            output,
+            prompt=prompt,
+            duration=duration,
+            fps=fps,
+            size=size,
+            task=task,
+            ckpt_dir=ckpt_dir,
+            generate_script_path=generate_script_path,
+            timeout=timeout,
+            emit=emit
+        )
+        return await _describe_output(response, output)
+
+
+async def _describe_output(response: dict, output: JobOutput) -> dict:
+    """
+    Проверяет, что генерация создала файл результата, и добавляет
+    в результат его метаданные (размер, контрольная сумма, длительность)
+    """
+    result = response.get("result")
+    if not isinstance(result, dict):
+        return response
+    if not os.path.exists(output.save_file):
+        error_msg = f"Генерация завершилась без файла результата {output.save_file}"
+        logger.error(error_msg)
+        return {
+            "result": None,
+            "error": error_msg,
+            "elapsed_time": response.get("elapsed_time")
+        }
+    output.keep = True
+    artifact = await artifact_registry.inspect(output.save_file)
+    return {**response, "result": {**result, "video_path": artifact.path, **artifact.metadata()}}
+
+
+async def _generate_video_file(
+    output: JobOutput,
+    prompt: str,
+    duration: int,
+    fps: int,
+    size: Optional[str],
+    task: Optional[str],
+    ckpt_dir: Optional[str],
+    generate_script_path: Optional[str],
+    timeout: Optional[int],
+    emit: EventCallback
+) -> dict:
+    """Генерирует видео в output.save_file (резидентный воркер или запуск generate.py)"""
     start_time = time.time()
     
     # Параметры по умолчанию
@@ -206,7 +1218,27 @@ async def generate_video(
     ckpt_dir = ckpt_dir or get_ckpt_dir()
     script_path = generate_script_path or get_generate_script_path()
     wan_python_path = get_wan_python_path() 
-    timeout = timeout or get_timeout()
+    # Генерация не продолжается после дедлайна запроса
+    timeout = bound_timeout(get_timeout(timeout, "video"))
+    if timeout <= 0:
+        raise DeadlineExceeded("Дедлайн запроса истек до начала генерации видео")
+    
+    # Резидентный воркер с уже загруженной моделью, если он подходит под параметры
+    if get_video_worker_mode() == "resident" and video_worker_pool.accepts(task, ckpt_dir, generate_script_path):
+        try:
+            return await _generate_video_resident(
+                prompt=prompt,
+                duration=duration,
+                fps=fps,
+                size=size,
+                task=task,
+                timeout=timeout,
+                start_time=start_time,
+                save_file=output.save_file,
+                emit=emit
+            )
+        except WorkerUnavailable as e:
+            logger.warning("%s. Используется запуск generate.py", e)
     
     # Проверяем существование скрипта
     if not os.path.exists(script_path):
@@ -219,7 +1251,7 @@ async def generate_video(
             "elapsed_time": elapsed
         }
     
-    logger.info(f"Запуск генерации видео: task={task}, size={size}, prompt='{prompt[:50]}...'")
+    logger.info("Запуск генерации видео: task=%s, size=%s, prompt='%s...'", task, size, prompt[:50])
     
     try:
         # Формируем команду для запуска скрипта
@@ -233,27 +1265,44 @@ async def generate_video(
             "--convert_model_dtype",
             "--t5_cpu",
             "--prompt",prompt,
+            "--save_file", output.save_file,
         ]
         
-        logger.info(f"Выполнение команды: {' '.join(cmd)}")
+        logger.info("Выполнение команды: %s", ' '.join(cmd))
         
         # Запускаем процесс асинхронно
         process = await asyncio.create_subprocess_exec(
-            *cmd,
+            *bound_command(cmd),
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
-            cwd=os.path.dirname(script_path) or os.getcwd()
+            cwd=os.path.dirname(script_path) or os.getcwd(),
+            # Временные файлы задания — в его собственной директории
+            env={**os.environ, "TMPDIR": output.scratch_dir, "TEMP": output.scratch_dir, "TMP": output.scratch_dir},
+            # Своя группа процессов: при остановке сигнал получат и потомки generate.py
+            **process_group_kwargs()
         )
         
+        # Читаем вывод построчно по мере поступления, храня только последние строки
+        stdout_tail = deque(maxlen=_OUTPUT_TAIL_LINES)
+        stderr_tail = deque(maxlen=_OUTPUT_TAIL_LINES)
+        
+        async def communicate():
+            await asyncio.gather(
+                _read_lines(process.stdout, "stdout", stdout_tail, emit),
+                _read_lines(process.stderr, "stderr", stderr_tail, emit)
+            )
+            await process.wait()
+        
         # Ждем завершения с таймаутом
         try:
-            stdout, stderr = await asyncio.wait_for(
-                process.communicate(),
-                timeout=timeout
-            )
+            await asyncio.wait_for(communicate(), timeout=timeout)
+        except asyncio.CancelledError:
+            # Задание отменено — не оставляем процесс работать впустую
+            await terminate_process_group(process)
+            logger.info("Генерация видео отменена, процесс остановлен")
+            raise
         except asyncio.TimeoutError:
-            process.kill()
-            await process.wait()
+            await terminate_process_group(process)
             elapsed = time.time() - start_time
             error_msg = f"Таймаут генерации видео после {elapsed:.2f}s"
             logger.error(error_msg)
@@ -265,26 +1314,16 @@ async def generate_video(
         
         elapsed = time.time() - start_time
         
-        # Декодируем вывод
-        stdout_text = stdout.decode('utf-8', errors='ignore') if stdout else ""
-        stderr_text = stderr.decode('utf-8', errors='ignore') if stderr else ""
+        stdout_text = "\n".join(stdout_tail)
+        stderr_text = "\n".join(stderr_tail)
         
         if process.returncode == 0:
-            logger.info(f"Генерация видео завершена успешно за {elapsed:.2f}s")
-            
-            # Пытаемся найти путь к сгенерированному видео в выводе
-            video_path = None
-            for line in stdout_text.split('\n'):
-                if '.mp4' in line or '.avi' in line or 'output' in line.lower():
-                    # Простая эвристика для поиска пути к видео
-                    if os.path.exists(line.strip()):
-                        video_path = line.strip()
-                        break
+            logger.info("Генерация видео завершена успешно за %.2fs", elapsed)
             
             return {
                 "result": {
                     "status": "success",
-                    "video_path": video_path,
+                    "video_path": output.save_file,
                     "stdout": stdout_text[-500:] if stdout_text else "",  # Последние 500 символов
                     "duration": duration,
                     "fps": fps,
@@ -295,7 +1334,7 @@ async def generate_video(
             }
         else:
             error_msg = f"Ошибка генерации видео: код возврата {process.returncode}"
-            logger.error(f"{error_msg}\nSTDERR: {stderr_text}")
+            logger.error("%s\nSTDERR: %s", error_msg, stderr_text)
             
             return {
                 "result": None,
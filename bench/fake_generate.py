@@ -0,0 +1,57 @@
+"""
+Фейковый generate.py WAN2.2 для бенчмарка
+
+Принимает аргументы настоящего скрипта, печатает прогресс шагов в формате
+tqdm и записывает минимальный MP4 в --save_file.
+
+Настройки (переменные окружения, формат задержки — bench/latency.py):
+    FAKE_GENERATE_LATENCY=lognormal:2:0.2   — время генерации
+    FAKE_GENERATE_ERROR_RATE=0               — доля запусков с кодом возврата 1
+    FAKE_GENERATE_STEPS=10                   — число шагов прогресса
+"""
+import argparse
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.latency import parse_latency, should_fail  # noqa: E402
+
+
+def _box(kind: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+
+def _write_mp4(path: str, duration: float):
+    """ftyp + moov/mvhd с длительностью + пустой mdat"""
+    timescale = 1000
+    mvhd = _box(b"mvhd", bytes(4) + struct.pack(">IIII", 0, 0, timescale, int(duration * timescale)) + bytes(80))
+    with open(path, "wb") as f:
+        f.write(_box(b"ftyp", b"isom" + bytes(4)) + _box(b"moov", mvhd) + _box(b"mdat", b""))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    for name in ("--task", "--size", "--ckpt_dir", "--offload_model", "--prompt", "--save_file"):
+        parser.add_argument(name)
+    parser.add_argument("--convert_model_dtype", action="store_true")
+    parser.add_argument("--t5_cpu", action="store_true")
+    args = parser.parse_args()
+
+    latency = parse_latency(os.getenv("FAKE_GENERATE_LATENCY", "lognormal:2:0.2"))()
+    steps = int(os.getenv("FAKE_GENERATE_STEPS", "10"))
+    for step in range(1, steps + 1):
+        time.sleep(latency / steps)
+        print(f"{step * 100 // steps}%| | {step}/{steps} [00:00<00:00]", flush=True)
+
+    if should_fail(float(os.getenv("FAKE_GENERATE_ERROR_RATE", "0"))):
+        print("Fake generation error", file=sys.stderr)
+        sys.exit(1)
+    _write_mp4(args.save_file, 5.0)
+    print(f"Saving generated video to {args.save_file}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
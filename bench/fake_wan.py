@@ -0,0 +1,97 @@
+"""
+Фейковый апстрим WAN2.2 для бенчмарка
+
+Отвечает на те же endpoint, что вызывает шлюз, с настраиваемой задержкой
+и долей ошибок (HTTP 500 или FAKE_WAN_ERROR_STATUS):
+    POST /generate (текст), /generate/image
+    POST /generate/batch, /generate/image/batch ({"items": [...]} -> {"results": [...]})
+    GET /health
+
+Настройки (переменные окружения, формат задержек — bench/latency.py):
+    FAKE_WAN_TEXT_LATENCY=lognormal:0.05:0.3
+    FAKE_WAN_IMAGE_LATENCY=lognormal:0.5:0.3
+    FAKE_WAN_ERROR_RATE=0
+    FAKE_WAN_ERROR_STATUS=500 — статус ошибок (503 — повторяемая шлюзом ошибка)
+    FAKE_WAN_IMAGE_BYTES=0    — больше 0: изображение в ответе как base64 PNG такого размера
+
+Запуск:
+    python -m uvicorn bench.fake_wan:app --port 8100
+"""
+import asyncio
+import base64
+import os
+import random
+
+from fastapi import FastAPI, HTTPException, Request
+
+from bench.latency import parse_latency, should_fail
+
+_rng = random.Random(os.getenv("FAKE_WAN_SEED"))
+_latency = {
+    "text": parse_latency(os.getenv("FAKE_WAN_TEXT_LATENCY", "lognormal:0.05:0.3"), _rng),
+    "image": parse_latency(os.getenv("FAKE_WAN_IMAGE_LATENCY", "lognormal:0.5:0.3"), _rng),
+}
+_error_rate = float(os.getenv("FAKE_WAN_ERROR_RATE", "0"))
+_error_status = int(os.getenv("FAKE_WAN_ERROR_STATUS", "500"))
+_image_bytes = int(os.getenv("FAKE_WAN_IMAGE_BYTES", "0"))
+# Одно и то же "изображение" для всех ответов: сигнатура PNG и случайные байты
+_image_base64 = (
+    base64.b64encode(b"\x89PNG\r\n\x1a\n" + os.urandom(max(_image_bytes - 8, 0))).decode("ascii")
+    if _image_bytes > 0 else None
+)
+
+app = FastAPI(title="Fake WAN2.2 upstream")
+
+
+def _result(kind: str, payload: dict) -> dict:
+    prompt = payload.get("prompt", "")
+    if kind == "text":
+        return {"content": f"Fake text for: {prompt}"}
+    if _image_base64 is not None:
+        return {"image": _image_base64, "format": "png"}
+    return {"image_url": f"http://fake-wan/images/{abs(hash(prompt))}.png"}
+
+
+@app.get("/health")
+async def health():
+    return {"status": "healthy"}
+
+
+async def _generate(kind: str, request: Request) -> dict:
+    payload = await request.json()
+    await asyncio.sleep(_latency[kind]())
+    if should_fail(_error_rate, _rng):
+        raise HTTPException(status_code=_error_status, detail="Fake upstream error")
+    return _result(kind, payload)
+
+
+async def _generate_batch(kind: str, request: Request) -> dict:
+    items = (await request.json())["items"]
+    # Пакет на GPU выполняется за время самого долгого элемента
+    await asyncio.sleep(max(_latency[kind]() for _ in items))
+    return {
+        "results": [
+            {"error": "Fake upstream error"} if should_fail(_error_rate, _rng) else _result(kind, item)
+            for item in items
+        ]
+    }
+
+
+@app.post("/generate")
+async def generate_text(request: Request):
+    return await _generate("text", request)
+
+
+@app.post("/generate/batch")
+async def generate_text_batch(request: Request):
+    return await _generate_batch("text", request)
+
+
+@app.post("/generate/image")
+async def generate_image(request: Request):
+    return await _generate("image", request)
+
+
+@app.post("/generate/image/batch")
+async def generate_image_batch(request: Request):
+    return await _generate_batch("image", request)
@@ -0,0 +1,140 @@
+"""
+Микробенчмарк сериализации JSON
+
+Сравнивает пути кодирования ответа шлюза и разбора ответа апстрима:
+    - fastapi: jsonable_encoder + json.dumps (JSONResponse без response_model)
+    - model: валидация в GenerationResponse + сериализация pydantic-core
+    - model+orjson: валидация + model_dump + orjson (response_model с FastJSONResponse)
+    - orjson: orjson.dumps готового dict (FastJSONResponse без response_model)
+    - json.loads / orjson.loads: разбор тела ответа апстрима
+
+Запуск: python -m bench.json_codec [--number 2000] [--image-bytes 1048576] [--large-items 2000]
+Без установленного orjson строки с ним пропускаются.
+"""
+import argparse
+import base64
+import json
+import os
+import timeit
+from typing import Any, Callable, Dict, List, Tuple
+
+from fastapi.encoders import jsonable_encoder
+
+from app.routers.generate import GenerationResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def text_response() -> Dict[str, Any]:
+    """Типичный ответ генерации текста"""
+    return {
+        "result": {
+            "content": "Короткий ответ модели на запрос пользователя. " * 8,
+            "finish_reason": "stop",
+            "usage": {"prompt_tokens": 42, "completion_tokens": 128, "total_tokens": 170},
+        },
+        "elapsed_time": 1.234,
+        "api_url": "http://localhost:7860",
+        "cached": False,
+        "batch_size": 4,
+    }
+
+
+def image_response(size: int) -> Dict[str, Any]:
+    """Ответ генерации изображения с base64 (output=inline)"""
+    return {
+        "result": {"image": base64.b64encode(os.urandom(size)).decode("ascii"), "format": "png"},
+        "elapsed_time": 3.2,
+        "api_url": "http://localhost:7860",
+    }
+
+
+def large_response(items: int) -> Dict[str, Any]:
+    """Большой ответ с множеством вложенных объектов"""
+    return {
+        "result": {
+            "segments": [
+                {"index": i, "text": f"Сегмент номер {i}", "score": i / items, "tokens": [i, i + 1, i + 2]}
+                for i in range(items)
+            ],
+            "status": "ok",
+        },
+        "elapsed_time": 12.5,
+        "api_url": "http://localhost:7860",
+    }
+
+
+def _stdlib_render(content: Any) -> bytes:
+    """То же, что JSONResponse.render"""
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def encoders() -> List[Tuple[str, Callable[[Dict[str, Any]], bytes]]]:
+    cases = [
+        ("fastapi (jsonable_encoder + json)", lambda value: _stdlib_render(jsonable_encoder(value))),
+        (
+            "model (pydantic-core)",
+            lambda value: GenerationResponse.model_validate(value).model_dump_json(exclude_unset=True).encode("utf-8"),
+        ),
+    ]
+    if orjson is not None:
+        cases += [
+            (
+                "model + orjson",
+                lambda value: orjson.dumps(
+                    GenerationResponse.model_validate(value).model_dump(mode="json", exclude_unset=True)
+                ),
+            ),
+            ("orjson", lambda value: orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)),
+        ]
+    return cases
+
+
+def decoders() -> List[Tuple[str, Callable[[bytes], Any]]]:
+    cases: List[Tuple[str, Callable[[bytes], Any]]] = [("json.loads", json.loads)]
+    if orjson is not None:
+        cases.append(("orjson.loads", orjson.loads))
+    return cases
+
+
+def measure(func: Callable[[Any], Any], value: Any, number: int) -> float:
+    """Лучшее из трех время одного вызова в микросекундах"""
+    return min(timeit.repeat(lambda: func(value), number=number, repeat=3)) / number * 1e6
+
+
+def run(number: int, image_bytes: int, large_items: int):
+    payloads = [
+        ("text", text_response(), number),
+        ("image", image_response(image_bytes), max(number // 100, 10)),
+        ("large", large_response(large_items), max(number // 100, 10)),
+    ]
+    print(f"orjson: {'есть' if orjson is not None else 'не установлен'}")
+    for name, payload, count in payloads:
+        body = _stdlib_render(payload)
+        print(f"\n{name}: {len(body)} байт")
+        baseline = None
+        for label, func in encoders():
+            elapsed = measure(func, payload, count)
+            baseline = baseline or elapsed
+            print(f"  encode {label:<36} {elapsed:10.1f} мкс  x{baseline / elapsed:.1f}")
+        baseline = None
+        for label, func in decoders():
+            elapsed = measure(func, body, count)
+            baseline = baseline or elapsed
+            print(f"  decode {label:<36} {elapsed:10.1f} мкс  x{baseline / elapsed:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарк сериализации JSON")
+    parser.add_argument("--number", type=int, default=2000, help="Вызовов на замер для обычного ответа")
+    parser.add_argument("--image-bytes", type=int, default=1024 * 1024, help="Размер изображения в ответе")
+    parser.add_argument("--large-items", type=int, default=2000, help="Сегментов в большом ответе")
+    args = parser.parse_args()
+    run(args.number, args.image_bytes, args.large_items)
+
+
+if __name__ == "__main__":
+    main()
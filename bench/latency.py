@@ -0,0 +1,38 @@
+"""
+Распределения задержек и ошибок для фейковых бэкендов бенчмарка
+
+Задержка задается строкой "распределение:параметры" (секунды):
+    const:0.05            — всегда 50 мс
+    uniform:0.02:0.1      — равномерно от 20 до 100 мс
+    exp:0.05              — экспоненциально, среднее 50 мс
+    lognormal:0.05:0.5    — логнормально, медиана 50 мс, sigma 0.5 (длинный хвост)
+"""
+import math
+import random
+from typing import Callable, Optional
+
+
+def parse_latency(spec: str, rng: Optional[random.Random] = None) -> Callable[[], float]:
+    """
+    Возвращает генератор задержек по описанию распределения
+
+    Raises:
+        ValueError: неизвестное распределение или неверные параметры
+    """
+    rng = rng or random.Random()
+    name, _, rest = spec.strip().partition(":")
+    params = [float(value) for value in rest.split(":")] if rest else []
+    if name == "const" and len(params) == 1:
+        return lambda: params[0]
+    if name == "uniform" and len(params) == 2:
+        return lambda: rng.uniform(params[0], params[1])
+    if name == "exp" and len(params) == 1:
+        return lambda: rng.expovariate(1 / params[0]) if params[0] > 0 else 0.0
+    if name == "lognormal" and len(params) == 2:
+        return lambda: rng.lognormvariate(math.log(params[0]), params[1])
+    raise ValueError(f"Неверное описание задержки: {spec}")
+
+
+def should_fail(error_rate: float, rng: Optional[random.Random] = None) -> bool:
+    """Выпадает ли ошибка с вероятностью error_rate"""
+    return (rng or random).random() < error_rate
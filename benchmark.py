@@ -0,0 +1,387 @@
+"""
+Бенчмарк API Gateway на фейковых бэкендах
+
+Запускает шлюз (uvicorn), фейковый апстрим WAN2.2 (bench/fake_wan.py)
+и подставляет фейковый generate.py (bench/fake_generate.py), затем подает
+нагрузку из смеси text/image/video и выводит отчет в JSON: пропускная
+способность, p50/p95/p99 задержки и доля ошибок по каждому типу запросов.
+
+Модели нагрузки:
+    open   — запросы приходят с постоянной частотой --rate в секунду
+             (или пуассоновским потоком с --arrival poisson), независимо
+             от того, как быстро отвечает шлюз
+    closed — --concurrency клиентов, каждый отправляет следующий запрос
+             сразу после ответа на предыдущий
+
+Примеры:
+    python benchmark.py --mode open --rate 20 --duration 30 --mix text=0.7,image=0.25,video=0.05
+    python benchmark.py --mode closed --concurrency 16 --output after.json --baseline before.json
+    python benchmark.py --gateway-url http://localhost:8000 --mix text=1   # уже запущенный шлюз
+
+С --baseline в отчет добавляется сравнение с предыдущим отчетом.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+KINDS = ("text", "image", "video")
+# Метрики, которые сравниваются с базовым отчетом
+COMPARED = ("throughput_rps", "error_rate", "p50_ms", "p95_ms", "p99_ms")
+
+
+class Sample:
+    """Результат одного запроса"""
+
+    def __init__(self, kind: str, started: float, latency: float, outcome: str):
+        self.kind = kind
+        self.started = started
+        self.latency = latency
+        # "ok", "status 429", "error", "timeout", ...
+        self.outcome = outcome
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """Разбирает смесь "text=0.7,image=0.3" в нормированные веса"""
+    mix: Dict[str, float] = {}
+    for part in value.split(","):
+        kind, _, weight = part.strip().partition("=")
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f"Неизвестный тип запроса: {kind}")
+        mix[kind] = float(weight or 1)
+    total = sum(mix.values())
+    if total <= 0:
+        raise argparse.ArgumentTypeError("Сумма весов смеси должна быть больше 0")
+    return {kind: weight / total for kind, weight in mix.items()}
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Перцентиль по методу ближайшего ранга"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# --- Запуск шлюза и фейковых бэкендов ---
+
+def _start_uvicorn(app: str, port: int, env: Dict[str, str], log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w", encoding="utf-8")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT,
+        env={**os.environ, **env},
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+
+
+async def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2.0) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Процесс завершился с кодом {process.returncode} при запуске ({url})")
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} не ответил за {timeout:.0f}s")
+
+
+def _stop(process: subprocess.Popen):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+# --- Нагрузка ---
+
+def _request(kind: str, number: int, image_output: Optional[str]) -> tuple:
+    """Endpoint и тело запроса; промпты уникальны, чтобы не попадать в кэш и singleflight"""
+    prompt = f"benchmark {kind} #{number}"
+    if kind == "text":
+        return "/api/generate/text", {"prompt": prompt}
+    if kind == "image":
+        body = {"prompt": prompt, "width": 512, "height": 512, "steps": 10, "cache": False}
+        if image_output:
+            body["output"] = image_output
+        return "/api/generate/image", body
+    return "/api/generate/video", {"prompt": prompt, "cache": False}
+
+
+async def _send(
+    client: httpx.AsyncClient,
+    base_url: str,
+    kind: str,
+    number: int,
+    origin: float,
+    image_output: Optional[str] = None
+) -> Sample:
+    path, body = _request(kind, number, image_output)
+    started = time.monotonic()
+    try:
+        response = await client.post(f"{base_url}{path}", json=body)
+        data = response.json() if response.status_code == 200 else None
+        if response.status_code != 200:
+            outcome = f"status {response.status_code}"
+        elif kind == "image" and image_output == "stream":
+            # Тело ответа апстрима как есть, без полей шлюза
+            outcome = "error" if data.get("error") else "ok"
+        else:
+            outcome = "ok" if data.get("result") is not None and not data.get("error") else "error"
+    except httpx.TimeoutException:
+        outcome = "timeout"
+    except httpx.HTTPError as e:
+        outcome = type(e).__name__
+    return Sample(kind, started - origin, time.monotonic() - started, outcome)
+
+
+async def run_open_loop(client, base_url, mix, rate, duration, arrival, rng, image_output=None) -> List[Sample]:
+    """Постоянная частота запросов: следующий запрос отправляется по расписанию, а не после ответа"""
+    origin = time.monotonic()
+    kinds, weights = list(mix), list(mix.values())
+    tasks = []
+    next_at = 0.0
+    number = 0
+    while next_at < duration:
+        delay = origin + next_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        kind = rng.choices(kinds, weights)[0]
+        tasks.append(asyncio.create_task(_send(client, base_url, kind, number, origin, image_output)))
+        number += 1
+        next_at += rng.expovariate(rate) if arrival == "poisson" else 1 / rate
+    return list(await asyncio.gather(*tasks))
+
+
+async def run_closed_loop(client, base_url, mix, concurrency, duration, rng, image_output=None) -> List[Sample]:
+    """concurrency клиентов, каждый ждет ответа перед следующим запросом"""
+    origin = time.monotonic()
+    kinds, weights = list(mix), list(mix.values())
+    samples: List[Sample] = []
+    counter = iter(range(sys.maxsize))
+
+    async def user():
+        while time.monotonic() - origin < duration:
+            kind = rng.choices(kinds, weights)[0]
+            samples.append(await _send(client, base_url, kind, next(counter), origin, image_output))
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return samples
+
+
+# --- Отчет ---
+
+def summarize(samples: List[Sample], window: float) -> Dict[str, Any]:
+    """Пропускная способность, перцентили задержки успешных запросов и ошибки"""
+    ok = [sample.latency * 1000 for sample in samples if sample.outcome == "ok"]
+    errors: Dict[str, int] = {}
+    for sample in samples:
+        if sample.outcome != "ok":
+            errors[sample.outcome] = errors.get(sample.outcome, 0) + 1
+
+    def rounded(value: Optional[float]) -> Optional[float]:
+        return round(value, 2) if value is not None else None
+
+    return {
+        "requests": len(samples),
+        "succeeded": len(ok),
+        "failed": len(samples) - len(ok),
+        "error_rate": round((len(samples) - len(ok)) / len(samples), 4) if samples else 0.0,
+        "errors": errors,
+        "throughput_rps": round(len(ok) / window, 3) if window > 0 else 0.0,
+        "p50_ms": rounded(percentile(ok, 50)),
+        "p95_ms": rounded(percentile(ok, 95)),
+        "p99_ms": rounded(percentile(ok, 99)),
+        "mean_ms": rounded(sum(ok) / len(ok)) if ok else None,
+        "max_ms": rounded(max(ok)) if ok else None,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, Any]:
+    """Изменение ключевых метрик относительно базового отчета"""
+    comparison = {}
+    sections = {"overall": (current["overall"], baseline.get("overall", {}))}
+    for kind, stats in current["by_kind"].items():
+        sections[kind] = (stats, baseline.get("by_kind", {}).get(kind, {}))
+    for name, (now, before) in sections.items():
+        entry = {}
+        for metric in COMPARED:
+            value, base = now.get(metric), before.get(metric)
+            if value is None or base is None:
+                continue
+            change = round((value - base) / base * 100, 1) if base else None
+            entry[metric] = {"baseline": base, "current": value, "change_pct": change}
+        comparison[name] = entry
+    return comparison
+
+
+async def benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    processes: List[subprocess.Popen] = []
+    workdir = tempfile.mkdtemp(prefix="wan-bench-")
+    base_url = args.gateway_url
+    try:
+        if base_url is None:
+            upstream_urls = []
+            for index in range(args.upstreams):
+                upstream_port = _free_port()
+                upstream_url = f"http://127.0.0.1:{upstream_port}"
+                upstream = _start_uvicorn("bench.fake_wan:app", upstream_port, {
+                    "FAKE_WAN_TEXT_LATENCY": args.text_latency,
+                    "FAKE_WAN_IMAGE_LATENCY": args.image_latency,
+                    "FAKE_WAN_ERROR_RATE": str(args.error_rate),
+                    "FAKE_WAN_ERROR_STATUS": str(args.error_status),
+                    "FAKE_WAN_IMAGE_BYTES": str(args.image_bytes),
+                    "FAKE_WAN_SEED": str(args.seed + index),
+                }, os.path.join(workdir, f"fake_wan{index or ''}.log"))
+                processes.append(upstream)
+                await _wait_ready(f"{upstream_url}/health", upstream)
+                upstream_urls.append(upstream_url)
+            gateway_port = _free_port()
+
+            gateway_env = {
+                "WAN_API_URL": upstream_urls[0],
+                "WAN_API_URLS": ",".join(upstream_urls),
+                "GENERATE_SCRIPT_PATH": os.path.join(ROOT, "bench", "fake_generate.py"),
+                "WAN_PYTHON_PATH": sys.executable,
+                "VIDEO_WORKER_MODE": "subprocess",
+                "FAKE_GENERATE_LATENCY": args.video_latency,
+                "FAKE_GENERATE_ERROR_RATE": str(args.video_error_rate),
+                "CACHE_ENABLED": "false",
+                "JOB_STORE": "memory",
+                "ARTIFACT_DIR": os.path.join(workdir, "outputs"),
+                "LOG_DIR": os.path.join(workdir, "logs"),
+            }
+            for item in args.env:
+                name, _, value = item.partition("=")
+                gateway_env[name] = value
+            base_url = f"http://127.0.0.1:{gateway_port}"
+            gateway = _start_uvicorn("app.main:app", gateway_port, gateway_env, os.path.join(workdir, "gateway.log"))
+            processes.append(gateway)
+            await _wait_ready(f"{base_url}/api/health", gateway)
+
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(timeout=args.request_timeout, limits=limits) as client:
+            started_at = datetime.now().isoformat(timespec="seconds")
+            if args.mode == "open":
+                samples = await run_open_loop(
+                    client, base_url, args.mix, args.rate, args.duration, args.arrival, rng, args.image_output
+                )
+            else:
+                samples = await run_closed_loop(
+                    client, base_url, args.mix, args.concurrency, args.duration, rng, args.image_output
+                )
+            try:
+                gateway_metrics = (await client.get(f"{base_url}/metrics")).json()
+            except (httpx.HTTPError, ValueError):
+                gateway_metrics = None
+    finally:
+        for process in reversed(processes):
+            _stop(process)
+
+    measured = [sample for sample in samples if sample.started >= args.warmup]
+    window = max(args.duration - args.warmup, 1e-9)
+    return {
+        "config": {
+            "mode": args.mode,
+            "rate": args.rate if args.mode == "open" else None,
+            "arrival": args.arrival if args.mode == "open" else None,
+            "concurrency": args.concurrency if args.mode == "closed" else None,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "mix": args.mix,
+            "seed": args.seed,
+            "gateway_url": args.gateway_url,
+            "text_latency": args.text_latency,
+            "image_latency": args.image_latency,
+            "video_latency": args.video_latency,
+            "error_rate": args.error_rate,
+            "error_status": args.error_status,
+            "upstreams": args.upstreams,
+            "video_error_rate": args.video_error_rate,
+            "image_bytes": args.image_bytes,
+            "image_output": args.image_output,
+            "env": args.env,
+        },
+        "started_at": started_at,
+        "logs_dir": workdir if args.gateway_url is None else None,
+        "overall": summarize(measured, window),
+        "by_kind": {
+            kind: summarize([sample for sample in measured if sample.kind == kind], window)
+            for kind in args.mix
+        },
+        "gateway_metrics": gateway_metrics,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк WAN2.2 API Gateway")
+    parser.add_argument("--mode", choices=("open", "closed"), default="open", help="Модель нагрузки")
+    parser.add_argument("--rate", type=float, default=10.0, help="Запросов в секунду (open)")
+    parser.add_argument("--arrival", choices=("constant", "poisson"), default="constant", help="Интервалы прихода (open)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Число клиентов (closed)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Длительность подачи нагрузки, сек")
+    parser.add_argument("--warmup", type=float, default=0.0, help="Запросы первых N секунд не входят в отчет")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("text=0.7,image=0.25,video=0.05"),
+                        help="Смесь запросов, например text=0.7,image=0.25,video=0.05")
+    parser.add_argument("--seed", type=int, default=1, help="Seed генератора нагрузки и фейкового апстрима")
+    parser.add_argument("--request-timeout", type=float, default=600.0, help="Таймаут одного запроса, сек")
+    parser.add_argument("--gateway-url", default=None, help="Нагружать уже запущенный шлюз вместо запуска своего")
+    parser.add_argument("--text-latency", default="lognormal:0.05:0.3", help="Задержка апстрима для текста")
+    parser.add_argument("--image-latency", default="lognormal:0.5:0.3", help="Задержка апстрима для изображений")
+    parser.add_argument("--video-latency", default="lognormal:2:0.2", help="Время работы фейкового generate.py")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ошибок апстрима")
+    parser.add_argument("--error-status", type=int, default=500, help="HTTP статус ошибок апстрима")
+    parser.add_argument("--upstreams", type=int, default=1, help="Число фейковых апстримов")
+    parser.add_argument("--video-error-rate", type=float, default=0.0, help="Доля ошибок generate.py")
+    parser.add_argument("--image-bytes", type=int, default=0,
+                        help="Размер изображения base64 в ответе апстрима (0 — только ссылка)")
+    parser.add_argument("--image-output", choices=("inline", "artifact", "stream"), default=None,
+                        help="Поле output запросов изображений (по умолчанию IMAGE_OUTPUT шлюза)")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Дополнительная переменная окружения шлюза (можно повторять)")
+    parser.add_argument("--output", help="Файл отчета JSON (по умолчанию stdout)")
+    parser.add_argument("--baseline", help="Предыдущий отчет JSON для сравнения")
+    args = parser.parse_args()
+
+    report = asyncio.run(benchmark(args))
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            report["comparison"] = compare(report, json.load(f))
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(json.dumps({"overall": report["overall"], "comparison": report.get("comparison")}, ensure_ascii=False, indent=2))
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,15 @@
 """
 Нагрузочное тестирование API Gateway
-Имитирует 5 одновременных запросов на генерацию изображений
+Имитирует N одновременных запросов на генерацию изображений (или видео)
+
+    python load_test.py --url http://localhost:8000 --requests 5 --kind image
+
+Для воспроизводимых замеров с перцентилями и отчетом JSON см. benchmark.py
 """
 
+import argparse
 import asyncio
+import os
 import httpx
 import json
 from datetime import datetime
@@ -58,7 +64,7 @@ async def generate_image_request(
 async def generate_video_request(
     client: httpx.AsyncClient, user_id: int, base_url: str
 ):
-    """Отправляет запрос на генерацию изображения"""
+    """Отправляет запрос на генерацию видео"""
     prompt = "Pretty woman walks across the beach"
 
     start_time = time()
@@ -102,9 +108,9 @@ async def generate_video_request(
         }
 
 
-async def load_test(num_requests: int = 5):
+async def load_test(num_requests: int = 5, base_url: str = "http://localhost:8000", kind: str = "image"):
     """Запускает нагрузочный тест с заданным количеством одновременных запросов"""
-    base_url = "http://localhost:8000"
+    send_request = generate_video_request if kind == "video" else generate_image_request
 
     print("=" * 70)
     print(f"НАГРУЗОЧНОЕ ТЕСТИРОВАНИЕ - {num_requests} одновременных запросов")
@@ -135,7 +141,7 @@ async def load_test(num_requests: int = 5):
     async with httpx.AsyncClient(timeout=600.0) as client:
         # Создаем все задачи одновременно
         tasks = [
-            generate_video_request(client, user_id=i + 1, base_url=base_url)
+            send_request(client, user_id=i + 1, base_url=base_url)
             for i in range(num_requests)
         ]
 
@@ -204,10 +210,16 @@ async def load_test(num_requests: int = 5):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочное тестирование API Gateway")
+    parser.add_argument("--url", default=os.getenv("LOAD_TEST_URL", "http://localhost:8000"), help="Адрес шлюза")
+    parser.add_argument("--requests", type=int, default=5, help="Число одновременных запросов")
+    parser.add_argument("--kind", choices=("image", "video"), default="image", help="Тип генерации")
+    args = parser.parse_args()
+
     print("\n" + "=" * 70)
     print("НАГРУЗОЧНОЕ ТЕСТИРОВАНИЕ API GATEWAY")
     print("=" * 70)
-    print("\nЭтот тест имитирует ситуацию, когда 5 человек одновременно")
-    print("отправляют запросы на генерацию изображений.\n")
+    print(f"\nЭтот тест имитирует ситуацию, когда {args.requests} человек одновременно")
+    print("отправляют запросы на генерацию " + ("видео" if args.kind == "video" else "изображений") + ".\n")
 
-    asyncio.run(load_test(num_requests=5))
+    asyncio.run(load_test(num_requests=args.requests, base_url=args.url, kind=args.kind))
@@ -0,0 +1,132 @@
+"""Тесты контроля допуска (ConcurrencyLimiter)"""
+import asyncio
+import time
+
+import pytest
+
+from app.services.admission import AdmissionRejected, ConcurrencyLimiter, DeadlineExceeded
+from app.services.clients import Client
+from app.services.deadlines import deadline_var
+
+
+def _limiter(max_concurrent: int = 1, max_queue: int = 4, max_wait: float = 5.0) -> ConcurrencyLimiter:
+    return ConcurrencyLimiter("text", max_concurrent, max_queue, max_wait)
+
+
+async def _wait_queued(limiter: ConcurrencyLimiter, count: int):
+    while limiter.waiting < count:
+        await asyncio.sleep(0)
+
+
+def test_full_queue_and_client_quota_are_rejected_with_429():
+    async def scenario():
+        limiter = _limiter(max_queue=4)
+        await limiter.acquire()
+        noisy = Client("noisy")
+        # CLIENT_MAX_QUEUE_SHARE=0.5: клиенту доступны 2 места из 4
+        waiters = [asyncio.create_task(limiter.acquire(noisy)) for _ in range(2)]
+        await _wait_queued(limiter, 2)
+        with pytest.raises(AdmissionRejected) as quota:
+            await limiter.acquire(noisy)
+
+        waiters += [asyncio.create_task(limiter.acquire(Client(f"c{i}"))) for i in range(2)]
+        await _wait_queued(limiter, 4)
+        with pytest.raises(AdmissionRejected) as full:
+            await limiter.acquire(Client("late"))
+
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        return limiter, quota.value, full.value
+
+    limiter, quota, full = asyncio.run(scenario())
+    assert quota.status_code == full.status_code == 429
+    assert (limiter.rejected_client_quota, limiter.rejected_queue_full) == (1, 1)
+    # Отмененные ожидающие убраны из очереди
+    assert limiter.waiting == 0
+
+
+def test_wait_timeout_is_rejected_with_503():
+    async def scenario():
+        limiter = _limiter(max_wait=0.05)
+        await limiter.acquire()
+        with pytest.raises(AdmissionRejected) as error:
+            await limiter.acquire()
+        return limiter, error.value
+
+    limiter, error = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert limiter.rejected_wait_timeout == 1
+    assert limiter.waiting == 0
+
+
+def test_expired_deadline_is_rejected_before_queueing():
+    async def scenario():
+        limiter = _limiter(max_concurrent=4)
+        deadline_var.set(time.time() - 1)
+        with pytest.raises(DeadlineExceeded) as error:
+            await limiter.acquire()
+        return limiter, error.value
+
+    limiter, error = asyncio.run(scenario())
+    assert error.status_code == 504
+    assert (limiter.rejected_deadline, limiter.active) == (1, 0)
+
+
+def test_deadline_too_close_for_expected_wait_is_rejected_early():
+    async def scenario():
+        limiter = _limiter()
+        # Среднее удержание слота — 0.1s: ожидание в очереди плюс выполнение ~0.2s
+        async with limiter.slot():
+            await asyncio.sleep(0.1)
+        await limiter.acquire()
+        deadline_var.set(time.time() + 0.05)
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            await limiter.acquire()
+        return limiter, time.monotonic() - started
+
+    limiter, waited = asyncio.run(scenario())
+    assert limiter.rejected_deadline == 1
+    # Отказ сразу, без ожидания в очереди
+    assert waited < 0.04
+    assert limiter.waiting == 0
+
+
+def test_deadline_expiring_in_queue_is_rejected_with_504():
+    async def scenario():
+        limiter = _limiter(max_wait=5.0)
+        await limiter.acquire()
+        # Без истории удержания оценки нет, запрос встает в очередь и ждет до дедлайна
+        deadline_var.set(time.time() + 0.05)
+        with pytest.raises(DeadlineExceeded):
+            await limiter.acquire()
+        return limiter
+
+    limiter = asyncio.run(scenario())
+    assert (limiter.rejected_deadline, limiter.rejected_wait_timeout) == (1, 0)
+    assert limiter.waiting == 0
+
+
+def test_released_slot_goes_to_higher_priority_class_first():
+    async def scenario():
+        limiter = _limiter()
+        await limiter.acquire()
+        order = []
+
+        async def request(client: Client):
+            await limiter.acquire(client)
+            order.append(client.id)
+            limiter.release(client)
+
+        batch = asyncio.create_task(request(Client("nightly", priority_class="batch")))
+        await _wait_queued(limiter, 1)
+        interactive = asyncio.create_task(request(Client("frontend", priority_class="interactive")))
+        await _wait_queued(limiter, 2)
+        limiter.release()
+        await asyncio.gather(batch, interactive)
+        return limiter, order
+
+    limiter, order = asyncio.run(scenario())
+    assert order == ["frontend", "nightly"]
+    assert limiter.active == 0
@@ -0,0 +1,88 @@
+"""Тесты отдачи артефактов: Range, ETag и передача файла"""
+import asyncio
+import os
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.routers import artifacts
+from app.routers.artifacts import ZEROCOPY_EXTENSION, ArtifactResponse
+from app.services.artifacts import artifact_registry
+
+# Больше ArtifactResponse.chunk_size, чтобы чтение в потоке шло несколькими блоками
+_CONTENT = os.urandom(ArtifactResponse.chunk_size * 2 + 12345)
+
+
+@pytest.fixture
+def artifact(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(_CONTENT)
+    return artifact_registry.register(str(path))
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(artifacts.router)
+    return TestClient(app)
+
+
+def test_full_file_without_zerocopy_is_read_in_thread(client, artifact):
+    # TestClient, как и uvicorn, не предоставляет zerocopysend и pathsend
+    response = client.get(f"/api/artifacts/{artifact.id}")
+    assert response.status_code == 200
+    assert response.content == _CONTENT
+    assert response.headers["content-length"] == str(len(_CONTENT))
+    assert response.headers["accept-ranges"] == "bytes"
+
+
+def test_single_range_without_zerocopy(client, artifact):
+    start, end = 100, ArtifactResponse.chunk_size + 200
+    response = client.get(f"/api/artifacts/{artifact.id}", headers={"Range": f"bytes={start}-{end}"})
+    assert response.status_code == 206
+    assert response.content == _CONTENT[start:end + 1]
+    assert response.headers["content-range"] == f"bytes {start}-{end}/{len(_CONTENT)}"
+
+    suffix = client.get(f"/api/artifacts/{artifact.id}", headers={"Range": "bytes=-10"})
+    assert suffix.content == _CONTENT[-10:]
+
+    unsatisfiable = client.get(f"/api/artifacts/{artifact.id}", headers={"Range": f"bytes={len(_CONTENT)}-"})
+    assert unsatisfiable.status_code == 416
+    assert unsatisfiable.headers["content-range"] == f"bytes */{len(_CONTENT)}"
+
+
+def test_etag_revalidation_and_if_range(client, artifact):
+    etag = client.head(f"/api/artifacts/{artifact.id}").headers["etag"]
+
+    assert client.get(f"/api/artifacts/{artifact.id}", headers={"If-None-Match": etag}).status_code == 304
+    # If-Range с устаревшим ETag — весь файл вместо диапазона
+    stale = client.get(f"/api/artifacts/{artifact.id}", headers={"Range": "bytes=0-9", "If-Range": '"old"'})
+    assert stale.status_code == 200
+    assert stale.content == _CONTENT
+
+
+def test_range_with_zerocopy_extension_uses_sendfile_message(artifact):
+    response = ArtifactResponse(artifact.path, stat_result=os.stat(artifact.path))
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "headers": [(b"range", b"bytes=10-19")],
+        "extensions": {ZEROCOPY_EXTENSION: {}},
+    }
+    messages = []
+
+    async def send(message):
+        if message["type"] == ZEROCOPY_EXTENSION:
+            file = message["file"]
+            file.seek(message["offset"])
+            message = {**message, "data": file.read(message["count"])}
+        messages.append(message)
+
+    async def receive():
+        return {"type": "http.request"}
+
+    asyncio.run(response(scope, receive, send))
+    assert messages[0]["status"] == 206
+    assert messages[1]["type"] == ZEROCOPY_EXTENSION
+    assert messages[1]["data"] == _CONTENT[10:20]
@@ -0,0 +1,72 @@
+"""Тесты выбора апстрима и исключения нездоровых апстримов"""
+from collections import Counter
+
+import pytest
+
+from app import config
+from app.services import backends
+from app.services.backends import BackendPool
+from app.services.circuit_breaker import CircuitBreakerRegistry, CircuitOpen
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """Пул из апстримов с весами 3 и 1 и свежими circuit breaker'ами"""
+    original = config.get_settings()
+
+    def build(**values) -> BackendPool:
+        upstream = original.upstream.model_copy(update={"api_urls": "http://a|3,http://b", **values})
+        config.replace_settings(original.model_copy(update={"upstream": upstream}))
+        monkeypatch.setattr(backends, "circuit_breakers", CircuitBreakerRegistry())
+        return BackendPool()
+
+    yield build
+    config.replace_settings(original)
+
+
+def test_round_robin_follows_weights_smoothly(pool):
+    backend_pool = pool(lb_strategy="round_robin")
+    picks = [backend_pool.select().url for _ in range(8)]
+    assert Counter(picks) == {"http://a": 6, "http://b": 2}
+    # Smooth weighted round-robin не отдает тяжелому апстриму все запросы подряд
+    assert picks[:4].count("http://b") == 1
+
+
+def test_exclude_prefers_untried_backend(pool):
+    backend_pool = pool(lb_strategy="round_robin")
+    assert all(backend_pool.select(exclude=["http://a"]).url == "http://b" for _ in range(3))
+    # Если исключены все, выбирается любой
+    assert backend_pool.select(exclude=["http://a", "http://b"]).url in ("http://a", "http://b")
+
+
+def test_least_outstanding_accounts_for_weight(pool):
+    backend_pool = pool(lb_strategy="least_outstanding")
+    a, b = backend_pool.backends
+    for _ in range(2):
+        backend_pool.on_start(a)
+    backend_pool.on_start(b)
+    # 2/3 у a меньше 1/1 у b
+    assert backend_pool.select() is a
+
+
+def test_failing_backend_is_ejected_and_skipped(pool):
+    backend_pool = pool(lb_strategy="round_robin", health_interval=10, max_failures=2)
+    a, b = backend_pool.backends
+    for _ in range(2):
+        backend_pool.on_start(a)
+        backend_pool.on_finish(a, 0.1, success=False)
+    assert not a.healthy and a.ejections == 1
+    assert {backend_pool.select().url for _ in range(4)} == {"http://b"}
+
+    # Отмененный запрос на здоровье не влияет
+    backend_pool.on_start(b)
+    backend_pool.on_finish(b, 0.1, success=None)
+    assert b.healthy and b.consecutive_failures == 0
+
+
+def test_all_breakers_open_rejects_with_shortest_retry_after(pool):
+    backend_pool = pool()
+    for backend in backend_pool.backends:
+        backends.circuit_breakers.get(backend.url)._open()
+    with pytest.raises(CircuitOpen):
+        backend_pool.select()
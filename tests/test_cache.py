@@ -0,0 +1,58 @@
+"""Тесты двухуровневого кэша результатов"""
+import asyncio
+import os
+
+import pytest
+
+from app import config
+from app.services.cache import ResultCache, cache_key
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    """Включает кэш с директорией во временной папке на время теста"""
+    original = config.get_settings()
+    cache = original.cache.model_copy(update={"enabled": True, "dir": str(tmp_path / "cache")})
+    config.replace_settings(original.model_copy(update={"cache": cache}))
+    yield tmp_path
+    config.replace_settings(original)
+
+
+def _video_response(path: str) -> dict:
+    return {"result": {"status": "success", "video_path": path}, "elapsed_time": 1.0}
+
+
+def test_memory_hit_returns_cached_copy(cache_dir):
+    source = cache_dir / "out.mp4"
+    source.write_bytes(b"video")
+
+    async def scenario():
+        cache = ResultCache()
+        key = cache_key("video", {"prompt": "cat"})
+        stored = await cache.set(key, _video_response(str(source)))
+        hit = await cache.get(key)
+        return cache, stored, hit
+
+    cache, stored, hit = asyncio.run(scenario())
+    assert hit["cached"] is True
+    assert hit["result"]["video_path"] == stored["result"]["video_path"] != str(source)
+    assert (cache.hits_memory, cache.misses) == (1, 0)
+
+
+def test_memory_hit_with_deleted_artifact_is_a_miss(cache_dir):
+    source = cache_dir / "out.mp4"
+    source.write_bytes(b"video")
+
+    async def scenario():
+        cache = ResultCache()
+        key = cache_key("video", {"prompt": "cat"})
+        stored = await cache.set(key, _video_response(str(source)))
+        # Копию в кэше удалили в обход кэша (janitor, оператор)
+        os.remove(stored["result"]["video_path"])
+        first, second = await cache.get(key), await cache.get(key)
+        return cache, key, first, second
+
+    cache, key, first, second = asyncio.run(scenario())
+    assert first is None and second is None
+    assert (cache.hits_memory, cache.hits_disk, cache.misses) == (0, 0, 2)
+    assert key not in cache._memory and key not in cache._disk
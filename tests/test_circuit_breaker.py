@@ -0,0 +1,99 @@
+"""Тесты переходов состояний circuit breaker"""
+import time
+
+import pytest
+
+from app import config
+from app.services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+
+
+@pytest.fixture(autouse=True)
+def breaker_settings():
+    """Короткое окно и пауза открытия, чтобы тесты не ждали по 30 секунд"""
+    original = config.get_settings()
+    breaker = original.breaker.model_copy(update={
+        "enabled": True,
+        "window": 60,
+        "min_requests": 4,
+        "error_rate": 0.5,
+        "slow_call_seconds": 1.0,
+        "slow_call_rate": 0.8,
+        "open_seconds": 0.05,
+        "half_open_max_calls": 1,
+    })
+    config.replace_settings(original.model_copy(update={"breaker": breaker}))
+    yield
+    config.replace_settings(original)
+
+
+def _call(breaker: CircuitBreaker, success: bool, latency: float = 0.01):
+    breaker.acquire()
+    breaker.record(success, latency)
+
+
+def test_opens_only_after_min_requests_and_error_rate():
+    breaker = CircuitBreaker("http://gpu-1")
+    for _ in range(3):
+        _call(breaker, success=False)
+    # Окно еще меньше BREAKER_MIN_REQUESTS
+    assert breaker.state == CLOSED
+
+    _call(breaker, success=True)
+    assert breaker.state == OPEN
+    assert breaker.opens == 1
+
+    with pytest.raises(CircuitOpen) as error:
+        breaker.acquire()
+    assert error.value.status_code == 503
+    assert error.value.retry_after >= 1
+    assert breaker.rejected == 1
+
+
+def test_slow_calls_open_breaker():
+    breaker = CircuitBreaker("http://gpu-1")
+    for _ in range(4):
+        _call(breaker, success=True, latency=2.0)
+    assert breaker.state == OPEN
+
+
+def test_half_open_admits_limited_probes_and_closes_on_success():
+    breaker = CircuitBreaker("http://gpu-1")
+    for _ in range(4):
+        _call(breaker, success=False)
+    time.sleep(0.06)
+
+    assert breaker.available()
+    breaker.acquire()
+    assert breaker.state == HALF_OPEN
+    # Пробный слот один: второй запрос отклоняется, пока первый не завершился
+    assert not breaker.available()
+    with pytest.raises(CircuitOpen):
+        breaker.acquire()
+
+    breaker.record(True, 0.01)
+    assert breaker.state == CLOSED
+    assert breaker.snapshot()["window_requests"] == 0
+
+
+def test_failed_or_slow_probe_reopens_breaker():
+    breaker = CircuitBreaker("http://gpu-1")
+    for _ in range(4):
+        _call(breaker, success=False)
+    time.sleep(0.06)
+
+    _call(breaker, success=True, latency=2.0)
+    assert breaker.state == OPEN
+    assert breaker.opens == 2
+
+
+def test_released_probe_frees_the_half_open_slot():
+    breaker = CircuitBreaker("http://gpu-1")
+    for _ in range(4):
+        _call(breaker, success=False)
+    time.sleep(0.06)
+
+    breaker.acquire()
+    # Запрос отменен без результата — слот возвращается, состояние не меняется
+    breaker.release()
+    assert breaker.state == HALF_OPEN
+    breaker.acquire()
@@ -0,0 +1,65 @@
+"""Тесты определения клиентов API и их классов приоритета"""
+import asyncio
+
+import pytest
+
+from app import config
+from app.services import config_reload
+from app.services.clients import ANONYMOUS, BATCH, INTERACTIVE, STANDARD, UNKNOWN, resolve_client
+from app.services.config_reload import ConfigReloader
+
+
+@pytest.fixture
+def client_settings():
+    """Подменяет секцию clients настроек на время теста"""
+    original = config.get_settings()
+
+    def apply(**values):
+        clients = original.clients.model_copy(update=values)
+        config.replace_settings(original.model_copy(update={"clients": clients}))
+
+    yield apply
+    config.replace_settings(original)
+
+
+def test_known_client_is_capped_at_its_max_class(client_settings):
+    client_settings(api_clients="k1=frontend:4:interactive,k2=nightly:1:batch")
+
+    frontend = resolve_client("k1", INTERACTIVE)
+    assert (frontend.id, frontend.weight, frontend.priority_class) == ("frontend", 4.0, INTERACTIVE)
+    assert resolve_client("k2", INTERACTIVE).priority_class == BATCH
+
+
+def test_anonymous_and_unknown_keys_share_capped_clients(client_settings):
+    client_settings(api_clients="k1=frontend:4:interactive", anonymous_max_class=STANDARD)
+
+    anonymous = resolve_client(None, INTERACTIVE)
+    assert (anonymous.id, anonymous.priority_class) == (ANONYMOUS, STANDARD)
+
+    # Случайные ключи не дают новых клиентов (квот и долей очереди)
+    first, second = resolve_client("random-1", INTERACTIVE), resolve_client("random-2", BATCH)
+    assert first.id == second.id == UNKNOWN
+    assert first.weight == 1.0
+    assert (first.priority_class, second.priority_class) == (STANDARD, BATCH)
+    assert "random-1" not in first.label
+
+
+@pytest.mark.parametrize("value", ["k1=frontend:fast", "k1=frontend:1:urgent"])
+def test_invalid_api_clients_is_rejected(tmp_path, value):
+    path = tmp_path / "config.toml"
+    path.write_text(f'[clients]\napi_clients = "{value}"\n')
+    with pytest.raises(ValueError, match="clients.api_clients"):
+        config.load_settings(str(path))
+
+
+def test_invalid_api_clients_reload_keeps_previous_settings(tmp_path, monkeypatch, client_settings):
+    client_settings(api_clients="k1=frontend:4:interactive")
+    path = tmp_path / "config.toml"
+    path.write_text('[clients]\napi_clients = "k1=frontend:4:urgent"\n')
+    monkeypatch.setattr(config_reload, "load_settings", lambda: config.load_settings(str(path)))
+
+    reloader = ConfigReloader()
+    assert asyncio.run(reloader.reload()) is False
+    assert reloader.failures == 1
+    assert config.get_api_clients() == "k1=frontend:4:interactive"
+    assert resolve_client("k1", INTERACTIVE).id == "frontend"
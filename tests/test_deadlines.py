@@ -0,0 +1,44 @@
+"""Тесты разбора и распространения дедлайна запроса"""
+import time
+
+import pytest
+
+from app.services.deadlines import bound_timeout, deadline_var, latest, parse_deadline, remaining
+
+
+def test_parse_deadline_takes_the_earlier_of_both_headers():
+    now = time.time()
+    assert parse_deadline(None, None) is None
+    assert parse_deadline(f"{now + 100}", None) == pytest.approx(now + 100)
+    assert parse_deadline(None, "10") == pytest.approx(now + 10, abs=1)
+    assert parse_deadline(f"{now + 100}", "10") == pytest.approx(now + 10, abs=1)
+    assert parse_deadline(f"{now + 5}", "10") == pytest.approx(now + 5)
+
+
+@pytest.mark.parametrize("deadline, timeout", [("soon", None), (None, "-1"), (None, "0"), ("nan", None), (None, "inf")])
+def test_parse_deadline_rejects_invalid_values(deadline, timeout):
+    with pytest.raises(ValueError):
+        parse_deadline(deadline, timeout)
+
+
+def test_remaining_and_bound_timeout_follow_context_deadline():
+    token = deadline_var.set(None)
+    try:
+        assert remaining() is None
+        assert bound_timeout(30) == 30
+
+        deadline_var.set(time.time() + 5)
+        assert 4 < remaining() <= 5
+        assert 4 < bound_timeout(30) <= 5
+        assert bound_timeout(1) == 1
+        # Явно переданный дедлайн важнее контекста
+        assert remaining(time.time() - 1) < 0
+    finally:
+        deadline_var.reset(token)
+
+
+def test_latest_deadline_of_a_batch():
+    assert latest([10.0, 30.0, 20.0]) == 30.0
+    # Запрос без дедлайна снимает ограничение со всего пакета
+    assert latest([10.0, None]) is None
+    assert latest([]) is None
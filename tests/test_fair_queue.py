@@ -0,0 +1,66 @@
+"""Тесты взвешенной справедливой очереди"""
+from app.services.fair_queue import FairQueue
+
+
+def _drain(queue: FairQueue) -> list:
+    return [queue.pop() for _ in range(len(queue))]
+
+
+def test_new_client_is_not_stuck_behind_a_long_queue():
+    queue = FairQueue()
+    for i in range(5):
+        queue.push(f"a{i}", "a")
+    queue.push("b0", "b")
+    queue.push("b1", "b")
+    # Слоты b начинаются с текущего виртуального времени, а не после хвоста a
+    assert _drain(queue) == ["a0", "b0", "a1", "b1", "a2", "a3", "a4"]
+
+
+def test_clients_are_served_in_proportion_to_weights():
+    queue = FairQueue()
+    for i in range(6):
+        queue.push(f"heavy{i}", "heavy", weight=2)
+        queue.push(f"light{i}", "light", weight=1)
+    first = _drain(queue)[:6]
+    assert sum(item.startswith("heavy") for item in first) == 4
+
+
+def test_priority_class_is_strict():
+    queue = FairQueue()
+    queue.push("batch", "a", priority_class=0)
+    queue.push("standard", "b", priority_class=1)
+    queue.push("interactive", "c", priority_class=2)
+    assert _drain(queue) == ["interactive", "standard", "batch"]
+
+
+def test_item_priority_reorders_only_within_its_client():
+    queue = FairQueue()
+    queue.push("a-low", "a")
+    queue.push("b0", "b")
+    queue.push("a-high", "a", priority=10)
+    # a-high занимает ранний слот своего клиента, но не обходит b, поставленного раньше
+    assert _drain(queue) == ["b0", "a-high", "a-low"]
+
+
+def test_remove_and_depth():
+    queue = FairQueue()
+    queue.push("a0", "a")
+    queue.push("a1", "a")
+    queue.push("b0", "b")
+    assert (queue.depth("a"), queue.depth("b")) == (2, 1)
+
+    assert queue.remove("a0")
+    assert not queue.remove("a0")
+    assert "a0" not in queue and queue.depth("a") == 1
+    assert list(queue) == ["b0", "a1"]
+
+
+def test_empty_queue_forgets_past_consumption():
+    queue = FairQueue()
+    for i in range(3):
+        queue.push(f"a{i}", "a")
+    _drain(queue)
+    # После опустевшей очереди a не расплачивается за прошлые элементы
+    queue.push("b0", "b")
+    queue.push("a3", "a")
+    assert _drain(queue) == ["b0", "a3"]
@@ -0,0 +1,127 @@
+"""Тесты повторов и hedged запросов к апстриму (фейковые апстримы на httpx.MockTransport)"""
+import asyncio
+from typing import Dict, List
+
+import httpx
+import pytest
+
+from app import config
+from app.services import backends, wan_client
+from app.services.backends import BackendPool
+from app.services.circuit_breaker import CircuitBreakerRegistry
+from app.services.http_pool import HTTPClientPool
+from app.services.retries import LatencyTracker, RetryBudget
+
+SLOW, FAST = "http://slow", "http://fast"
+ENDPOINT = "/generate/image"
+
+
+class Upstreams:
+    """Фейковые апстримы: задержка и статус ответа по URL, запись вызовов и отмен"""
+
+    def __init__(self):
+        self.delays: Dict[str, float] = {SLOW: 0.0, FAST: 0.0}
+        self.statuses: Dict[str, int] = {SLOW: 200, FAST: 200}
+        self.calls: List[str] = []
+        self.cancelled: List[str] = []
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        url = f"{request.url.scheme}://{request.url.host}"
+        self.calls.append(url)
+        try:
+            await asyncio.sleep(self.delays[url])
+        except asyncio.CancelledError:
+            self.cancelled.append(url)
+            raise
+        return httpx.Response(self.statuses[url], json={"image": url})
+
+
+@pytest.fixture
+def upstreams(monkeypatch):
+    """Два апстрима, hedged запросы для ENDPOINT и свежее состояние пула, breaker'ов и бюджета"""
+    original = config.get_settings()
+
+    def apply(**values):
+        upstream = original.upstream.model_copy(update={
+            "api_urls": f"{SLOW},{FAST}",
+            "lb_strategy": "round_robin",
+            "health_interval": 0,
+            "hedge_endpoints": ENDPOINT,
+            "hedge_min_delay": 0.05,
+            "retry_backoff": 0.01,
+            **values,
+        })
+        config.replace_settings(original.model_copy(update={"upstream": upstream, "mock_mode": False}))
+
+        fake = Upstreams()
+        pool = HTTPClientPool()
+        monkeypatch.setattr(pool, "_build_client", lambda: httpx.AsyncClient(transport=httpx.MockTransport(fake.handle)))
+        breakers = CircuitBreakerRegistry()
+        monkeypatch.setattr(wan_client, "http_pool", pool)
+        monkeypatch.setattr(wan_client, "circuit_breakers", breakers)
+        monkeypatch.setattr(backends, "circuit_breakers", breakers)
+        monkeypatch.setattr(wan_client, "backend_pool", BackendPool())
+        monkeypatch.setattr(wan_client, "retry_budget", RetryBudget())
+        latency = LatencyTracker()
+        for _ in range(20):
+            latency.observe(ENDPOINT, 0.01)
+        monkeypatch.setattr(wan_client, "upstream_latency", latency)
+        return fake
+
+    yield apply
+    config.replace_settings(original)
+
+
+def test_hedge_wins_and_slow_primary_is_cancelled(upstreams):
+    fake = upstreams()
+    fake.delays[SLOW] = 5.0
+
+    response = asyncio.run(wan_client._make_request(ENDPOINT, {"prompt": "cat"}))
+
+    assert response["result"] == {"image": FAST}
+    assert response["hedged"] is True
+    assert fake.calls == [SLOW, FAST]
+    assert fake.cancelled == [SLOW]
+    budget = wan_client.retry_budget.snapshot()
+    assert (budget["hedges"], budget["hedge_wins"]) == (1, 1)
+
+
+def test_primary_answering_first_cancels_the_hedge(upstreams):
+    fake = upstreams()
+    fake.delays[SLOW] = 0.15
+    fake.delays[FAST] = 5.0
+
+    response = asyncio.run(wan_client._make_request(ENDPOINT, {"prompt": "cat"}))
+
+    assert response["result"] == {"image": SLOW}
+    assert "hedged" not in response
+    assert fake.cancelled == [FAST]
+    assert wan_client.retry_budget.hedge_wins == 0
+
+
+def test_exhausted_budget_disables_hedges_and_retries(upstreams):
+    fake = upstreams(retry_budget_min=0, retry_budget_ratio=0)
+    fake.delays[SLOW] = 0.15
+
+    response = asyncio.run(wan_client._make_request(ENDPOINT, {"prompt": "cat"}))
+    assert response["result"] == {"image": SLOW}
+    assert fake.calls == [SLOW]
+
+    fake.statuses[FAST] = 503
+    response = asyncio.run(wan_client._make_request(ENDPOINT, {"prompt": "cat"}))
+    # Второй запрос ушел в FAST по round robin, получил 503 и не повторялся
+    assert "error" in response and "retries" not in response
+    assert fake.calls == [SLOW, FAST]
+    assert wan_client.retry_budget.exhausted == 2
+
+
+def test_retryable_status_is_retried_on_another_backend(upstreams):
+    fake = upstreams(hedge_endpoints="")
+    fake.statuses[SLOW] = 503
+
+    response = asyncio.run(wan_client._make_request(ENDPOINT, {"prompt": "cat"}))
+
+    assert response["result"] == {"image": FAST}
+    assert response["retries"] == 1
+    assert fake.calls == [SLOW, FAST]
+    assert wan_client.retry_budget.retries == 1
@@ -0,0 +1,65 @@
+"""Тесты реестра общих HTTP клиентов"""
+import asyncio
+
+import pytest
+
+from app import config
+import app.services.http_pool as http_pool_module
+from app.services.http_pool import HTTPClientPool
+
+
+@pytest.fixture
+def upstream_settings():
+    """Подменяет секцию upstream настроек на время теста"""
+    original = config.get_settings()
+
+    def apply(**values):
+        upstream = original.upstream.model_copy(update=values)
+        config.replace_settings(original.model_copy(update={"upstream": upstream}))
+
+    yield apply
+    config.replace_settings(original)
+
+
+def test_startup_creates_backend_clients(upstream_settings):
+    upstream_settings(api_urls="http://gpu-1:8000|2, http://gpu-2:8000/")
+
+    async def scenario():
+        pool = HTTPClientPool()
+        pool.startup()
+        try:
+            assert set(pool._clients) == {"http://gpu-1:8000", "http://gpu-2:8000"}
+            client = pool._clients["http://gpu-1:8000"]
+            assert pool.get_client("http://gpu-1:8000") is client
+            assert pool.snapshot()["adhoc_clients"] == 0
+        finally:
+            await pool.shutdown()
+        assert client.is_closed
+
+    asyncio.run(scenario())
+
+
+def test_adhoc_clients_are_bounded_and_evicted_lru(upstream_settings, monkeypatch):
+    upstream_settings(api_urls="http://gpu-1:8000")
+    monkeypatch.setattr(http_pool_module, "_MAX_ADHOC_CLIENTS", 2)
+    monkeypatch.setattr(http_pool_module, "_RETIRE_POLL_INTERVAL", 0)
+
+    async def scenario():
+        pool = HTTPClientPool()
+        pool.startup()
+        try:
+            first = pool.get_client("http://adhoc-1")
+            second = pool.get_client("http://adhoc-2")
+            # Обращение делает adhoc-1 недавним, поэтому вытесняется adhoc-2
+            assert pool.get_client("http://adhoc-1") is first
+            pool.get_client("http://adhoc-3")
+            assert list(pool._adhoc) == ["http://adhoc-1", "http://adhoc-3"]
+            await asyncio.gather(*pool._retiring)
+            assert second.is_closed
+            assert not first.is_closed
+            assert set(pool._clients) == {"http://gpu-1:8000"}
+        finally:
+            await pool.shutdown()
+        assert first.is_closed
+
+    asyncio.run(scenario())
@@ -0,0 +1,172 @@
+"""Тесты сборки пакетов заданий видео (JobManager с фейковым генератором)"""
+import asyncio
+import time
+from typing import Any, Dict, List, Tuple
+
+import pytest
+
+from app import config
+from app.services.clients import BATCH, INTERACTIVE, STANDARD, Client
+from app.services.job_store import JobStore
+from app.services.jobs import SUCCEEDED, JobManager
+
+
+@pytest.fixture
+def video_settings():
+    """Подменяет секцию video настроек на время теста"""
+    original = config.get_settings()
+
+    def apply(**values):
+        video = original.video.model_copy(update=values)
+        config.replace_settings(original.model_copy(update={"video": video}))
+
+    yield apply
+    config.replace_settings(original)
+
+
+class RecordingGenerator:
+    """Фейковый генератор: записывает пакеты и ждет открытия gate"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.batches: List[List[str]] = []
+        self.started: List[float] = []
+        self.gate = asyncio.Event()
+
+    async def generate(self, prompt: str, on_event=None, **_) -> Dict[str, Any]:
+        return (await self._run([prompt]))[0]
+
+    async def generate_batch(self, items: List[Dict[str, Any]], on_events) -> List[Dict[str, Any]]:
+        return await self._run([item["prompt"] for item in items])
+
+    async def _run(self, prompts: List[str]) -> List[Dict[str, Any]]:
+        self.batches.append(prompts)
+        self.started.append(time.monotonic())
+        await self.gate.wait()
+        return [{"result": {"prompt": prompt}} for prompt in prompts]
+
+    def batch_capacity(self, params: Dict[str, Any]) -> int:
+        return self.capacity
+
+
+def _manager(generator: RecordingGenerator) -> JobManager:
+    return JobManager(
+        generator=generator.generate,
+        batch_generator=generator.generate_batch,
+        batch_capacity=generator.batch_capacity,
+        store=JobStore(),
+    )
+
+
+def _params(prompt: str, size: str = "1280*704") -> Dict[str, Any]:
+    return {"prompt": prompt, "size": size, "cache": False}
+
+
+async def _submit_all(manager: JobManager, items: List[Tuple[str, str, Client]]):
+    return [await manager.submit(_params(prompt, size), client=client) for prompt, size, client in items]
+
+
+def test_batches_follow_priority_and_group_only_compatible_jobs(video_settings):
+    video_settings(batch_max_size=3, batch_max_delay=0.05)
+
+    async def scenario():
+        generator = RecordingGenerator(capacity=3)
+        manager = _manager(generator)
+        await manager.start(workers=1)
+        try:
+            # Исполнитель занят, пока остальные задания ставятся в очередь
+            blocker = await manager.submit(_params("block", "832*480"))
+            while not generator.batches:
+                await asyncio.sleep(0.01)
+
+            nightly = Client("nightly", priority_class=BATCH)
+            service = Client("service", priority_class=STANDARD)
+            frontend = Client("frontend", priority_class=INTERACTIVE)
+            jobs = await _submit_all(manager, [
+                ("b1", "1280*704", nightly),
+                ("s1", "1280*704", service),
+                ("s2", "704*1280", service),
+                ("i1", "704*1280", frontend),
+                ("i2", "1280*704", frontend),
+            ])
+            generator.gate.set()
+            await asyncio.wait_for(asyncio.gather(blocker.wait(), *(job.wait() for job in jobs)), 5)
+            assert all(job.status == SUCCEEDED for job in jobs)
+            assert all(job.result["result"]["prompt"] == job.params["prompt"] for job in jobs)
+        finally:
+            await manager.stop()
+        return generator.batches, manager.batches
+
+    batches, batch_count = asyncio.run(scenario())
+    # Первым идет пакет самого приоритетного задания (i1), в него попадают только задания
+    # того же размера; внутри пакета — порядок справедливой очереди
+    assert batches == [["block"], ["i1", "s2"], ["i2", "s1", "b1"]]
+    assert batch_count == 2
+
+
+def test_batch_size_is_limited_by_max_size_and_capacity(video_settings):
+    video_settings(batch_max_size=2, batch_max_delay=0.05)
+
+    async def scenario(capacity: int) -> List[List[str]]:
+        generator = RecordingGenerator(capacity=capacity)
+        manager = _manager(generator)
+        await manager.start(workers=1)
+        try:
+            blocker = await manager.submit(_params("block", "832*480"))
+            while not generator.batches:
+                await asyncio.sleep(0.01)
+            jobs = [await manager.submit(_params(f"p{i}")) for i in range(5)]
+            generator.gate.set()
+            await asyncio.wait_for(asyncio.gather(blocker.wait(), *(job.wait() for job in jobs)), 5)
+        finally:
+            await manager.stop()
+        return generator.batches[1:]
+
+    # VIDEO_BATCH_MAX_SIZE меньше того, что принимают воркеры
+    assert asyncio.run(scenario(capacity=10)) == [["p0", "p1"], ["p2", "p3"], ["p4"]]
+    # Воркеры без пакетных заданий
+    assert asyncio.run(scenario(capacity=1)) == [["p0"], ["p1"], ["p2"], ["p3"], ["p4"]]
+
+
+def test_batch_waits_for_max_delay_from_first_job(video_settings):
+    video_settings(batch_max_size=4, batch_max_delay=0.3)
+
+    async def scenario() -> Tuple[List[List[str]], float]:
+        generator = RecordingGenerator(capacity=4)
+        generator.gate.set()
+        manager = _manager(generator)
+        await manager.start(workers=1)
+        try:
+            submitted = time.monotonic()
+            first = await manager.submit(_params("p0"))
+            await asyncio.sleep(0.1)
+            second = await manager.submit(_params("p1"))
+            await asyncio.wait_for(asyncio.gather(first.wait(), second.wait()), 5)
+        finally:
+            await manager.stop()
+        return generator.batches, generator.started[0] - submitted
+
+    batches, waited = asyncio.run(scenario())
+    # Второе задание успело в пакет, а пакет ушел не раньше VIDEO_BATCH_MAX_DELAY, но и не сильно позже
+    assert batches == [["p0", "p1"]]
+    assert 0.3 <= waited < 0.6
+
+
+def test_full_batch_does_not_wait_for_max_delay(video_settings):
+    video_settings(batch_max_size=2, batch_max_delay=5)
+
+    async def scenario() -> float:
+        generator = RecordingGenerator(capacity=2)
+        generator.gate.set()
+        manager = _manager(generator)
+        await manager.start(workers=1)
+        try:
+            submitted = time.monotonic()
+            jobs = [await manager.submit(_params(f"p{i}")) for i in range(2)]
+            await asyncio.wait_for(asyncio.gather(*(job.wait() for job in jobs)), 2)
+        finally:
+            await manager.stop()
+        assert generator.batches == [["p0", "p1"]]
+        return generator.started[0] - submitted
+
+    assert asyncio.run(scenario()) < 0.5
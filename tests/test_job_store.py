@@ -0,0 +1,72 @@
+"""Тесты пакетной записи заданий (JobStoreWriter)"""
+import asyncio
+from typing import Any, Dict, List
+
+from app.services.job_store import JobStore, JobStoreWriter
+
+
+class FakeJob:
+    def __init__(self, job_id: str, status: str = "queued"):
+        self.id = job_id
+        self.status = status
+
+    def to_record(self) -> Dict[str, Any]:
+        return {"job_id": self.id, "status": self.status}
+
+
+class FlakyStore(JobStore):
+    """Хранилище, которое первые failures записей завершает ошибкой"""
+
+    def __init__(self, failures: int = 1):
+        self.failures = failures
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self.deleted: List[str] = []
+
+    def write(self, records: List[Dict[str, Any]], deleted: List[str]):
+        if self.failures > 0:
+            self.failures -= 1
+            raise OSError("disk I/O error")
+        for record in records:
+            self.records[record["job_id"]] = record
+        self.deleted.extend(deleted)
+
+
+def test_failed_write_is_retried_on_next_flush():
+    store = FlakyStore(failures=1)
+    writer = JobStoreWriter(store)
+    job = FakeJob("a")
+    writer.save(job)
+    writer.delete("b")
+
+    asyncio.run(writer.flush())
+    assert writer.errors == 1
+    assert writer.snapshot()["pending_writes"] == 2
+    assert store.records == {}
+
+    job.status = "completed"
+    asyncio.run(writer.flush())
+    assert store.records == {"a": {"job_id": "a", "status": "completed"}}
+    assert store.deleted == ["b"]
+    assert writer.snapshot()["pending_writes"] == 0
+
+
+def test_newer_changes_win_over_failed_batch():
+    store = FlakyStore(failures=1)
+    writer = JobStoreWriter(store)
+    writer.save(FakeJob("a"))
+    writer.delete("b")
+
+    async def flush_with_concurrent_changes():
+        flush = asyncio.create_task(writer.flush())
+        # Пока пакет пишется в потоке, задание a удаляется, а b снова сохраняется
+        await asyncio.sleep(0)
+        writer.delete("a")
+        writer.save(FakeJob("b", status="running"))
+        await flush
+
+    asyncio.run(flush_with_concurrent_changes())
+    assert writer.errors == 1
+
+    asyncio.run(writer.flush())
+    assert store.records == {"b": {"job_id": "b", "status": "running"}}
+    assert store.deleted == ["a"]
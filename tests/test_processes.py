@@ -0,0 +1,57 @@
+"""Тесты запуска процессов генерации в собственной группе"""
+import os
+import signal
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Имитация шлюза: запускает "генерацию" так же, как wan_client, и печатает ее PID
+_GATEWAY = textwrap.dedent("""
+    import asyncio, sys
+
+    from app.services.processes import bound_command, process_group_kwargs
+
+    async def main():
+        child = await asyncio.create_subprocess_exec(
+            *bound_command([sys.executable, "-c", "import time; time.sleep(60)"]), **process_group_kwargs()
+        )
+        print(child.pid, flush=True)
+        await asyncio.sleep(60)
+
+    asyncio.run(main())
+""")
+
+
+def _alive(pid: int) -> bool:
+    # Осиротевший процесс после смерти может остаться зомби, если init его не забрал
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            return stat.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="PR_SET_PDEATHSIG есть только в Linux")
+def test_generation_process_dies_with_killed_gateway():
+    gateway = subprocess.Popen([sys.executable, "-c", _GATEWAY], stdout=subprocess.PIPE, text=True, cwd=_ROOT)
+    child = None
+    try:
+        child = int(gateway.stdout.readline())
+        assert _alive(child)
+        gateway.send_signal(signal.SIGKILL)
+        gateway.wait()
+
+        deadline = time.monotonic() + 5
+        while _alive(child) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert not _alive(child)
+    finally:
+        gateway.kill()
+        gateway.wait()
+        if child is not None and _alive(child):
+            os.kill(child, signal.SIGKILL)
@@ -0,0 +1,114 @@
+"""Тесты объединения одинаковых одновременных вызовов (SingleFlight)"""
+import asyncio
+import time
+
+import pytest
+
+from app.services.admission import DeadlineExceeded
+from app.services.deadlines import deadline_var
+from app.services.wan_client import SingleFlight
+
+
+class Execution:
+    """Фейковое выполнение: считает запуски, публикует событие и ждет gate"""
+
+    def __init__(self):
+        self.calls = 0
+        self.cancelled = False
+        self.started = asyncio.Event()
+        self.gate = asyncio.Event()
+
+    async def __call__(self, emit) -> dict:
+        self.calls += 1
+        self.started.set()
+        try:
+            emit({"event": "log", "line": "step"})
+            await self.gate.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return {"result": "video"}
+
+
+def test_concurrent_calls_share_one_execution():
+    async def scenario():
+        flight, execution = SingleFlight(), Execution()
+        events = [[], []]
+        first = asyncio.create_task(flight.do("k", execution, listener=events[0].append))
+        await execution.started.wait()
+        second = asyncio.create_task(flight.do("k", execution, listener=events[1].append))
+        await asyncio.sleep(0)
+        execution.gate.set()
+        results = await asyncio.gather(first, second)
+        return flight, execution, events, results
+
+    flight, execution, events, (first, second) = asyncio.run(scenario())
+    assert execution.calls == 1
+    assert first == second == {"result": "video"}
+    # Каждый вызывающий получает свою копию ответа
+    assert first is not second
+    # Второй присоединился после публикации события и его не получил
+    assert events == [[{"event": "log", "line": "step"}], []]
+    assert flight.snapshot() == {"in_flight": 0, "executions": 1, "coalesced": 1, "separate_deadline": 0}
+
+
+def test_cancelling_one_caller_keeps_execution_for_the_others():
+    async def scenario():
+        flight, execution = SingleFlight(), Execution()
+        first = asyncio.create_task(flight.do("k", execution))
+        await execution.started.wait()
+        second = asyncio.create_task(flight.do("k", execution))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        assert not execution.cancelled
+        execution.gate.set()
+        return execution, await second
+
+    execution, result = asyncio.run(scenario())
+    assert result == {"result": "video"}
+    assert execution.calls == 1 and not execution.cancelled
+
+
+def test_execution_is_cancelled_when_every_caller_gives_up():
+    async def scenario():
+        flight, execution = SingleFlight(), Execution()
+        callers = [asyncio.create_task(flight.do("k", execution)) for _ in range(2)]
+        await execution.started.wait()
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+        # Следующий вызов запускает новое выполнение
+        execution.gate.set()
+        result = await flight.do("k", execution)
+        return flight, execution, result
+
+    flight, execution, result = asyncio.run(scenario())
+    assert execution.cancelled
+    assert execution.calls == 2
+    assert result == {"result": "video"}
+    assert flight.snapshot()["in_flight"] == 0
+
+
+def test_later_deadline_runs_separately_and_earlier_deadline_times_out():
+    async def scenario():
+        flight, execution = SingleFlight(), Execution()
+        deadline_var.set(time.time() + 0.2)
+        owner = asyncio.create_task(flight.do("k", execution))
+        await execution.started.wait()
+
+        # Без дедлайна нельзя ждать выполнение, ограниченное дедлайном запустившего
+        deadline_var.set(None)
+        separate = asyncio.create_task(flight.do("k", execution))
+        await asyncio.sleep(0)
+        assert execution.calls == 2
+
+        with pytest.raises(DeadlineExceeded):
+            await owner
+        execution.gate.set()
+        return flight, await separate
+
+    flight, result = asyncio.run(scenario())
+    assert result == {"result": "video"}
+    assert flight.separate == 1
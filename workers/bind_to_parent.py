@@ -0,0 +1,34 @@
+"""
+Запуск скрипта генерации, привязанного к жизни шлюза (только Linux)
+
+Шлюз запускает generate.py и резидентные воркеры в собственной группе
+процессов, поэтому сигнал, убивший шлюз, до них не доходит. Обертка
+просит ядро прислать процессу SIGKILL при завершении родителя
+(PR_SET_PDEATHSIG) и заменяет себя интерпретатором с переданными
+аргументами: PID и привязка сохраняются.
+
+    python bind_to_parent.py <pid шлюза> generate.py --task ti2v-5B ...
+
+Используется только стандартная библиотека: обертка выполняется
+интерпретатором WAN_PYTHON_PATH.
+"""
+import ctypes
+import os
+import signal
+import sys
+
+# prctl(2): сигнал, который процесс получит при завершении родителя
+_PR_SET_PDEATHSIG = 1
+
+
+def main():
+    parent = int(sys.argv[1])
+    ctypes.CDLL(None, use_errno=True).prctl(_PR_SET_PDEATHSIG, signal.SIGKILL)
+    # Шлюз мог умереть до вызова prctl
+    if os.getppid() != parent:
+        sys.exit(1)
+    os.execv(sys.executable, [sys.executable, *sys.argv[2:]])
+
+
+if __name__ == "__main__":
+    main()
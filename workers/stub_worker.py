@@ -0,0 +1,75 @@
+"""
+Заглушка резидентного видео воркера для тестов и локальной разработки
+
+Говорит по тому же протоколу, что и workers/wan_worker.py, но вместо
+генерации ждет STUB_WORKER_DELAY секунд и пишет пустой .mp4 файл.
+С --batch (VIDEO_WORKER_BATCH=true) объявляет поддержку пакетных заданий.
+Промпт "crash" завершает процесс, чтобы проверить перезапуск воркера.
+
+    export VIDEO_WORKER_MODE=resident
+    export VIDEO_WORKER_SCRIPT=workers/stub_worker.py
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+
+def _send(message):
+    sys.stdout.write(json.dumps(message, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--task", default="ti2v-5B")
+    parser.add_argument("--ckpt_dir", default="")
+    parser.add_argument("--wan_dir", default=os.getcwd())
+    parser.add_argument("--batch", action="store_true")
+    args, _ = parser.parse_known_args()
+
+    delay = float(os.getenv("STUB_WORKER_DELAY", "1"))
+    load_delay = float(os.getenv("STUB_WORKER_LOAD_DELAY", "0.5"))
+    output_dir = os.getenv("STUB_WORKER_OUTPUT_DIR", os.getcwd())
+
+    time.sleep(load_delay)
+    _send({"event": "ready", "batch": args.batch})
+
+    def generate(job, job_id, on_log):
+        steps = 5
+        for step in range(1, steps + 1):
+            time.sleep(delay / steps)
+            on_log(f"{step * 100 // steps}%| | {step}/{steps} [00:00<00:00]")
+        save_file = job.get("save_file") or os.path.join(output_dir, f"stub_{job_id}.mp4")
+        with open(save_file, "wb"):
+            pass
+        video_path = os.path.abspath(save_file)
+        return {"status": "success", "video_path": video_path, "stdout": f"Saving generated video to {video_path}"}
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        job = json.loads(line)
+        job_id = job.get("id")
+
+        if "batch" in job:
+            results = []
+            for index, item in enumerate(job["batch"]):
+                if item.get("prompt") == "crash":
+                    sys.exit(1)
+                results.append(generate(
+                    item,
+                    f"{job_id}_{index}",
+                    lambda text, index=index: _send({"id": job_id, "event": "log", "index": index, "line": text}),
+                ))
+            _send({"id": job_id, "event": "done", "status": "success", "results": results})
+            continue
+
+        if job.get("prompt") == "crash":
+            sys.exit(1)
+        result = generate(job, job_id, lambda text: _send({"id": job_id, "event": "log", "line": text}))
+        _send({"id": job_id, "event": "done", **result})
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Резидентный воркер генерации видео WAN2.2
+
+Загружает модель один раз и выполняет задания, поступающие JSON строками
+через stdin. Протокол описан в app/services/video_workers.py.
+
+Запускается шлюзом интерпретатором WAN_PYTHON_PATH из директории Wan2.2:
+    python wan_worker.py --task ti2v-5B --ckpt_dir ./Wan2.2-TI2V-5B --wan_dir ../Wan2.2
+
+Задания содержат только промпт, поэтому поддерживаются задачи генерации
+из текста: ti2v-* (WanTI2V) и t2v-* (WanT2V), как их выбирает generate.py.
+Остальные задачи (i2v, s2v, animate) требуют входных файлов и отклоняются
+при запуске.
+"""
+import argparse
+import json
+import os
+import sys
+import traceback
+from datetime import datetime
+
+
+def _open_protocol_stream():
+    """
+    Забирает настоящий stdout под протокол, а sys.stdout перенаправляет в stderr,
+    чтобы print() внутри wan не ломал JSON строки
+    """
+    protocol = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8", buffering=1)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+    return protocol
+
+
+def _send(stream, message):
+    stream.write(json.dumps(message, ensure_ascii=False) + "\n")
+    stream.flush()
+
+
+# Префикс задачи -> класс пайплайна wan
+_PIPELINES = {"ti2v-": "WanTI2V", "t2v-": "WanT2V"}
+
+
+def _pipeline_class(task):
+    for prefix, name in _PIPELINES.items():
+        if task.startswith(prefix):
+            return name
+    return None
+
+
+def _default_save_file(task, size, prompt):
+    formatted_time = datetime.now().strftime("%Y%m%d_%H%M%S")
+    formatted_prompt = prompt.replace(" ", "_").replace("/", "_")[:50]
+    return f"{task}_{size.replace('*', 'x')}_{formatted_prompt}_{formatted_time}.mp4"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--task", default="ti2v-5B")
+    parser.add_argument("--ckpt_dir", required=True)
+    parser.add_argument("--wan_dir", default=os.getcwd())
+    parser.add_argument("--device_id", type=int, default=0)
+    # WanTI2V генерирует по одному промпту: пакет выполнялся бы подряд без выигрыша,
+    # поэтому пакетные задания объявляются только для пайплайна с настоящим батчингом
+    parser.add_argument("--batch", action="store_true", help="Объявить поддержку пакетных заданий")
+    args = parser.parse_args()
+    pipeline_class = _pipeline_class(args.task)
+    if pipeline_class is None:
+        supported = ", ".join(prefix + "*" for prefix in _PIPELINES)
+        parser.error(f"задача {args.task} не поддерживается воркером, допустимы: {supported}")
+
+    protocol = _open_protocol_stream()
+
+    sys.path.insert(0, args.wan_dir)
+    import wan
+    from wan.configs import MAX_AREA_CONFIGS, SIZE_CONFIGS, WAN_CONFIGS
+    from wan.utils.utils import save_video
+
+    cfg = WAN_CONFIGS[args.task]
+    pipeline = getattr(wan, pipeline_class)(
+        config=cfg,
+        checkpoint_dir=args.ckpt_dir,
+        device_id=args.device_id,
+        rank=0,
+        t5_fsdp=False,
+        dit_fsdp=False,
+        use_sp=False,
+        t5_cpu=True,
+        convert_model_dtype=True,
+    )
+    _send(protocol, {"event": "ready", "batch": args.batch})
+
+    def generate(job, on_log):
+        size = job.get("size", "1280*704")
+        save_file = job.get("save_file") or _default_save_file(args.task, size, job["prompt"])
+        on_log(f"Generating video: size={size}")
+
+        # WanTI2V принимает изображение и площадь кадра, WanT2V — только размер
+        inputs = {"img": None, "max_area": MAX_AREA_CONFIGS[size]} if pipeline_class == "WanTI2V" else {}
+        video = pipeline.generate(
+            job["prompt"],
+            size=SIZE_CONFIGS[size],
+            **inputs,
+            frame_num=job.get("frame_num", cfg.frame_num),
+            shift=cfg.sample_shift,
+            sample_solver="unipc",
+            sampling_steps=job.get("sampling_steps", cfg.sample_steps),
+            guide_scale=cfg.sample_guide_scale,
+            seed=job.get("seed", -1),
+            offload_model=True,
+        )
+        save_video(
+            tensor=video[None],
+            save_file=save_file,
+            fps=cfg.sample_fps,
+            nrow=1,
+            normalize=True,
+            value_range=(-1, 1),
+        )
+        del video
+
+        video_path = os.path.abspath(save_file)
+        return {
+            "status": "success",
+            "video_path": video_path,
+            "stdout": f"Saving generated video to {video_path}",
+        }
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        job = json.loads(line)
+        job_id = job.get("id")
+
+        if "batch" in job:
+            # Без --batch шлюз пакеты не присылает; обработка оставлена для совместимости протокола
+            results = []
+            for index, item in enumerate(job["batch"]):
+                def on_log(text, index=index):
+                    _send(protocol, {"id": job_id, "event": "log", "index": index, "line": text})
+                try:
+                    results.append(generate(item, on_log))
+                except Exception as e:
+                    traceback.print_exc()
+                    results.append({"status": "error", "error": str(e)})
+            _send(protocol, {"id": job_id, "event": "done", "status": "success", "results": results})
+            continue
+
+        try:
+            result = generate(job, lambda text: _send(protocol, {"id": job_id, "event": "log", "line": text}))
+            _send(protocol, {"id": job_id, "event": "done", **result})
+        except Exception as e:
+            traceback.print_exc()
+            _send(protocol, {"id": job_id, "event": "done", "status": "error", "error": str(e)})
+
+if __name__ == "__main__":
+    main()